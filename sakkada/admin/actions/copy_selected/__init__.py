@@ -2,9 +2,43 @@ from django.contrib import messages
 from django.contrib.admin import helpers
 from django.contrib.admin.utils import model_ngettext
 from django.core.exceptions import PermissionDenied
+from django.http import Http404
+from django.shortcuts import redirect, render
 from django.template.response import TemplateResponse
+from django.template.defaultfilters import filesizeformat
+from django.urls import reverse
+from django.urls.exceptions import NoReverseMatch
 from django.utils.translation import gettext as _, gettext_lazy
-from .utils import get_copied_objects
+
+# note: utils and jobs modules (and Collector with contenttypes models) are
+#       imported inside functions to allow to add this package to
+#       INSTALLED_APPS (for templates and "copy_selected_job" command)
+
+
+def get_exceeded_limits(modeladmin, estimate):
+    """
+    Check copying estimate with modeladmin limits: "copy_selected_max_rows",
+    "copy_selected_max_bytes" and "copy_selected_max_queries" (None values
+    or absent attributes mean no limit). Return list of exceeded limits.
+    Files with unknown size (see Collector.estimate) are not counted.
+    """
+    if estimate is None:
+        return []
+
+    exceeded = []
+    limits = (
+        ('rows', estimate.total_rows, _('objects'), str,),
+        ('bytes', estimate.bytes, _('files size'), filesizeformat,),
+        ('queries', estimate.queries, _('queries'), str,),
+    )
+    for name, value, title, formatter in limits:
+        limit = getattr(modeladmin, 'copy_selected_max_%s' % name, None)
+        if limit is not None and value > limit:
+            exceeded.append(_('%(title)s %(value)s (limit is %(limit)s)') % {
+                'title': title, 'value': formatter(value),
+                'limit': formatter(limit),
+            })
+    return exceeded
 
 
 # original - django.contrib.admin.actions.delete_selected (v2.1.0)
@@ -18,29 +52,50 @@ def copy_selected(modeladmin, request, queryset):
 
     Next, it copies all selected objects and redirects back to the change list.
     """
+    from .utils import get_copied_objects
+
     opts = modeladmin.model._meta
     app_label = opts.app_label
+    bulk = getattr(modeladmin, 'copy_selected_bulk', False)
+
+    # The user has already confirmed the copying and it is executed in
+    # background: collecting, permissions and limits checks are done by job.
+    executor = getattr(modeladmin, 'copy_selected_executor', None)
+    if request.POST.get('post') and executor:
+        return copy_selected_in_background(modeladmin, request, queryset,
+                                           executor, bulk=bulk)
 
     # Populate creatable_objects, a data structure of all related objects that
     # will also be created.
     creatable_objects, model_count, perms_needed, collector = get_copied_objects(
         queryset, request, modeladmin.admin_site,
-        handlers=getattr(modeladmin, 'copy_selected_handlers', None)
+        handlers=getattr(modeladmin, 'copy_selected_handlers', None),
+        limit=getattr(modeladmin, 'copy_selected_max_nodes', 1000)
     )
 
+    # Estimate copying cost and check it with modeladmin limits.
+    sizes = getattr(modeladmin, 'copy_selected_estimate_sizes', 'local')
+    estimate = collector.estimate(bulk=bulk, sizes=sizes) if collector else None
+    limits_exceeded = get_exceeded_limits(modeladmin, estimate)
+
     # The user has already confirmed the deletion.
     # Do the creation and return None to display the change list view again.
     if request.POST.get('post'):
         if perms_needed:
             raise PermissionDenied
+        if limits_exceeded:
+            modeladmin.message_user(
+                request, _("Copying is too large: %(limits)s.") % {
+                    "limits": '; '.join(limits_exceeded),
+                }, messages.ERROR)
+            return None
         n = queryset.count()
         if n:
             for obj in queryset:
-                change_message = modeladmin.construct_change_message(
-                    request, None, None, True)
-                modeladmin.log_addition(request, obj, change_message)
+                modeladmin.log_addition(request, obj, [{'added': {}}])
+
             # copy all objects with related objects
-            collector.copy()
+            collector.copy(bulk=bulk)
             modeladmin.message_user(
                 request, _("Successfully created %(count)d %(items)s.") % {
                     "count": n, "items": model_ngettext(modeladmin.opts, n)
@@ -63,6 +118,8 @@ def copy_selected(modeladmin, request, queryset):
         'model_count': dict(model_count).items(),
         'queryset': queryset,
         'perms_lacking': perms_needed,
+        'copy_estimate': estimate,
+        'limits_exceeded': limits_exceeded,
         'opts': opts,
         'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
         'media': modeladmin.media,
@@ -82,5 +139,64 @@ def copy_selected(modeladmin, request, queryset):
     )
 
 
+def copy_selected_in_background(modeladmin, request, queryset, executor,
+                                bulk=False):
+    """
+    Schedule copying of the selected objects by "copy_selected_executor".
+    Request does only cheap check of selected objects count with
+    "copy_selected_max_rows" limit, all objects collecting with
+    permissions and limits checks are done by job (see CopyJob.run).
+    """
+    from .jobs import CopyJob
+
+    n = queryset.count()
+    limit = getattr(modeladmin, 'copy_selected_max_rows', None)
+    if limit is not None and n > limit:
+        modeladmin.message_user(
+            request, _("Copying is too large: %(limits)s.") % {
+                "limits": _('%(title)s %(value)s (limit is %(limit)s)') % {
+                    'title': _('objects'), 'value': n, 'limit': limit,
+                },
+            }, messages.ERROR)
+        return None
+    if not n:
+        return None
+
+    for obj in queryset:
+        modeladmin.log_addition(request, obj, [{'added': {}}])
+
+    # copy all objects with related objects in background
+    job = CopyJob.create(modeladmin, request, queryset, bulk=bulk)
+    executor.submit(job)
+    modeladmin.message_user(
+        request, _("Copying of %(count)d %(items)s is scheduled.") % {
+            "count": n, "items": model_ngettext(modeladmin.opts, n)
+        }, messages.SUCCESS)
+    try:
+        return redirect(reverse(
+            '%s:copy_selected_status' % modeladmin.admin_site.name,
+            args=(job.id,)))
+    except NoReverseMatch:
+        return None
+
+
 copy_selected.allowed_permissions = ('add',)
 copy_selected.short_description = gettext_lazy('Copy selected %(verbose_name_plural)s')
+
+
+def copy_selected_status_view(request, job_id, template_name=None,
+                              extra_context=None, admin_site=None):
+    """Status page of background copy_selected job."""
+    from .jobs import CopyJob
+
+    job = CopyJob.get(job_id)
+    if job is None:
+        raise Http404(_('Copy job does not exist or is expired.'))
+    if not (request.user.is_superuser or request.user.pk == job.user_id):
+        raise PermissionDenied
+
+    context = {'title': _("Copying status"), 'job': job,}
+    context.update(admin_site.each_context(request) if admin_site else {})
+    context.update(**(extra_context or {}))
+    template_name = template_name or ('admin/copy_selected_status.html',)
+    return render(request, template_name, context)
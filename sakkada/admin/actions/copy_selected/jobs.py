@@ -0,0 +1,224 @@
+"""
+Background execution of copy_selected action.
+
+Copy job serialises selected objects pks, model label, admin site name and
+handlers keys, stores its state in django cache and runs copying outside
+of the request by pluggable executor. On run, handlers are taken from the
+registered ModelAdmin again (keys should be the same), objects are
+collected, checked with user add permissions and ModelAdmin limits and
+copied by Collector, progress is stored in job state.
+
+Executors:
+-   ThreadExecutor  - run jobs in local thread pool of current process
+-   ProcessExecutor - run each job in a new process by "copy_selected_job"
+                      management command (requires shared cache backend and
+                      "sakkada.admin.actions.copy_selected" in INSTALLED_APPS)
+"""
+
+import os
+import sys
+import uuid
+import subprocess
+from concurrent.futures import ThreadPoolExecutor as PoolExecutor
+from django.apps import apps
+from django.contrib.admin.sites import all_sites
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.http import HttpRequest
+from sakkada.models.copying import Collector
+from . import get_exceeded_limits
+
+
+class CopyJob:
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    cache_alias = 'default'
+    cache_prefix = 'sakkada.copy_selected.job'
+    cache_timeout = 60 * 60 * 24
+
+    fields = ('id', 'model', 'pks', 'handlers', 'admin_site', 'using',
+              'bulk', 'user_id', 'status', 'total', 'done', 'error',)
+
+    def __init__(self, id=None, model=None, pks=None, handlers=None,
+                 admin_site=None, using=None, bulk=False, user_id=None,
+                 status=STATUS_PENDING, total=0, done=0, error=None):
+        self.id = id or uuid.uuid4().hex
+        self.model = model  # "{app_label}.{model_name}"
+        self.pks = pks or []
+        self.handlers = handlers or []  # sorted handlers keys
+        self.admin_site = admin_site
+        self.using = using
+        self.bulk = bulk
+        self.user_id = user_id
+        self.status = status
+        self.total = total
+        self.done = done
+        self.error = error
+
+    def __repr__(self):
+        return '<CopyJob: %s (%s)>' % (self.id, self.status,)
+
+    @classmethod
+    def create(cls, modeladmin, request, queryset, bulk=False):
+        """
+        Create and save job for copy_selected action, objects are not
+        collected, so total is unknown until job is run.
+        """
+        opts = queryset.model._meta
+        job = cls(
+            model=opts.label_lower,
+            pks=[str(pk) for pk in queryset.values_list('pk', flat=True)],
+            handlers=sorted(getattr(modeladmin, 'copy_selected_handlers',
+                                    None) or {}),
+            admin_site=modeladmin.admin_site.name,
+            using=queryset.db, bulk=bulk, user_id=request.user.pk,
+        )
+        job.save()
+        return job
+
+    @classmethod
+    def get_cache(cls):
+        return caches[cls.cache_alias]
+
+    @classmethod
+    def get_cache_key(cls, id):
+        return '%s:%s' % (cls.cache_prefix, id,)
+
+    @classmethod
+    def get(cls, id):
+        """Get job by id from cache or None if it does not exist."""
+        data = cls.get_cache().get(cls.get_cache_key(id))
+        return cls(**data) if data else None
+
+    def save(self):
+        self.get_cache().set(self.get_cache_key(self.id),
+                             {name: getattr(self, name) for name in self.fields},
+                             self.cache_timeout)
+
+    @property
+    def finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED,)
+
+    @property
+    def percent(self):
+        return int(self.done * 100 / self.total) if self.total else 0
+
+    def get_modeladmin(self):
+        model = apps.get_model(self.model)
+        for site in all_sites:
+            if site.name == self.admin_site:
+                return site._registry.get(model)
+        return None
+
+    def check(self, modeladmin, collector):
+        """
+        Check collected objects with add permissions of job user (if set)
+        and with ModelAdmin limits (see get_exceeded_limits).
+        """
+        if self.user_id is not None:
+            request = HttpRequest()
+            request.user = get_user_model()._default_manager.get(
+                pk=self.user_id)
+            registry = modeladmin.admin_site._registry
+            perms_needed = sorted(
+                str(model._meta.verbose_name) for model in collector.data
+                if model in registry and
+                not registry[model].has_add_permission(request))
+            if perms_needed:
+                raise PermissionDenied('Permission to add %s is required.' %
+                                       ', '.join(perms_needed))
+
+        sizes = getattr(modeladmin, 'copy_selected_estimate_sizes', 'local')
+        exceeded = get_exceeded_limits(
+            modeladmin, collector.estimate(bulk=self.bulk, sizes=sizes))
+        if exceeded:
+            raise ValueError('Copying is too large: %s.' % '; '.join(exceeded))
+
+    def progress(self, model, count):
+        self.done += count
+        self.save()
+
+    def run(self):
+        """Collect and copy objects, save status on each step."""
+        try:
+            modeladmin = self.get_modeladmin()
+            if modeladmin is None:
+                raise LookupError('ModelAdmin for "%s" model is not found '
+                                  'in "%s" admin site.' % (self.model,
+                                                           self.admin_site,))
+            handlers = getattr(modeladmin, 'copy_selected_handlers', None)
+            if sorted(handlers or {}) != self.handlers:
+                raise ValueError('Copy handlers are changed since job '
+                                 'creation, job is cancelled.')
+
+            model = modeladmin.model
+            queryset = model._base_manager.using(self.using).filter(
+                pk__in=[model._meta.pk.to_python(pk) for pk in self.pks])
+            collector = Collector(using=self.using, handlers=handlers)
+            collector.collect(queryset)
+            self.check(modeladmin, collector)
+
+            self.status, self.done = self.STATUS_RUNNING, 0
+            self.total = sum(len(objs) for objs in collector.data.values())
+            self.save()
+
+            collector.copy(bulk=self.bulk, progress=self.progress)
+        except Exception as e:
+            self.status, self.error = self.STATUS_FAILED, str(e)
+        else:
+            self.status = self.STATUS_DONE
+        self.save()
+        return self
+
+
+class BaseExecutor:
+    def submit(self, job):
+        raise NotImplementedError
+
+
+class ThreadExecutor(BaseExecutor):
+    """Run jobs in thread pool (shared by all instances) of this process."""
+
+    pool = None
+    max_workers = 2
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or self.max_workers
+
+    def get_pool(self):
+        if ThreadExecutor.pool is None:
+            ThreadExecutor.pool = PoolExecutor(max_workers=self.max_workers)
+        return ThreadExecutor.pool
+
+    def submit(self, job):
+        return self.get_pool().submit(self.run, job)
+
+    def run(self, job):
+        try:
+            job.run()
+        finally:
+            # close connections opened by this thread
+            connections.close_all()
+
+
+class ProcessExecutor(BaseExecutor):
+    """Run each job in a new "copy_selected_job" command process."""
+
+    def get_command(self, job):
+        return [sys.executable, '-m', 'django', 'copy_selected_job', job.id]
+
+    def get_env(self):
+        env = os.environ.copy()
+        env['PYTHONPATH'] = os.pathsep.join(p for p in sys.path if p)
+        return env
+
+    def submit(self, job):
+        return subprocess.Popen(
+            self.get_command(job), env=self.get_env(),
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL, start_new_session=True)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from sakkada.admin.actions.copy_selected.jobs import CopyJob
+
+
+class Command(BaseCommand):
+    help = "Run pending copy_selected background jobs by their ids."
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_ids', nargs='+', help="Copy jobs ids.")
+
+    def handle(self, *args, **options):
+        for job_id in options['job_ids']:
+            job = CopyJob.get(job_id)
+            if job is None:
+                self.stderr.write('Copy job "%s" does not exist.' % job_id)
+                continue
+            if job.status != CopyJob.STATUS_PENDING:
+                self.stderr.write('Copy job "%s" is already %s.' %
+                                  (job_id, job.status,))
+                continue
+            job.run()
+            self.stdout.write('Copy job "%s" is %s%s.' % (
+                job_id, job.status, job.error and ': %s' % job.error or '',))
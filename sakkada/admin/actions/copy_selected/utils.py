@@ -4,18 +4,21 @@ from django.contrib.admin.utils import quote
 from django.urls import reverse
 from django.urls.exceptions import NoReverseMatch
 from django.utils.html import format_html
+from django.utils.formats import number_format
 from django.utils.text import capfirst
+from django.utils.translation import gettext as _
 from sakkada.models.copying import Collector
 
 
 # original - django.contrib.admin.utils.get_deleted_objects (v2.1.x)
-def get_copied_objects(objs, request, admin_site, handlers=None):
+def get_copied_objects(objs, request, admin_site, handlers=None, limit=None):
     """
     Find all objects related to ``objs`` that should also be copied. ``objs``
     must be a homogeneous iterable of objects (e.g. a QuerySet).
 
     Return a nested list of strings suitable for display in the
-    template with the ``unordered_list`` filter.
+    template with the ``unordered_list`` filter, at most ``limit`` objects
+    are displayed if it is set.
 
     Fixed: do not return protected, return collector instead
     """
@@ -29,6 +32,11 @@ def get_copied_objects(objs, request, admin_site, handlers=None):
     collector.collect(objs)
     perms_needed = set()
 
+    for model in collector.model_objs:
+        if (model in admin_site._registry and
+                not admin_site._registry[model].has_add_permission(request)):
+            perms_needed.add(model._meta.verbose_name)
+
     def format_callback(obj):
         model = obj.__class__
         has_admin = model in admin_site._registry
@@ -37,8 +45,6 @@ def get_copied_objects(objs, request, admin_site, handlers=None):
         no_edit_link = '%s: %s' % (capfirst(opts.verbose_name), obj)
 
         if has_admin:
-            if not admin_site._registry[model].has_add_permission(request):
-                perms_needed.add(opts.verbose_name)
             try:
                 admin_url = reverse('%s:%s_%s_change'
                                     % (admin_site.name,
@@ -59,7 +65,7 @@ def get_copied_objects(objs, request, admin_site, handlers=None):
             # admin or is edited inline.
             return no_edit_link
 
-    to_copy = collector.nested(format_callback)
+    to_copy = collector.nested(format_callback, limit=limit)
 
     model_count = {model._meta.verbose_name_plural: len(objs)
                    for model, objs in collector.model_objs.items()}
@@ -69,39 +75,102 @@ def get_copied_objects(objs, request, admin_site, handlers=None):
 
 # original - django.contrib.admin.utils.NestedObjects (v2.1.x)
 class NestedObjects(Collector):
+    """
+    Collector, which also builds graph of collected objects for rendering.
+    Graph nodes are (concrete_model, pk) pairs, edges are built from raw
+    relation values (field.attname) of already collected objects, so
+    related objects are never fetched for edges building.
+    """
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.edges = {}  # {from_instance: [to_instances]}
+        self.edges = {}  # {from_node: [to_nodes]}
+        self.nodes = {}  # {node: instance}
         self.model_objs = defaultdict(set)
 
+    def get_node(self, model, pk):
+        return (model._meta.concrete_model, pk,)
+
     def add_edge(self, source, target):
         self.edges.setdefault(source, []).append(target)
 
+    def get_relation_field(self, model, name):
+        """Get concrete forward relation field of 'model' by field name or
+        by related query name (name of relation from the other side)."""
+        for field in model._meta.concrete_fields:
+            if field.is_relation and name in (field.name,
+                                              field.remote_field.name,):
+                return field
+        return None
+
+    def get_target_pks(self, field, targets, values=()):
+        """
+        Map raw values of relation 'field' to pks of related objects. Values
+        are taken from already collected 'targets', missing 'values' of
+        non-pk target field are resolved with one in_bulk query.
+        """
+        target_field = field.target_field
+        pks = {getattr(obj, target_field.attname): obj.pk for obj in targets}
+        missing = {value for value in values
+                   if value is not None and value not in pks}
+        if missing and target_field.primary_key:
+            pks.update((value, value) for value in missing)
+        elif missing:
+            queryset = field.remote_field.model._base_manager.using(self.using)
+            pks.update((value, obj.pk) for value, obj in queryset.in_bulk(
+                missing, field_name=target_field.name).items())
+        return pks
+
     def collect(self, objs, source=None, source_attr=None, **kwargs):
+        objs = list(objs)
+        nodes = []
         for obj in objs:
-            if source_attr and not source_attr.endswith('+'):
-                related_name = source_attr % {
-                    'class': source._meta.model_name,
-                    'app_label': source._meta.app_label,
-                }
-                self.add_edge(getattr(obj, related_name), obj)
-            else:
-                self.add_edge(None, obj)
-            self.model_objs[obj._meta.model].add(obj)
+            node = self.get_node(obj.__class__, obj.pk)
+            if node not in self.nodes:
+                self.nodes[node] = obj
+                self.model_objs[obj._meta.model].add(obj)
+            nodes.append(node)
+
+        field, reverse = None, kwargs.get('reverse_dependency', False)
+        if source_attr and not source_attr.endswith('+') and objs:
+            related_name = source_attr % {
+                'class': source._meta.model_name,
+                'app_label': source._meta.app_label,
+            }
+            field = self.get_relation_field(
+                source if reverse else objs[0].__class__, related_name)
+
+        if field is None:
+            for node in nodes:
+                self.add_edge(None, node)
+        elif reverse:
+            # objs are referenced by already collected source objects
+            pks = self.get_target_pks(field, objs)
+            for obj in self.data.get(source, ()):
+                value = getattr(obj, field.attname)
+                if value in pks:
+                    self.add_edge(self.get_node(source, obj.pk),
+                                  self.get_node(field.remote_field.model,
+                                                pks[value]))
+        else:
+            # objs reference source objects
+            values = [getattr(obj, field.attname) for obj in objs]
+            pks = self.get_target_pks(field, self.data.get(source, ()),
+                                      values)
+            for node, value in zip(nodes, values):
+                self.add_edge(self.get_node(source, pks.get(value)), node)
+
         return super().collect(objs, source=source, source_attr=source_attr,
                                **kwargs)
 
-    def related_objects(self, related, objs):
-        qs = super().related_objects(related, objs)
-        return qs.select_related(related.field.name)
-
-    def _nested(self, obj, seen, format_callback):
-        if obj in seen:
+    def _nested(self, node, seen, format_callback, limit):
+        if node in seen or (limit is not None and len(seen) >= limit):
             return []
-        seen.add(obj)
+        seen.add(node)
         children = []
-        for child in self.edges.get(obj, ()):
-            children.extend(self._nested(child, seen, format_callback))
+        for child in self.edges.get(node, ()):
+            children.extend(self._nested(child, seen, format_callback, limit))
+        obj = self.nodes[node]
         if format_callback:
             ret = [format_callback(obj)]
         else:
@@ -110,12 +179,18 @@ class NestedObjects(Collector):
             ret.append(children)
         return ret
 
-    def nested(self, format_callback=None):
+    def nested(self, format_callback=None, limit=None):
         """
-        Return the graph as a nested list.
+        Return the graph as a nested list. If 'limit' is set, only first
+        'limit' objects are returned, followed by "and N more..." string.
         """
         seen = set()
         roots = []
         for root in self.edges.get(None, ()):
-            roots.extend(self._nested(root, seen, format_callback))
+            roots.extend(self._nested(root, seen, format_callback, limit))
+        more = len(self.nodes) - len(seen)
+        if limit is not None and more > 0:
+            roots.append(_('and %(count)s more\u2026') % {
+                'count': number_format(more, force_grouping=True),
+            })
         return roots
@@ -90,17 +90,25 @@ Default on_copy handlers:
 -   ManyToOneRel backward field - CASCADE
 """
 
-import mimetypes
+import os
+import shutil
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from operator import attrgetter
-from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.signals import setting_changed
 from django.db import models, connections, transaction
 from django.db.models import (
     OneToOneField, OneToOneRel,
     ForeignKey, ManyToOneRel,
     ManyToManyField, ManyToManyRel)
+from django.db.models.signals import class_prepared
 from django.contrib.contenttypes.fields import (
     GenericRelation, GenericRel,
     GenericForeignKey)
+from django.contrib.contenttypes.models import ContentType
 
 
 # on_copy handlers
@@ -173,9 +181,76 @@ IGNORABLE_FIELDS = (
 )
 
 
+class CyclicDependencyError(ValueError):
+    """Raised if collected models can not be sorted by dependencies."""
+
+
+# process-wide LRU cache of copy plans {(collector_class, model, handlers): plan},
+# bounded, because handlers created per call (e.g. SET closures) are new keys
+COPY_PLANS = OrderedDict()
+COPY_PLANS_SIZE = 256
+COPY_PLANS_LOCK = threading.Lock()
+
+
+def clear_copy_plans(**kwargs):
+    """Clear copy plans cache, connected to app registry changes signals."""
+    if kwargs.get('setting', 'INSTALLED_APPS') == 'INSTALLED_APPS':
+        with COPY_PLANS_LOCK:
+            COPY_PLANS.clear()
+
+
+class_prepared.connect(clear_copy_plans)
+setting_changed.connect(clear_copy_plans)
+
+
+class FileCopyTask:
+    """Scheduled file copying: source file name and reserved copy name."""
+
+    def __init__(self, instance, field, storage, source, name):
+        self.instance = instance
+        self.field = field
+        self.storage = storage
+        self.source = source
+        self.name = name
+
+    def __repr__(self):
+        return '<FileCopyTask: %s -> %s>' % (self.source, self.name,)
+
+
+class FilesCopyResult:
+    """Result of files copying: copied tasks and failed (task, error)."""
+
+    def __init__(self):
+        self.copied = []
+        self.failed = []
+
+    def __bool__(self):
+        return not self.failed
+
+
+class CopyEstimate:
+    """
+    Estimated cost of copying: rows count per model, files count and
+    total files size in bytes (files with unknown size are counted in
+    "unsized") and approximate count of write queries.
+    """
+
+    def __init__(self):
+        self.rows = {}  # {model: count}
+        self.files = 0
+        self.bytes = 0
+        self.unsized = 0
+        self.queries = 0
+
+    @property
+    def total_rows(self):
+        return sum(self.rows.values())
+
+
 class Collector:
     field_on_copy = None
     field_updates = None
+    files_result = None
 
     def __init__(self, using, handlers=None):
         self.using = using
@@ -190,6 +265,20 @@ class Collector:
         # Proxy models are represented here by their concrete parent.
         self.dependencies = {}  # {model: {models}}
 
+        # Relations, which values are set after all objects are copied,
+        # deferred to break dependencies cycles (see sort), deferred
+        # values of objects being copied and pks of collected objects of
+        # concrete models, only relations to them are deferred (see copy).
+        self.deferred_fields = {}  # {model: {fields}}
+        self.deferred_values = None  # {model: [(instance, {field: value})]}
+        self.collected_pks = None  # {model: {pks}}
+
+        # Values of not primary key fields, which are targets of relations
+        # (to_field), of objects being copied: original values and mapping
+        # of original values to values of copies (see copy).
+        self.target_values = None  # {id(instance): {field: value}}
+        self.old_new_values = None  # {field: {old_value: new_value}}
+
     def add(self, objs, source=None, reverse_dependency=False):
         """
         Add 'objs' to the collection of objects to be copied. If the call is
@@ -275,9 +364,14 @@ class Collector:
             return []
 
         model = field.remote_field.model
-        values = [getattr(obj, field.name, None) for obj in objs]
-        values = {obj.pk for obj in values if obj}
-        result = []
+        if field.concrete and field.target_field.primary_key:
+            # take raw values to prevent related objects fetching
+            values = {getattr(obj, field.attname) for obj in objs}
+            values.discard(None)
+        else:
+            values = [getattr(obj, field.name, None) for obj in objs]
+            values = {obj.pk for obj in values if obj}
+        values, result = list(values), []
 
         batches = self.get_connection_batches(values, field)
         for batch in batches:
@@ -338,153 +432,737 @@ class Collector:
 
         model = new_objs[0].__class__
 
-        CANDIDATES = {
-            'parents': model._meta.concrete_model._meta.parents.values(),
-            'forward': self.get_candidate_relations_forward(model._meta),
-            'backward': self.get_candidate_relations_backward(model._meta),
-            'private': self.get_candidate_relations_private(model._meta),
-        }
-
-        for field in model._meta.get_fields(include_hidden=True):
-            # ManyToManyField and ManyToManyRel and GenericRel are ignored
-            if ((not field.is_relation and field.primary_key) or
-                    isinstance(field, IGNORABLE_FIELDS)):
-                continue
-
-            key = self.get_key_for_field(field)
-            on_copy = self.field_on_copy.get(key, None)
-
+        for kind, field, on_copy in self.get_copy_plan(model):
             # Parents OneToOneField relations (forward 1-1).
             # Recursively collect concrete model's parent models (Multi
             # Table Inherited models, collect by "{model}_ptr" fields).
             # Parent objects will be created first, before inherited.
-            # Default handler is CASCADE_SELF.
-            if field in CANDIDATES['parents']:
+            if kind == 'parent':
                 parent_objs = self.get_forward_relations(new_objs, field)
-                on_copy = on_copy or CASCADE_SELF
                 on_copy(self, field, parent_objs, self.using,
                         reverse_dependency=True)
+                continue
 
-            if (on_copy == DO_NOTHING or
-                    (not collect_related and field.is_relation)):
+            if not collect_related and field.is_relation:
                 continue
 
             # Forward OneToOneField, ForeingKey or GenericForeignKey fields
             # (forward 1-1, N-1).
-            # There is no default handler value, they are ignored by default.
-            if field in CANDIDATES['forward'] and on_copy:
+            if kind == 'forward':
                 related_objs = self.get_forward_relations(new_objs, field)
                 on_copy(self, field, related_objs, self.using,
                         reverse_dependency=True)
 
             # Backward OneToOneRel and ManyToOneRel fields (backward 1-1, 1-N).
-            # Default handler is CASCADE.
-            elif field in CANDIDATES['backward']:
-                on_copy = on_copy or CASCADE
+            elif kind == 'backward':
                 sub_objs = self.get_backward_relations(new_objs, field)
                 on_copy(self, field.remote_field, sub_objs, self.using,
                         reverse_dependency=False)
 
             # GenericRelation with "bulk_related_objects" (1-N)
-            # Default handler is CASCADE.
-            elif field in CANDIDATES['private']:
+            elif kind == 'private':
                 # It's something like generic foreign key.
                 sub_objs = field.bulk_related_objects(new_objs, self.using)
-                on_copy = on_copy or CASCADE
                 on_copy(self, field, sub_objs, self.using,
                         reverse_dependency=False)
 
             # Any non-relational field
-            # There is no default handler value, they are ignored by default.
-            elif not field.is_relation and on_copy:
+            elif kind == 'field':
                 on_copy(self, field, None, self.using, reverse_dependency=True)
 
+    # copy plan section
+    def get_copy_plan(self, model):
+        """
+        Get copy plan for 'model' from process-wide LRU cache (at most
+        COPY_PLANS_SIZE plans), keyed by collector class, model and handlers.
+        Cache is cleared with any app registry changes (see clear_copy_plans).
+        Unhashable handlers disable caching.
+        """
+        try:
+            key = (self.__class__, model,
+                   frozenset(self.field_on_copy.items()),)
+        except TypeError:
+            return self.build_copy_plan(model)
+        with COPY_PLANS_LOCK:
+            plan = COPY_PLANS.get(key, None)
+            if plan is not None:
+                COPY_PLANS.move_to_end(key)
+                return plan
+        plan = self.build_copy_plan(model)
+        with COPY_PLANS_LOCK:
+            COPY_PLANS[key] = plan
+            while len(COPY_PLANS) > COPY_PLANS_SIZE:
+                COPY_PLANS.popitem(last=False)
+        return plan
+
+    def build_copy_plan(self, model):
+        """
+        Build copy plan for 'model' - tuple of (kind, field, on_copy) items,
+        where kind is one of 'parent', 'forward', 'backward', 'private' or
+        'field', and on_copy is resolved handler (with default value).
+        """
+        opts = model._meta
+        candidates = {
+            'parents': opts.concrete_model._meta.parents.values(),
+            'forward': self.get_candidate_relations_forward(opts),
+            'backward': self.get_candidate_relations_backward(opts),
+            'private': self.get_candidate_relations_private(opts),
+        }
+
+        plan = []
+        for field in opts.get_fields(include_hidden=True):
+            # ManyToManyField and ManyToManyRel and GenericRel are ignored
+            if ((not field.is_relation and field.primary_key) or
+                    isinstance(field, IGNORABLE_FIELDS)):
+                continue
+
+            key = self.get_key_for_field(field)
+            on_copy = self.field_on_copy.get(key, None)
+
+            # Parents OneToOneField relations, default handler is CASCADE_SELF.
+            if field in candidates['parents']:
+                plan.append(('parent', field, on_copy or CASCADE_SELF,))
+                continue
+
+            if on_copy == DO_NOTHING:
+                continue
+
+            # Forward relational fields, there is no default handler value,
+            # they are ignored by default.
+            if field in candidates['forward'] and on_copy:
+                plan.append(('forward', field, on_copy,))
+
+            # Backward relational fields, default handler is CASCADE.
+            elif field in candidates['backward']:
+                plan.append(('backward', field, on_copy or CASCADE,))
+
+            # GenericRelation fields, default handler is CASCADE.
+            elif field in candidates['private']:
+                plan.append(('private', field, on_copy or CASCADE,))
+
+            # Any non-relational field, there is no default handler value,
+            # they are ignored by default.
+            elif not field.is_relation and on_copy:
+                plan.append(('field', field, on_copy,))
+
+        return tuple(plan)
+
     # generating section
     def sort(self):
-        """Sort collected objects by relations dependencies."""
+        """
+        Sort collected objects by relations dependencies with topological
+        (Kahn's) sort of concrete models, each model is copied before models,
+        which depend on it. Self dependencies are ignored (nullable self
+        relations are deferred, other are remapped in pk order). Cycles are
+        broken by deferring nullable relations if possible, else
+        CyclicDependencyError is raised.
+        """
+        concrete_models = {}  # {concrete_model: [models]}
+        for model in self.data:
+            concrete_models.setdefault(model._meta.concrete_model,
+                                       []).append(model)
+        order = {model: i for i, model in enumerate(concrete_models)}
+
+        def get_dependencies(model):
+            deps = self.dependencies.get(model, ())
+            return sorted((dep for dep in deps
+                           if dep is not model and dep in order),
+                          key=order.get)
+
+        incoming = dict.fromkeys(concrete_models, 0)
+        for model in concrete_models:
+            for dep in get_dependencies(model):
+                incoming[dep] += 1
+
+        queue = deque(model for model in concrete_models if not incoming[model])
         sorted_models = []
-        concrete_models = set()
-        models = list(self.data)
-        while len(sorted_models) < len(models):
-            found = False
-            for model in models:
-                if model in sorted_models:
+        while queue:
+            model = queue.popleft()
+            sorted_models.extend(concrete_models[model])
+            for dep in get_dependencies(model):
+                incoming[dep] -= 1
+                if not incoming[dep]:
+                    queue.append(dep)
+
+        if len(sorted_models) < len(self.data):
+            cyclic = {model for model, count in incoming.items() if count}
+            if self.break_cycles(cyclic):
+                return self.sort()
+            raise CyclicDependencyError(
+                'Copying dependencies between models contain cycle: %s.' %
+                ', '.join(sorted(model._meta.label for model in cyclic)))
+        self.data = {model: self.data[model] for model in sorted_models}
+
+    def sort_instances(self, model, instances):
+        """
+        Sort 'instances' of 'model' by pk, if model relates to itself with
+        deferrable fields, related instances are placed before instances
+        referencing them (parents before children), so relation values are
+        deferred only for instances in cycles.
+        """
+        instances = sorted(instances, key=attrgetter('pk'))
+        concrete_model = model._meta.concrete_model
+        fields = [f for f in self.get_deferred_fields(model)
+                  if f.remote_field.model._meta.concrete_model is concrete_model]
+        if not fields:
+            return instances
+
+        pks = {instance.pk: instance for instance in instances}
+        ordered, seen = [], set()
+        for instance in instances:
+            stack = [(instance, False,)]
+            while stack:
+                instance, visited = stack.pop()
+                if visited:
+                    ordered.append(instance)
+                    continue
+                if instance.pk in seen:
                     continue
-                deps = self.dependencies.get(model._meta.concrete_model)
-                if not (deps and deps.difference(concrete_models)):
-                    sorted_models.append(model)
-                    concrete_models.add(model._meta.concrete_model)
-                    found = True
-            if not found:
-                return
-        self.data = {model: self.data[model] for model in sorted_models[::-1]}
-
-    def get_uploaded_file_from_path(self, path, quiet=True):
+                seen.add(instance.pk)
+                stack.append((instance, True,))
+                for field in reversed(fields):
+                    related = pks.get(getattr(instance, field.attname))
+                    if related is not None and related.pk not in seen:
+                        stack.append((related, False,))
+        return ordered
+
+    def break_cycles(self, models):
+        """
+        Try to break dependencies cycles between concrete 'models' by
+        deferring nullable relations (see get_deferred_fields): dependency
+        of model on related model is removed, if all relations between them
+        are deferrable. Return True if any dependency is removed.
+        """
+        # leave only models in cycles: drop models without dependants
+        models = set(models)
+        while True:
+            leafs = {model for model in models
+                     if not (self.dependencies.get(model, set()) & models) -
+                     {model}}
+            if not leafs:
+                break
+            models -= leafs
+
+        broken = False
+        for model in models:
+            relations = {}
+            for field in getattr(model._meta, 'concrete_fields', ()):
+                if field.is_relation and (field.many_to_one or
+                                          field.one_to_one):
+                    target = field.remote_field.model._meta.concrete_model
+                    if target is not model and target in models:
+                        relations.setdefault(target, []).append(field)
+            for target, fields in relations.items():
+                if (model in self.dependencies.get(target, ()) and
+                        all(self.is_deferrable(f) for f in fields)):
+                    self.dependencies[target].discard(model)
+                    self.deferred_fields.setdefault(model, set()).update(
+                        fields)
+                    broken = True
+        return broken
+
+    def is_deferrable(self, field):
+        """Check if relation field value can be set after objects copying."""
+        return bool(
+            field.is_relation and field.concrete and field.null and
+            (field.many_to_one or field.one_to_one) and
+            field.target_field.primary_key and
+            not field.remote_field.parent_link)
+
+    def get_deferred_fields(self, model):
+        """
+        Get relation fields of 'model', which values are set after all
+        objects are copied (inserted with null values and then updated), if
+        related objects are not copied yet (see defer_related_values):
+        nullable self relations (e.g. "parent" in trees) and relations
+        deferred to break dependencies cycles.
+        """
+        opts = model._meta
+        deferred = self.deferred_fields.get(opts.concrete_model, ())
+        return [
+            f for f in opts.concrete_fields
+            if f in deferred or (
+                self.is_deferrable(f) and
+                f.remote_field.model._meta.concrete_model is opts.concrete_model)
+        ]
+
+    def defer_related_values(self, instance, old_new_pk_registry):
+        """
+        Unset deferred relation values and save them for update. Only values
+        of collected, but not yet copied related objects are deferred: values
+        of copied ones are remapped before saving (e.g. tree nodes are saved
+        with copied parents, so save methods, calculating tree fields by
+        parent, work as usual) and values of not collected ones are kept.
+        """
+        if self.deferred_values is None:
+            return
+        values = {}
+        for field in self.get_deferred_fields(instance.__class__):
+            value = getattr(instance, field.attname)
+            target = field.remote_field.model._meta.concrete_model
+            if value in self.collected_pks.get(target, ()) and (
+                    value not in old_new_pk_registry.get(target, {})):
+                values[field] = value
+                setattr(instance, field.attname, None)
+        if values:
+            self.deferred_values.setdefault(instance.__class__, []).append(
+                (instance, values,))
+
+    def update_deferred_values(self, old_new_pk_registry):
+        """
+        Set deferred relation values of copied objects: remapped to copied
+        objects if related object is copied too, else original values.
+        Objects of each model are updated with bulk_update (UPDATE ... CASE).
+        """
+        for model, items in self.deferred_values.items():
+            fields, objs = set(), []
+            for instance, values in items:
+                for field, value in values.items():
+                    target = field.remote_field.model._meta.concrete_model
+                    setattr(instance, field.attname, old_new_pk_registry.get(
+                        target, {}).get(value, value))
+                    fields.add(field.name)
+                objs.append(instance)
+            model._base_manager.using(self.using).bulk_update(
+                objs, sorted(fields))
+
+    def get_target_fields(self):
+        """
+        Get not primary key fields of collected models, which are targets
+        of relations (to_field) of collected models: {concrete_model: {fields}}.
+        """
+        targets = {}
+        for model in self.data:
+            for field in model._meta.concrete_fields:
+                if (field.is_relation and (field.many_to_one or field.one_to_one) and
+                        not field.target_field.primary_key):
+                    targets.setdefault(field.remote_field.model._meta.concrete_model,
+                                       set()).add(field.target_field)
+        return {model: fields for model, fields in targets.items()
+                if any(m._meta.concrete_model is model for m in self.data)}
+
+    def save_target_values(self):
+        """Save original values of relations targets of collected objects."""
+        targets = self.get_target_fields()
+        for model, instances in self.data.items():
+            fields = targets.get(model._meta.concrete_model, ())
+            for instance in (instances if fields else ()):
+                self.target_values[id(instance)] = {
+                    field: getattr(instance, field.attname) for field in fields}
+
+    def register_target_values(self, instance):
+        """Register mapping of original to copied relations targets values."""
+        for field, value in self.target_values.pop(id(instance), {}).items():
+            if value is not None:
+                self.old_new_values.setdefault(field, {})[value] = getattr(
+                    instance, field.attname)
+
+    def can_copy_file_locally(self, storage):
+        """
+        Check if files of 'storage' can be copied directly on filesystem.
+        Direct copying bypasses storage saving and naming logic, so it is
+        allowed only for storages, that do not redefine it.
+        """
+        cls = storage.__class__
+        return isinstance(storage, FileSystemStorage) and all(
+            getattr(cls, name) is getattr(FileSystemStorage, name)
+            for name in ('save', '_save', 'get_available_name',))
+
+    def reserve_file_name(self, fieldfile):
+        """
+        Reserve name for a copy of 'fieldfile' file. For plain
+        FileSystemStorage an empty placeholder file is saved by storage,
+        for any other storage only available name is returned.
+        """
+        field, storage = fieldfile.field, fieldfile.storage
+        name = field.generate_filename(fieldfile.instance,
+                                       os.path.basename(fieldfile.name))
+        if self.can_copy_file_locally(storage):
+            return storage.save(name, ContentFile(b''),
+                                max_length=field.max_length)
+        return storage.get_available_name(name, max_length=field.max_length)
+
+    def copy_file_content(self, storage, source, name):
+        """
+        Copy content of 'source' file into file with reserved 'name'.
+        Content is never loaded into memory: plain FileSystemStorage files
+        are copied by shutil.copyfile (kernel side copy where available),
+        any other storage gets file opened by its "open" method and saves
+        it by chunks (IOError is raised if storage changed reserved name).
+        """
+        if self.can_copy_file_locally(storage):
+            shutil.copyfile(storage.path(source), storage.path(name))
+            return
+        with storage.open(source, 'rb') as content:
+            saved = storage.save(name, content)
+        if saved != name:
+            raise IOError('File "%s" is saved as "%s".' % (name, saved,))
+
+    def copy_file(self, fieldfile, quiet=True):
+        """
+        Copy file of 'fieldfile' and return name of the copy (None if copying
+        failed and 'quiet' is True).
+        """
+        field, storage = fieldfile.field, fieldfile.storage
         try:
-            with open(path, 'rb') as image:
-                file = SimpleUploadedFile(image.name, image.read())
-                file.content_type = mimetypes.guess_type(path)[0]
-        except IOError:
+            if self.can_copy_file_locally(storage):
+                name = self.reserve_file_name(fieldfile)
+                try:
+                    self.copy_file_content(storage, fieldfile.name, name)
+                except OSError:
+                    storage.delete(name)
+                    raise
+            else:
+                name = field.generate_filename(
+                    fieldfile.instance, os.path.basename(fieldfile.name))
+                with storage.open(fieldfile.name, 'rb') as content:
+                    name = storage.save(name, content,
+                                        max_length=field.max_length)
+        except OSError:
             if not quiet:
                 raise
-            file = None
-        return file
+            name = None
+        return name
+
+    def prepare_files(self):
+        """
+        Reserve names for copies of all collected files and set them to
+        instances, return list of FileCopyTask (files are not copied yet).
+        Fields with scheduled field updates are skipped.
+        """
+        tasks = []
+        for model, instances in self.data.items():
+            updates = self.field_updates.get(model, {})
+            fields = [f for f in model._meta.concrete_fields
+                      if isinstance(f, models.FileField) and f not in updates]
+            for instance in (instances if fields else ()):
+                for field in fields:
+                    fieldfile = getattr(instance, field.name, None)
+                    if not fieldfile:
+                        continue
+                    task = FileCopyTask(instance, field, fieldfile.storage,
+                                        fieldfile.name, None)
+                    try:
+                        task.name = self.reserve_file_name(fieldfile)
+                    except OSError as e:
+                        self.files_result.failed.append((task, e,))
+                        continue
+                    setattr(instance, field.attname, task.name)
+                    tasks.append(task)
+        return tasks
+
+    def run_files_copying(self, tasks, workers=None, revert=False,
+                          restore=False):
+        """
+        Copy files content for all 'tasks' in thread pool with at most
+        'workers' threads, register results in files_result. If 'revert'
+        is True, failed instances get their original file name back, if
+        'restore' is True, it is also saved into already inserted rows.
+        """
+        failed = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(self.copy_file_content,
+                                task.storage, task.source, task.name): task
+                for task in tasks
+            }
+            for future in as_completed(futures):
+                task = futures[future]
+                try:
+                    future.result()
+                except OSError as e:
+                    self.files_result.failed.append((task, e,))
+                    failed.append(task)
+                    if revert:
+                        setattr(task.instance, task.field.attname,
+                                task.source)
+                    if self.can_copy_file_locally(task.storage):
+                        task.storage.delete(task.name)
+                else:
+                    self.files_result.copied.append(task)
+
+        for task in (failed if restore else ()):
+            manager = task.instance.__class__._base_manager
+            manager.using(self.using).filter(pk=task.instance.pk).update(
+                **{task.field.name: task.source})
+
+    def delete_files_copies(self, tasks):
+        """
+        Delete reserved or copied files of 'tasks' and set original file
+        names back to instances (cleanup after transaction rollback).
+        """
+        for task in tasks:
+            setattr(task.instance, task.field.attname, task.source)
+            try:
+                task.storage.delete(task.name)
+            except OSError:
+                pass
 
     def save_instance(self, instance, old_pk_value, old_new_pk_registry):
         instance.save()
-        old_new_pk_registry[instance._meta.model].update({
+        old_new_pk_registry[instance._meta.concrete_model].update({
             old_pk_value: instance.pk,
         })
+        self.target_values and self.register_target_values(instance)
         return instance
 
+    def can_bulk_create(self, model):
+        """
+        Check if objects of 'model' can be inserted with bulk_create: backend
+        should return pks from bulk insert (required for pks registry), model
+        should not be multi-table inherited and should not relate to itself
+        (such objects are remapped only by previously saved rows).
+
+        Note: only postgresql returns pks from bulk insert (Django 3.0),
+        other backends (sqlite, mysql) always save objects one by one, so
+        copying takes one query per object instead of one per model batch.
+        """
+        opts = model._meta
+        if not connections[self.using].features.can_return_rows_from_bulk_insert:
+            return False
+        if any(parent._meta.concrete_model is not opts.concrete_model
+               for parent in opts.get_parent_list()):
+            return False
+        deferred = self.get_deferred_fields(model)
+        return not any(
+            f.is_relation and (f.many_to_one or f.one_to_one) and
+            f.remote_field.model._meta.concrete_model is opts.concrete_model
+            and f not in deferred
+            for f in opts.concrete_fields
+        )
+
+    def copy_files(self, instance):
+        """Replace files of 'instance' FileFields by copies of them."""
+        if self.files_result is not None:
+            return  # files are prepared and copied by thread pool
+        for field in instance._meta.concrete_fields:
+            if isinstance(field, models.FileField):
+                oldval = getattr(instance, field.name, None)
+                if oldval:
+                    newval = self.copy_file(oldval)
+                    newval and setattr(instance, field.attname, newval)
+
+    def remap_related_values(self, instance, old_new_pk_registry):
+        """
+        Remap forward relations of 'instance' to copied objects by raw
+        "{field}_id" values (field.attname) and GenericForeignKey fk values
+        through pks registry, related objects are never fetched. Relations
+        to not primary key fields (to_field) are remapped through values
+        of copied targets (see register_target_values).
+        """
+        opts = instance._meta
+        for field in opts.concrete_fields:
+            if not (field.is_relation and
+                    (field.many_to_one or field.one_to_one)):
+                continue
+            parent_link = field.remote_field.parent_link
+            oldval = getattr(instance, field.attname)
+            if oldval is None and parent_link:
+                # parent link value is cleared with pk, take it from parent
+                oldval = getattr(instance, field.target_field.attname)
+            if oldval is None:
+                continue
+            if field.target_field.primary_key:
+                model = field.remote_field.model._meta.concrete_model
+                newval = old_new_pk_registry.get(model, {}).get(oldval, None)
+            else:
+                newval = (self.old_new_values or {}).get(
+                    field.target_field, {}).get(oldval, None)
+            if newval is not None:
+                setattr(instance, field.attname, newval)
+                if parent_link:
+                    setattr(instance, field.target_field.attname, newval)
+
+        for field in opts.private_fields:
+            if not isinstance(field, GenericForeignKey):
+                continue
+            ct_id = getattr(instance, opts.get_field(field.ct_field).attname)
+            oldval = getattr(instance, field.fk_field)
+            if ct_id is None or oldval is None:
+                continue
+            model = ContentType.objects.db_manager(
+                self.using).get_for_id(ct_id).model_class()
+            if model is None:
+                continue
+            model = model._meta.concrete_model
+            newval = old_new_pk_registry.get(model, {}).get(
+                model._meta.pk.to_python(oldval), None)
+            if newval is not None:
+                setattr(instance, field.fk_field, newval)
+
+    def bulk_copy_objects(self, model, instances, old_new_pk_registry):
+        """
+        Copy all 'instances' of 'model' with bulk_create in batches sized by
+        connection and register new pk values. Note, that bulk_create do not
+        call save() method and do not send pre/post_save signals.
+        """
+        old_pk_values = []
+        for instance in instances:
+            old_pk_values.append(instance.pk)
+            instance.pk = None
+            self.copy_files(instance)
+            self.defer_related_values(instance, old_new_pk_registry)
+            self.remap_related_values(instance, old_new_pk_registry)
+
+        fields = [f.column for f in model._meta.concrete_fields]
+        batch_size = max(connections[self.using].ops.bulk_batch_size(
+            fields, instances), 1)
+        model._base_manager.using(self.using).bulk_create(
+            instances, batch_size=batch_size)
+
+        old_new_pk_registry[model._meta.concrete_model].update(
+            zip(old_pk_values, (instance.pk for instance in instances)))
+        for instance in (instances if self.target_values else ()):
+            self.register_target_values(instance)
+        return list(zip(instances, old_pk_values))
+
     def copy_object(self, instance, old_new_pk_registry, commit=True):
         # save old pk value and set pk to None (save as new)
         old_pk_value = instance.pk
         instance.pk = None
 
-        for field in instance._meta.get_fields(include_hidden=True):
-            if isinstance(field, models.FileField):
-                oldval = getattr(instance, field.name, None)
-                if oldval:
-                    newval = self.get_uploaded_file_from_path(oldval.path)
-                    newval and setattr(instance, field.name, newval)
-            elif isinstance(field, (models.ForeignKey,
-                                    models.OneToOneField, GenericForeignKey)):
-                oldval = getattr(instance, field.name, None)
-                newval = oldval and old_new_pk_registry.get(
-                    oldval._meta.model, {}).get(oldval.pk, None)
-                if newval:
-                    newval = oldval._meta.model.objects.get(pk=newval)
-                    setattr(instance, field.name, newval)
+        self.copy_files(instance)
+        self.defer_related_values(instance, old_new_pk_registry)
+        self.remap_related_values(instance, old_new_pk_registry)
 
+        newitem = instance
         if commit:
             newitem = self.save_instance(instance, old_pk_value,
                                          old_new_pk_registry)
 
         return newitem, old_pk_value
 
-    def copy(self):
-        # sort collected instances by pk and model dependencies
+    def estimate(self, bulk=False, sizes='local'):
+        """
+        Estimate cost of copying collected objects (see CopyEstimate) without
+        any database writes or additional queries: rows are counted by
+        collected data, queries count depends on 'bulk' mode and multi-table
+        inheritance (each saved object also updates its parents rows).
+
+        Files size is taken from files storages according to 'sizes' value:
+        "local" - only from FileSystemStorage (cheap local stat calls),
+        "all" - from any storage (remote storage may do request per file),
+        None - files are only counted. Not requested sizes are "unsized".
+        """
+        assert sizes in (None, 'local', 'all',), (
+            'Files sizes mode should be None, "local" or "all".')
+
+        estimate = CopyEstimate()
         for model, instances in self.data.items():
-            self.data[model] = sorted(instances, key=attrgetter('pk'))
+            count = len(instances)
+            estimate.rows[model] = count
+
+            if bulk and self.can_bulk_create(model):
+                fields = [f.column for f in model._meta.concrete_fields]
+                batch_size = max(connections[self.using].ops.bulk_batch_size(
+                    fields, list(instances)), 1)
+                estimate.queries += -(-count // batch_size)
+            else:
+                parents = len(model._meta.get_parent_list())
+                estimate.queries += count * (parents + 2 if parents else 1)
+
+            updates = self.field_updates.get(model, {})
+            fields = [f for f in model._meta.concrete_fields
+                      if isinstance(f, models.FileField) and f not in updates]
+            for instance in (instances if fields else ()):
+                for field in fields:
+                    fieldfile = getattr(instance, field.name, None)
+                    if not fieldfile:
+                        continue
+                    if not (sizes == 'all' or sizes == 'local' and isinstance(
+                            fieldfile.storage, FileSystemStorage)):
+                        estimate.unsized += 1
+                        estimate.files += 1
+                        continue
+                    try:
+                        estimate.bytes += fieldfile.storage.size(
+                            fieldfile.name)
+                    except OSError:
+                        continue
+                    estimate.files += 1
+
+        return estimate
+
+    def copy(self, bulk=False, files=None, files_workers=None, progress=None):
+        """
+        Copy all collected objects and return list of (new_object, old_pk)
+        pairs. If 'bulk' is True, objects of each model are inserted with
+        bulk_create, if model and backend allow it (see can_bulk_create),
+        else objects are saved one by one.
+
+        By default files are copied one by one while objects saving, failed
+        copies silently keep original file name. With 'files' value
+        "before" or "on_commit" names of all files are reserved before
+        transaction and files content is copied in thread pool of
+        'files_workers' size before transaction or after commit
+        (transaction.on_commit) respectively. Results are reported in
+        "files_result" attribute (FilesCopyResult instance), failed copies
+        get original file name back ("on_commit" mode updates it in already
+        committed rows). If copying transaction fails, reserved and copied
+        files are deleted, but rollback of outer transaction is not tracked:
+        call "delete_files_copies" with "files_result.copied" if required.
+
+        If 'progress' callable is provided, it is called with (model, count)
+        arguments after all objects of each model are copied.
+        """
+        assert files in (None, 'before', 'on_commit',), (
+            'Files copying mode should be None, "before" or "on_commit".')
+
+        # sort collected models by dependencies and instances by pk
+        # (parents first in self relations)
         self.sort()
+        self.collected_pks = {}
+        for model, instances in self.data.items():
+            self.data[model] = self.sort_instances(model, instances)
+            self.collected_pks.setdefault(
+                model._meta.concrete_model, set()).update(
+                    instance.pk for instance in instances)
+
+        if files:
+            self.files_result = FilesCopyResult()
+            tasks = self.prepare_files()
+            if files == 'before':
+                self.run_files_copying(tasks, files_workers, revert=True)
 
         old_new_pk_registry, copied_objects = {}, []
-        with transaction.atomic(using=self.using, savepoint=False):
-            # update fields values
-            for model, fields_values in self.field_updates.items():
-                for field, value in fields_values.items():
-                    for obj in self.data.get(model, []):
-                        if callable(value):
-                            value(obj, field)
-                        else:
-                            setattr(obj, field.name, value)
-
-            # generate new objects
-            for item in self.data.items():
-                old_new_pk_registry.setdefault(item[0], {})
-                for i in item[1]:
-                    item = self.copy_object(i, old_new_pk_registry)
-                    copied_objects.append(item)
+        self.deferred_values = {}
+        self.target_values, self.old_new_values = {}, {}
+        self.save_target_values()
+        try:
+            with transaction.atomic(using=self.using, savepoint=False):
+                # update fields values
+                for model, fields_values in self.field_updates.items():
+                    for field, value in fields_values.items():
+                        for obj in self.data.get(model, []):
+                            if callable(value):
+                                value(obj, field)
+                            else:
+                                setattr(obj, field.name, value)
+
+                # generate new objects
+                for model, instances in self.data.items():
+                    old_new_pk_registry.setdefault(
+                        model._meta.concrete_model, {})
+                    if bulk and self.can_bulk_create(model):
+                        copied_objects += self.bulk_copy_objects(
+                            model, instances, old_new_pk_registry)
+                    else:
+                        for instance in instances:
+                            item = self.copy_object(
+                                instance, old_new_pk_registry)
+                            copied_objects.append(item)
+                    progress and progress(model, len(instances))
+
+                # set deferred relations values
+                self.update_deferred_values(old_new_pk_registry)
+
+                if files == 'on_commit':
+                    transaction.on_commit(
+                        lambda: self.run_files_copying(
+                            tasks, files_workers, revert=True, restore=True),
+                        using=self.using)
+        except Exception:
+            files and self.delete_files_copies(tasks)
+            raise
 
         return copied_objects
@@ -1,14 +1,69 @@
+import uuid
+import hashlib
 from functools import reduce
+from django.core.cache import caches
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist
 from django.db import models, connections
+from django.db.models.expressions import OrderBy, RawSQL
+from django.db.models.functions import Lag, Lead
+
+# backends, which support row values comparison "(a, b) > (x, y)" (sqlite
+# since 3.15), and backends, where it always can use composite indexes
+ROW_VALUES_VENDORS = ('postgresql', 'mysql', 'sqlite',)
+ROW_VALUES_AUTO_VENDORS = ('postgresql',)
+
+
+def supports_row_values(connection):
+    """Check if backend supports row values comparison."""
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 15, 0)
+    return connection.vendor in ROW_VALUES_VENDORS
+
+
+class RowValuesCompare(models.Expression):
+    """Row values comparison "(a, b, ...) > (x, y, ...)" for filtering."""
+
+    template = '(%(left)s) %(operator)s (%(right)s)'
+
+    def __init__(self, left, right, operator='>'):
+        super().__init__(output_field=models.BooleanField())
+        self.left, self.right, self.operator = list(left), list(right), operator
+
+    def get_source_expressions(self):
+        return self.left + self.right
+
+    def set_source_expressions(self, exprs):
+        self.left, self.right = exprs[:len(self.left)], exprs[len(self.left):]
+
+    def as_sql(self, compiler, connection):
+        sqls, params = [], []
+        for expressions in (self.left, self.right,):
+            parts = []
+            for expression in expressions:
+                sql, sql_params = compiler.compile(expression)
+                parts.append(sql)
+                params.extend(sql_params)
+            sqls.append(', '.join(parts))
+        return self.template % {'left': sqls[0], 'right': sqls[1],
+                                'operator': self.operator}, params
 
 
 class PrevNextModel(models.Model):
+    # default neighbour lookup strategy: "filter", "rows", "window" or "auto"
+    nextprev_strategy = 'filter'
+    # shared (cross-request) neighbours cache, disabled if alias is None,
+    # timeout should be finite: it is invalidated only by post_save and
+    # post_delete signals, bulk writes require manual invalidation
+    nextprev_cache_alias = None
+    nextprev_cache_timeout = 60 * 60
+
     class Meta:
         abstract = True
 
-    def _get_current_ordering(self, queryset):
+    @classmethod
+    def _get_current_ordering(cls, queryset):
         """Get current ordering fields with directions"""
-        query, pk = queryset.query, self._meta.pk.name
+        query, pk = queryset.query, cls._meta.pk.name
 
         # note: taken from django source
         # get order_by declaration for current queryset:
@@ -28,16 +83,19 @@ class PrevNextModel(models.Model):
         else:
             ordering = [pk]
 
+        # convert F and OrderBy(F) expressions to strings, other expressions
+        # are returned as OrderBy instances (see _annotate_ordering)
+        ordering = [cls._get_ordering_item(i) for i in ordering]
+        if any(isinstance(i, str) and '?' in i for i in ordering):
+            raise ValueError('PrevNextModel does not support random'
+                             ' ordering.')
+
         # append pk ordering for uniqueness if not exists,
         # else cut any fields after pk (because pk is unique)
         ordering = [i.replace('pk', pk) if i in ['pk', '-pk'] else i
                     for i in ordering]
-        if any(not isinstance(i, str) or '__' in i or '?' in i
-               for i in ordering):
-            raise ValueError('PrevNextModel at this moment supports only'
-                             ' local order_by fields defined as strings.')
-
-        nodirect = [i.lstrip('-') for i in ordering]
+        nodirect = [i.lstrip('-') if isinstance(i, str) else None
+                    for i in ordering]
         if pk in nodirect:
             ordering = ordering[0:nodirect.index(pk)+1]
         else:
@@ -45,10 +103,160 @@ class PrevNextModel(models.Model):
 
         return ordering
 
+    @staticmethod
+    def _get_ordering_item(item):
+        """Convert ordering item to string if possible or to OrderBy"""
+        if isinstance(item, str):
+            return item
+        if isinstance(item, models.F):
+            return item.name
+        if not isinstance(item, OrderBy):
+            item = OrderBy(item)
+        if (isinstance(item.expression, models.F) and
+                not item.nulls_first and not item.nulls_last):
+            return '%s%s' % ('-' if item.descending else '',
+                             item.expression.name,)
+        return item
+
+    @staticmethod
+    def _annotate_ordering(queryset, ordering):
+        """
+        Annotate queryset with ordering expressions (OrderBy instances)
+        as "_nextprev_{index}" values, return annotated queryset, ordering
+        with expressions replaced by annotations names and annotations.
+        """
+        annotations, result = {}, []
+        for index, item in enumerate(ordering):
+            if isinstance(item, str):
+                result.append(item)
+                continue
+            name = '_nextprev_%s' % index
+            annotations[name] = item.expression
+            result.append('-%s' % name if item.descending else name)
+        if annotations:
+            queryset = queryset.annotate(**annotations)
+        return queryset, result, annotations
+
+    def _get_ordering_values(self, queryset, names, annotations):
+        """
+        Get values of ordering fields of current object: local values are
+        taken from instance, related ("__") and annotated ones are selected
+        by subquery by pk in the neighbour query itself, queryset is
+        annotated with them as "_nextprev_current_{index}" values (F
+        expressions are returned as values). Return queryset and values.
+        """
+        remote = [i for i in names if '__' in i or i in annotations]
+        values = {i: getattr(self, i) for i in names if i not in remote}
+        if remote:
+            manager = type(self)._base_manager.db_manager(queryset.db)
+            current = manager.annotate(**annotations).filter(pk=self.pk)
+            subqueries = {}
+            for index, name in enumerate(remote):
+                alias = '_nextprev_current_%s' % index
+                subqueries[alias] = models.Subquery(
+                    current.values(name)[:1])
+                values[name] = models.F(alias)
+            queryset = queryset.annotate(**subqueries)
+        return queryset, values
+
+    @classmethod
+    def _is_nullable(cls, name):
+        """Check if ordering field can contain null (related and annotated
+        values are considered as nullable)."""
+        try:
+            return cls._meta.get_field(name).null
+        except FieldDoesNotExist:
+            return True
+
+    def _get_nextprev_strategy(self, strategy, queryset, ordering):
+        """
+        Get neighbour lookup strategy, supported by queryset backend:
+        -   "filter" - "(a > x) | (a = x & b > y) | ..." filter with nulls
+                       processing, works everywhere
+        -   "rows"   - row values comparison "(a, b, pk) > (x, y, z)",
+                       only for local not nullable not relation fields
+                       with the same ordering direction and if backend
+                       supports row values (see supports_row_values),
+                       else "filter" is used
+        -   "window" - pk of neighbour is selected by LEAD/LAG subquery,
+                       only if backend supports window functions, note:
+                       subquery is calculated over all queryset rows
+        -   "auto"   - "rows" for postgresql (if it can be used), else
+                       "filter"
+        """
+        connection = connections[queryset.db]
+        if strategy == 'auto':
+            strategy = ('rows' if connection.vendor in ROW_VALUES_AUTO_VENDORS
+                        else 'filter')
+
+        if strategy == 'rows':
+            # relation fields are ordered by related model ordering
+            opts = self._meta
+            names = [i.lstrip('-') for i in ordering]
+            local = {f.name: f for f in opts.concrete_fields
+                     if not f.is_relation}
+            local['pk'] = local[opts.pk.name] = opts.pk
+            if (not supports_row_values(connection) or
+                    len({i.startswith('-') for i in ordering}) > 1 or
+                    any(i not in local or local[i].null for i in names)):
+                strategy = 'filter'
+        if strategy == 'window' and not connection.features.supports_over_clause:
+            strategy = 'filter'
+        return strategy
+
+    @classmethod
+    def _get_nextprev_cache_version_key(cls):
+        return 'sakkada.prev_next:%s:version' % (
+            cls._meta.concrete_model._meta.label_lower,)
+
+    @classmethod
+    def _get_nextprev_cache_version(cls):
+        """Get version of model neighbours in shared cache."""
+        cache = caches[cls.nextprev_cache_alias]
+        key = cls._get_nextprev_cache_version_key()
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, uuid.uuid4().hex, None)
+            version = cache.get(key)
+        return version
+
+    @classmethod
+    def invalidate_nextprev_cache(cls):
+        """
+        Invalidate all model (and its multi-table parents) neighbours in
+        shared cache by setting new version. Called automatically on
+        post_save and post_delete signals, should be called manually after
+        bulk writes (queryset.update, bulk_create, bulk_update, raw sql)
+        and changes of related objects used in ordering or filtering.
+        """
+        for model in [cls] + cls._meta.get_parent_list():
+            if issubclass(model, PrevNextModel) and model.nextprev_cache_alias:
+                caches[model.nextprev_cache_alias].set(
+                    model._get_nextprev_cache_version_key(),
+                    uuid.uuid4().hex, None)
+
+    def _get_nextprev_cache_key(self, queryset, ordering, is_next, nulls_first):
+        """
+        Get shared cache key of neighbour by model, pk, ordering and queryset
+        fingerprint (hash of its sql and params), or None if queryset can
+        not be compiled (e.g. is empty by definition).
+        """
+        try:
+            sql = queryset.query.get_compiler(queryset.db).as_sql()
+        except EmptyResultSet:
+            return None
+        fingerprint = hashlib.md5(repr((
+            queryset.db, sql, ordering, nulls_first,)).encode()).hexdigest()
+        return 'sakkada.prev_next:%s:%s:%s:%s:%s' % (
+            self._meta.concrete_model._meta.label_lower,
+            self._get_nextprev_cache_version(),
+            'next' if is_next else 'prev', self.pk, fingerprint,)
+
     def _get_next_or_prev_by_order(self, order_by=None,
                                    is_next=True, nulls_first=None,
                                    queryset=None, as_queryset=False,
-                                   cache_name=None, force=False):
+                                   cache_name=None, force=False,
+                                   strategy=None):
         """Get next or previous element according current queryset ordering"""
         cache_name = '_%s' % cache_name if cache_name else ''
         cache_name = '_%s%s_nextprev_cache' % ('next' if is_next else 'prev',
@@ -61,10 +269,27 @@ class PrevNextModel(models.Model):
                         else queryset)
             queryset = queryset.order_by(*order_by) if order_by else queryset
             ordering = self._get_current_ordering(queryset)
+            queryset, ordering, annotations = self._annotate_ordering(
+                queryset, ordering)
 
             nodirect = [i.lstrip('-') for i in ordering]
-            nulls_first = (connections[queryset.db].features.nulls_order_largest
+            nulls_default = connections[queryset.db].features.nulls_order_largest
+            nulls_first = (nulls_default
                            if nulls_first is None else bool(nulls_first))
+            strategy = self._get_nextprev_strategy(
+                strategy or self.nextprev_strategy, queryset, ordering)
+            window_ordering = ordering
+
+            # shared cache (if enabled): force=True only updates value
+            cache_key = None
+            if self.nextprev_cache_alias and force != 'nocache' and not as_queryset:
+                cache = caches[self.nextprev_cache_alias]
+                cache_key = self._get_nextprev_cache_key(
+                    queryset, ordering, is_next, nulls_first)
+                cached = cache.get(cache_key) if cache_key and not force else None
+                if cached is not None:
+                    setattr(self, cache_name, cached[0])
+                    return cached[0]
 
             if is_next:
                 directions = [not i.startswith('-') for i in ordering]
@@ -73,33 +298,28 @@ class PrevNextModel(models.Model):
                 ordering = [i.lstrip('-') if b else '-%s' % i
                             for i, b in zip(ordering, directions)]
 
-            # generate filter list
-            filter = []
-            for i, (name, direction,) in enumerate(zip(nodirect, directions)):
-                value = getattr(self, name)
-                equals = dict([(i, getattr(self, i)) for i in nodirect[0:i]])
-
-                # null values processing: if direction is reverse - ignore,
-                # generate filter according each ordering fields and direction
-                if value is None:
-                    # ignore to disable loop by null values
-                    if not nulls_first ^ direction:
-                        continue
-                    key, value = '%s__isnull' % name, False
-                    cmps = models.Q(**{key: value,})
-                else:
-                    key = '%s__%s' % (name, direction and 'gt' or 'lt')
-                    cmps = models.Q(**{key: value,})
-
-                    # add isnull filter for reverse direction on nullable fields
-                    null = self.__class__._meta.get_field(name).null
-                    if not direction ^ nulls_first and null:
-                        cmps = cmps | models.Q(**{'%s__isnull' % name: True,})
-
-                filter.append((models.Q(**equals) & cmps))
-
-            # compile filter and exclude self.pk for strict filtering
-            filter = reduce(lambda x, y: y | x, filter) & ~models.Q(pk=self.pk)
+            if strategy == 'rows':
+                # all directions are the same and values are not null
+                fields = [self._meta.get_field(name) for name in nodirect]
+                filter = models.Q(RowValuesCompare(
+                    [models.F(name) for name in nodirect],
+                    [models.Value(getattr(self, field.attname),
+                                  output_field=field) for field in fields],
+                    operator='>' if directions[0] else '<',
+                ))
+            elif strategy == 'window':
+                sql, params = self._get_nextprev_window_sql(
+                    self._get_nextprev_window_queryset(queryset),
+                    window_ordering, [self.pk],
+                    columns=('next' if is_next else 'prev',),
+                    nulls_largest=(None if nulls_first == nulls_default
+                                   else nulls_first))
+                filter = models.Q(pk=RawSQL(sql, params))
+            else:
+                queryset, values = self._get_ordering_values(
+                    queryset, nodirect, annotations)
+                filter = self._get_nextprev_filter(
+                    nodirect, directions, nulls_first, values)
             queryset = queryset.filter(filter).order_by(*ordering)
 
             # return as (queryset, filter and ordering params) if as_queryset
@@ -111,9 +331,162 @@ class PrevNextModel(models.Model):
             if force == 'nocache':
                 return queryset
             setattr(self, cache_name, queryset)
+            if cache_key:
+                cache.set(cache_key, (queryset,), self.nextprev_cache_timeout)
 
         return getattr(self, cache_name)
 
+    @classmethod
+    def _get_nextprev_filter(cls, nodirect, directions, nulls_first, values):
+        """
+        Get "filter" strategy Q object for ordering fields and directions
+        and ordering values of current row ('values' should contain pk).
+        Values, selected in query itself (F expressions), can be null, so
+        filter contains both null and not null conditions for them.
+        """
+        def isnull(value, negated=False):
+            return models.Q(**{'%s__isnull' % value.name: not negated})
+
+        # generate filter list
+        filter = []
+        for i, (name, direction,) in enumerate(zip(nodirect, directions)):
+            value = values[name]
+            equals = models.Q()
+            for prev in nodirect[0:i]:
+                if isinstance(values[prev], models.F):
+                    equals &= (models.Q(**{prev: values[prev]}) |
+                               models.Q(**{'%s__isnull' % prev: True}) &
+                               isnull(values[prev]))
+                else:
+                    equals &= models.Q(**{prev: values[prev]})
+
+            # null values processing: if direction is reverse - ignore,
+            # generate filter according each ordering fields and direction
+            cmps = None
+            if value is None or isinstance(value, models.F):
+                # ignore to disable loop by null values
+                if nulls_first ^ direction:
+                    cmps = models.Q(**{'%s__isnull' % name: False})
+                    if value is not None:
+                        cmps &= isnull(value)
+            if value is not None:
+                key = '%s__%s' % (name, direction and 'gt' or 'lt')
+                notnull = models.Q(**{key: value,})
+
+                # add isnull filter for reverse direction on nullable fields
+                null = cls._is_nullable(name)
+                if not direction ^ nulls_first and null:
+                    notnull = notnull | models.Q(**{'%s__isnull' % name: True,})
+                if isinstance(value, models.F):
+                    notnull &= isnull(value, negated=True)
+                cmps = notnull if cmps is None else cmps | notnull
+            if cmps is None:
+                continue
+
+            filter.append(equals & cmps)
+
+        # compile filter and exclude current pk for strict filtering
+        return reduce(lambda x, y: y | x, filter) & ~models.Q(
+            pk=values[cls._meta.pk.name])
+
+    def _get_nextprev_window_queryset(self, queryset):
+        """
+        Get rows of window subquery: 'queryset' rows and current object, so
+        its neighbours are found even if it is not in queryset (neighbours
+        are selected from 'queryset' rows anyway).
+        """
+        current = queryset.model._base_manager.db_manager(
+            queryset.db).filter(pk=self.pk)
+        if queryset.query.distinct:
+            current = current.distinct(*queryset.query.distinct_fields)
+        return queryset | current
+
+    @staticmethod
+    def _get_nextprev_window_sql(queryset, ordering, pks,
+                                 columns=('pk', 'next', 'prev',),
+                                 nulls_largest=None):
+        """
+        Get sql and params of query, which selects (pk, next pk, prev pk)
+        rows (or only specified 'columns') for 'pks' with LEAD/LAG window
+        functions over 'ordering'. Nulls are ordered by backend default
+        if 'nulls_largest' is None.
+        """
+        connection = connections[queryset.db]
+        qn = connection.ops.quote_name
+        order_by = []
+        for name in ordering:
+            descending = name.startswith('-')
+            nulls = ({} if nulls_largest is None else
+                     {'nulls_first': not nulls_largest ^ descending,
+                      'nulls_last': nulls_largest ^ descending})
+            order_by.append(OrderBy(models.F(name.lstrip('-')),
+                                    descending=descending, **nulls))
+        queryset = queryset.order_by().annotate(
+            _nextprev_pk=models.F('pk'),
+            _nextprev_next=models.Window(Lead('pk'), order_by=order_by),
+            _nextprev_prev=models.Window(Lag('pk'), order_by=order_by),
+        ).values_list('_nextprev_pk', '_nextprev_next', '_nextprev_prev')
+
+        # window functions are calculated after filtering, so filter by pks
+        # should be applied in outer query
+        sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+        sql = 'SELECT %s FROM (%s) %s WHERE %s IN (%s)' % (
+            ', '.join(qn('_nextprev_%s' % i) for i in columns),
+            sql, qn('_nextprev'), qn('_nextprev_pk'),
+            ', '.join(['%s'] * len(pks)),)
+        return sql, tuple(params) + tuple(pks)
+
+    @classmethod
+    def prefetch_next_and_prev_by_order(cls, instances, order_by=None,
+                                        queryset=None, cache_name=None):
+        """
+        Get next and previous elements for all 'instances' (e.g. objects of
+        current page) and fill theirs caches (the same as "cache_name" param
+        of _get_next_or_prev_by_order) in two queries: neighbours pks are
+        selected by LEAD/LAG window functions, if backend supports them,
+        and then all neighbours are fetched at once. Instances, which are
+        not in queryset, and backends without window functions are
+        processed one by one by _get_next_or_prev_by_order.
+        """
+        instances = list(instances)
+        if not instances:
+            return instances
+
+        queryset = (cls._default_manager.get_queryset()
+                    if not isinstance(queryset, models.query.QuerySet)
+                    else queryset)
+        queryset = queryset.order_by(*order_by) if order_by else queryset
+        suffix = '_%s' % cache_name if cache_name else ''
+        neighbours = {}
+
+        if connections[queryset.db].features.supports_over_clause:
+            ordering = instances[0]._get_current_ordering(queryset)
+            annotated, ordering, _ = cls._annotate_ordering(queryset, ordering)
+            sql, params = cls._get_nextprev_window_sql(
+                annotated, ordering, list({i.pk for i in instances}))
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute(sql, params)
+                neighbours = {pk: (next, prev,)
+                              for pk, next, prev in cursor.fetchall()}
+
+            pks = {pk for pair in neighbours.values()
+                   for pk in pair if pk is not None}
+            objects = queryset.in_bulk(pks) if pks else {}
+            neighbours = {pk: (objects.get(next), objects.get(prev),)
+                          for pk, (next, prev,) in neighbours.items()}
+
+        for instance in instances:
+            if instance.pk in neighbours:
+                next, prev = neighbours[instance.pk]
+                setattr(instance, '_next%s_nextprev_cache' % suffix, next)
+                setattr(instance, '_prev%s_nextprev_cache' % suffix, prev)
+            else:
+                for is_next in (True, False,):
+                    instance._get_next_or_prev_by_order(
+                        is_next=is_next, queryset=queryset,
+                        cache_name=cache_name, force=True)
+        return instances
+
     def get_next_by_order(self, **kwargs):
         kwargs['is_next'] = True
         return self._get_next_or_prev_by_order(**kwargs)
@@ -121,3 +494,13 @@ class PrevNextModel(models.Model):
     def get_prev_by_order(self, **kwargs):
         kwargs['is_next'] = False
         return self._get_next_or_prev_by_order(**kwargs)
+
+
+def invalidate_nextprev_cache(sender, **kwargs):
+    """Invalidate shared neighbours cache of saved or deleted objects."""
+    if issubclass(sender, PrevNextModel) and sender.nextprev_cache_alias:
+        sender.invalidate_nextprev_cache()
+
+
+models.signals.post_save.connect(invalidate_nextprev_cache)
+models.signals.post_delete.connect(invalidate_nextprev_cache)
@@ -1,12 +1,59 @@
 import os
-import re
-import sys
-from django.db import models
+from collections import namedtuple
+from django.db import models, connections
 from django.apps import apps
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
 from django.utils.functional import LazyObject
+from sakkada.system.management.files_clean.utils import (
+    join_path, walk_files, walk_files_parallel, walk_storage, iterate_parallel,
+    ReferencesIndex, ScanIndex, merge_join, Progress, Cleaner, Output, get_size)
+
+
+Source = namedtuple('Source', ('key', 'walk', 'registry', 'get_path', 'display',
+                               'storage',))
+
+
+def get_pk(pk):
+    """Get pk value storable in sqlite (int or str)."""
+    return pk if isinstance(pk, (int, str,)) else str(pk)
+
+
+def get_updated_field(model):
+    """Get auto_now date (or datetime) field of model, if exists."""
+    for field in model._meta.concrete_fields:
+        if isinstance(field, models.DateField) and field.auto_now:
+            return field
+    return None
+
+
+def get_storage_key(storage):
+    """Get key of storage, equal for the same deconstructible storages."""
+    try:
+        return repr(storage.deconstruct())
+    except Exception:
+        return id(storage)
+
+
+def get_storage_location(storage):
+    """Get normalized absolute location of filesystem storage or None."""
+    if not isinstance(storage, FileSystemStorage):
+        return None
+    return os.path.abspath(storage.location).replace('\\', '/')
+
+
+def get_storage_display(storage):
+    """
+    Get function converting storage file name to output value: absolute
+    path for storages with location, else "storage.class.path:name".
+    """
+    location = getattr(storage, 'location', None)
+    if isinstance(location, str):
+        return lambda name: join_path(location, name)
+    label = '%s.%s' % (storage.__class__.__module__, storage.__class__.__qualname__,)
+    return lambda name: '%s:%s' % (label, name,)
 
 
 def get_storage_by_field(field):
@@ -44,118 +91,423 @@ class Command(BaseCommand):
             "nodirs=directories excluded from search list by regex. Default 'fs'."
         ))
 
+        parser.add_argument(
+            '--chunk-size', dest='chunk_size', type=int, default=2000, help=(
+                "Count of database rows fetched at once, default 2000."
+            )
+        )
+        parser.add_argument(
+            '--db-workers', dest='db_workers', type=int, default=1, help=(
+                "Count of threads reading database references of file fields "
+                "concurrently (each with own connection), default 1 (no threads)."
+            )
+        )
+
+        parser.add_argument(
+            '-e', '--exclude', dest='exclude', default=None, help=(
+                "Regex for directories excluded from walking with subdirectories "
+                "(pruned before walking, unlike directories not matched by -r), "
+                "relative to media_root, for example '^(cache|tmp)(/|$)'."
+            )
+        )
+        parser.add_argument(
+            '-w', '--workers', dest='workers', type=int, default=1, help=(
+                "Count of threads walking top-level directories concurrently, "
+                "default 1 (no threads)."
+            )
+        )
+        parser.add_argument(
+            '--storages', dest='storages', action='store_true', help=(
+                "Storages mode: list files of each FileField storage (of any "
+                "class) by Storage.listdir and compare them with references "
+                "of fields using the same storage only, paths are absolute for "
+                "storages with location, else prefixed by storage class path."
+            )
+        )
+        parser.add_argument(
+            '--index', dest='index', default=None, help=(
+                "Persistent scan index file (sqlite database, created if not "
+                "exists) for incremental runs: not changed directories (by "
+                "mtime) are not listed again, database references of models "
+                "with auto_now date field are read only for changed rows."
+            )
+        )
+        parser.add_argument(
+            '-f', '--format', dest='format', default='text', choices=Output.formats, help=(
+                "Output format: text (default), jsonl (JSON object per line), "
+                "csv (with header row) or null (no records), all formats "
+                "except text are streamed with totals (count, bytes) at the end."
+            )
+        )
+        parser.add_argument(
+            '--progress', dest='progress', action='store_true', help=(
+                "Write walked files count and files/sec speed to stderr."
+            )
+        )
+
+        parser.add_argument(
+            '--delete', dest='delete', action='store_true', help=(
+                "Delete files of 'fs' list (not referenced files), output is "
+                "manifest: 'action<TAB>path[<TAB>info]' lines, where action "
+                "is delete, skip (too new) or error."
+            )
+        )
+        parser.add_argument(
+            '--move-to', dest='move_to', default=None, help=(
+                "Move files of 'fs' list to quarantine directory (outside of "
+                "media_root) keeping relative paths, manifest action is move."
+            )
+        )
+        parser.add_argument(
+            '--dry-run', dest='dry_run', action='store_true', help=(
+                "Write manifest of --delete or --move-to without changes."
+            )
+        )
+        parser.add_argument(
+            '--min-age', dest='min_age', type=float, default=60, help=(
+                "Skip files modified less than N minutes ago (uploads in "
+                "progress), default 60."
+            )
+        )
+        parser.add_argument(
+            '--rate', dest='rate', type=float, default=0, help=(
+                "Limit of deleted or moved files per second, default 0 (no limit)."
+            )
+        )
+        parser.add_argument(
+            '--batch-size', dest='batch_size', type=int, default=100, help=(
+                "Count of files deleted or moved at once, default 100."
+            )
+        )
+
+    def walk_files(self, media_root, on_directory=None, **options):
+        """Get sorted filesystem files stream according options."""
+        regex = options['regex']
+        kwargs = {'on_directory': on_directory, 'exclude': options['exclude'],
+                  'progress': self.progress,
+                  'scan': self.scan_index and self.scan_index.scan,}
+        if options['workers'] > 1:
+            return walk_files_parallel(media_root, regex, options['workers'], **kwargs)
+        return walk_files(media_root, regex, **kwargs)
+
+    def get_registry(self, media_root, storages=False):
+        """
+        Get {storage_key: (storage, registry)} data, where registry is
+        {model_name: {'class': model, 'fields': fields}}, fields are
+        grouped by storage in storages mode, else storage_key is None.
+        """
+        registry = {}
+        for model in apps.get_models():
+            groups = {}
+            for field in model._meta.fields:
+                if not isinstance(field, models.FileField):
+                    continue
+                storage = get_storage_by_field(field)
+                if not storages and not self.check_storage(storage, model, field, media_root):
+                    continue
+                key = get_storage_key(storage) if storages else None
+                groups.setdefault(key, (storage, {},))[1][field.name] = field
+
+            if not groups:
+                continue
+            for key, (storage, fields) in groups.items():
+                registry.setdefault(key, (storage, {},))[1][model.__name__] = {
+                    'class': model, 'fields': fields,}
+        return registry
+
+    def check_storage(self, storage, model, field, media_root):
+        """Check that storage is filesystem storage located in media_root."""
+        if not isinstance(storage, FileSystemStorage):
+            self.stderr.write('Illegal fileField storage class "%s" (%s, %s).\n'
+                              'Use --storages param for not filesystem storages.' %
+                              (storage.__class__.__name__, model.__name__, field.name))
+            return False
+        location = storage.location.replace('\\', '/')
+        if not location.startswith(media_root):
+            self.stderr.write('Illegal fileField storage location (%s, %s).\n'
+                              'Current:    %s\nMust be in: %s' %
+                              (model.__name__, field.name, location, media_root))
+            return False
+        return True
+
+    def get_references(self, registry, chunk_size, get_path, workers=1, key=None):
+        """
+        Get database files references index (see ReferencesIndex),
+        get_path converts field value to indexed path. Each field is read
+        by separate index-friendly query (non empty values only) in chunks
+        by base manager (default one can hide rows, e.g. soft deleted, which
+        still reference files), queries are run concurrently in "workers"
+        threads. If scan index is used, references are stored in it by
+        source key and read incrementally (see prepare_references).
+        """
+        def read(number, model, name, filters):
+            values = model._base_manager.filter(**{'%s__gt' % name: ''}, **filters)\
+                          .order_by().values_list('pk', name)
+            rows = []
+            for pk, value in values.iterator(chunk_size=chunk_size):
+                rows.append((get_pk(pk), name, get_path(value),))
+                if len(rows) >= chunk_size:
+                    yield number, rows
+                    rows = []
+            if rows:
+                yield number, rows
+
+        scan_index, marks, tasks = self.scan_index, {}, []
+        datas = list(registry.values())
+        for number, data in enumerate(datas):
+            filters = {}
+            if scan_index:
+                marks[number], filters = self.prepare_references(
+                    scan_index, key, data['class'], data['fields'], chunk_size)
+            tasks.extend((number, data['class'], name, filters,)
+                         for name in data['fields'])
+
+        index = ReferencesIndex()
+        for number, rows in iterate_parallel(read, tasks, workers,
+                                             finalize=connections.close_all):
+            model = datas[number]['class']
+            if scan_index:
+                scan_index.add_refs(marks[number][0], rows)
+                continue
+            index.add((path, model.__name__, model._meta.db_table, pk, name, number,)
+                      for pk, name, path in rows)
+
+        for number, (refs_key, mark) in marks.items():
+            model = datas[number]['class']
+            mark and scan_index.set_mark(refs_key, mark)
+            index.add((path, model.__name__, model._meta.db_table, pk, name, number,)
+                      for pk, name, path in scan_index.get_refs(refs_key))
+        return index
+
+    def prepare_references(self, scan_index, key, model, fields, chunk_size):
+        """
+        Prepare stored in scan index references of model fields for reading,
+        get ((refs_key, new_mark), filters of rows to read). References
+        of models with auto_now date field are read incrementally: only rows
+        changed since previous run (mark) are read again, references of
+        deleted rows are removed, other references are read fully.
+        """
+        refs_key = '%s|%s|%s' % (key, model._meta.label, ','.join(sorted(fields)))
+        updated = get_updated_field(model)
+        mark = updated and scan_index.get_mark(refs_key)
+        new_mark = updated and str(updated.to_python(timezone.now()))
+        if not mark:
+            scan_index.delete_refs(refs_key)
+            return (refs_key, new_mark,), {}
+
+        filters = {'%s__gte' % updated.name: updated.to_python(mark)}
+        manager = model._base_manager.order_by()
+        scan_index.keep_refs(refs_key, (
+            get_pk(pk) for pk in manager.values_list('pk', flat=True)
+                                        .iterator(chunk_size=chunk_size)))
+        scan_index.delete_refs(refs_key, (
+            get_pk(pk) for pk in manager.filter(**filters).values_list('pk', flat=True)
+                                        .iterator(chunk_size=chunk_size)))
+        return (refs_key, new_mark,), filters
+
+    def get_nested_locations(self, sources, media_root):
+        """
+        Get sorted locations of filesystem storages nested in locations of
+        other storages of sources (or in media_root in filesystem mode).
+        """
+        locations = set()
+        for source in sources:
+            if source.storage is not None:
+                locations.add(get_storage_location(source.storage))
+                continue
+            locations.add(os.path.abspath(media_root).replace('\\', '/'))
+            for data in source.registry.values():
+                locations.update(get_storage_location(get_storage_by_field(field))
+                                 for field in data['fields'].values())
+        locations.discard(None)
+        return sorted(location for location in locations if any(
+            location.startswith(join_path(other, '')) for other in locations
+            if other != location))
+
+    def get_sources(self, media_root, **options):
+        """
+        Get list of sources: (walk, registry, get_path, display), where
+        walk(on_directory) returns sorted files stream, get_path converts
+        database value to path in stream, display converts path to output.
+        Filesystem mode has one source (MEDIA_ROOT), storages mode has
+        source for each storage, paths are names relative to storage.
+        """
+        storages = options['storages']
+        if not storages:
+            registry = self.get_registry(media_root).get(None, (None, {},))[1]
+            return [Source(
+                key=media_root,
+                walk=lambda on_directory=None: self.walk_files(
+                    media_root, on_directory, **options),
+                registry=registry,
+                get_path=lambda value: join_path(settings.MEDIA_ROOT, value),
+                display=lambda path: path,
+                storage=None,
+            )]
+
+        # filesystem storages with the same location are one source (fields
+        # registries are merged), locations of nested storages are not
+        # walked by outer ones, so files are compared with references of
+        # fields of storage, which really contains them
+        groups = {}
+        for key, (storage, registry) in self.get_registry(media_root, True).items():
+            group = groups.setdefault(get_storage_location(storage) or key,
+                                      (storage, {},))[1]
+            for name, data in registry.items():
+                group.setdefault(name, {'class': data['class'], 'fields': {}})[
+                    'fields'].update(data['fields'])
+        locations = [get_storage_location(storage) for storage, _ in groups.values()]
+
+        sources = []
+        for storage, registry in groups.values():
+            location = get_storage_location(storage)
+            skip = location and {
+                other[len(location):].lstrip('/') for other in locations
+                if other and other.startswith(join_path(location, ''))} or ()
+            sources.append(Source(
+                key=get_storage_display(storage)(''),
+                walk=lambda on_directory=None, storage=storage, skip=skip: walk_storage(
+                    storage, options['regex'], on_directory,
+                    exclude=options['exclude'], progress=self.progress, skip=skip),
+                registry=registry,
+                get_path=lambda value: value.replace('\\', '/'),
+                display=get_storage_display(storage),
+                storage=storage,
+            ))
+        return sorted(sources, key=lambda source: source.display(''))
+
     def handle(self, *args, **options):
         # filename = None if options['filename'] == 'none' else options['filename']
         result = options['list']
         regex = None if options['regex'] == 'none' else options['regex']
         if result not in ['fs', 'fsall', 'db', 'dball', 'dbfs', 'dirs', 'nodirs']:
-            sys.stdout.write(
+            self.stdout.write(
                 "Use only 'fs', 'fsall', 'db', 'dball', 'dbfs', "
                 "'dirs', 'nodirs' for -l param."
-                "\nUse 'python manage.py help files_clean' for help message.")
+                "\nUse 'python manage.py help files_clean' for help message.", ending='')
             return
         if not regex:
-            sys.stdout.write(
+            self.stdout.write(
                 "Regex param (-r) is required."
                 "\nUse 'python manage.py help files_clean' for help message."
-                "\nExample: \"^upload/(?!upload(/|$)).*$\"")
+                "\nExample: \"^upload/(?!upload(/|$)).*$\"", ending='')
             return
 
-        registry, dbfilesmeta, dbfiles, fsfiles = {}, {}, [], []
-        directories = {'allowed': [], 'disallowed': []}
-
-        # TODO: use fs or db if it is really need
-        #       fsall - no db, dball - no fs
-
-        # get filesystem files list data
         # TODO: allow to set media_root customizible
         media_root = settings.MEDIA_ROOT.replace('\\', '/')
-        for base, dirs, files in os.walk(media_root):
-            root = base.replace('\\', '/').replace(media_root, '').lstrip('/')
-            if not re.match(regex, root):
-                directories['disallowed'].append(root)
-                continue
-            else:
-                directories['allowed'].append(root)
-            fsfiles += [os.path.join(media_root, root, i).replace('\\', '/') for i in files]
-        fsfiles.sort()
+        move_to = options['move_to'] and os.path.abspath(
+            options['move_to']).replace('\\', '/')
+        if (options['delete'] or move_to) and (
+                result != 'fs' or options['delete'] and move_to):
+            self.stdout.write(
+                "Use only one of --delete or --move-to params with '-l fs'.", ending='')
+            return
+        if move_to and join_path(move_to, '').startswith(join_path(media_root, '')):
+            self.stdout.write(
+                "Quarantine directory (--move-to) must be outside of media_root.", ending='')
+            return
+
+        options['move_to'] = move_to
+        write = self.stdout.write
+        self.progress = Progress(self.stderr) if options['progress'] else None
+        self.cleaner = None
+        self.scan_index = ScanIndex(options['index']) if options['index'] else None
+        try:
+            self.handle_result(media_root, write, **options)
+        except BaseException:
+            self.scan_index and self.scan_index.close(commit=False)
+            raise
+        else:
+            self.scan_index and self.scan_index.close()
+        finally:
+            self.progress and self.progress.finish()
+        if self.cleaner:
+            self.stderr.write('%s%s' % (', '.join(
+                '%s: %s' % (action, self.cleaner.totals[action],)
+                for action in self.cleaner.actions),
+                ' (dry run)' if options['dry_run'] else '',))
 
+    def handle_result(self, media_root, write, **options):
+        """Write result list data for "-l" param value."""
+        result, format = options['list'], options['format']
+        sources = self.get_sources(media_root, **options)
+        sized = format != 'text'
+
+        def get_output(fields, **kwargs):
+            return Output(lambda value: write(value, ending=''), format, fields, **kwargs)
+
+        # directories: walk only, names separated by new line
         if result in ['dirs', 'nodirs']:
-            sys.stdout.write('\n'.join(directories['allowed' if result == 'dirs' else 'disallowed']))
+            allowed = result == 'dirs'
+            output = get_output(('path',))
+            for source in sources:
+                def on_directory(root, is_allowed, display=source.display):
+                    if is_allowed == allowed:
+                        output.record([display(root) if options['storages'] else root])
+
+                for path in source.walk(on_directory):
+                    pass
+            output.finish()
             return
 
-        # get database files list data
-        for model in apps.get_models():
-            fields = dict([(f.name, f) for f in model._meta.fields if isinstance(f, models.FileField)])
+        # delete or move not referenced files, manifest is written, files
+        # of nested storages locations can not be safely compared
+        cleaner = None
+        if options['delete'] or options['move_to']:
+            nested = self.get_nested_locations(sources, media_root)
+            if nested:
+                write("Storages locations overlap (%s), --delete and --move-to"
+                      " are not allowed." % ', '.join(nested), ending='')
+                return
+            output = get_output(('action', 'path', 'info', 'size',), prefix='\n')
+            cleaner = self.cleaner = Cleaner(
+                output.record, move_to=options['move_to'],
+                min_age=options['min_age'] * 60, rate=options['rate'],
+                batch_size=options['batch_size'], dry_run=options['dry_run'],
+                sizes=sized,
+            )
+        elif result in ('fs', 'fsall'):
+            output = get_output(('path', 'size',), prefix='\n')
+        else:
+            output = get_output(('model_name', 'tb_name', 'id', 'field_name', 'path',
+                                 'count', 'size',), header=True)
 
-            for name, field in fields.items():
-                storage = get_storage_by_field(field)
-                if not isinstance(storage, FileSystemStorage):
-                    # TODO: allow to use other storage classes (may be for dbonly commands)
-                    sys.stderr.write('Illegal fileField storage class "%s" (%s, %s).' %
-                                     (storage.__class__.__name__, model.__name__, name))
-                    fields.__delitem__(name)
-                location = storage.location.replace('\\', '/')
-                if not location.startswith(media_root):
-                    sys.stderr.write('Illegal fileField storage location (%s, %s).\n'
-                                     'Current:    %s\nMust be in: %s' %
-                                     (model.__name__, name, location, media_root))
-                    fields.__delitem__(name)
-
-            if not fields or not model.objects.count():
-                continue
-            registry[model.__name__] = {'class': model, 'fields': fields,}
-
-        for data in registry.values():
-            model, fields = data['class'], data['fields']
-            # todo: add isnull support
-            excludes = dict([('%s__exact' % f.name, '') for f in fields.values()])
-            values = model.objects.exclude(**excludes)\
-                          .values('pk', *[f.name for f in fields.values()])
-
-            for i in values:
-                pk = i.pop('pk')
-                for key, val in i.items():
-                    if not val:
-                        continue
-                    val = os.path.join(settings.MEDIA_ROOT, val).replace('\\', '/')
-                    entry = [model.__name__, model._meta.db_table, pk, key, val]
-                    if val in dbfilesmeta:
-                        dbfilesmeta[val].append(entry)
-                    else:
-                        dbfilesmeta[val] = [entry]
-
-        dbfiles = [f for f in dbfilesmeta.keys()]
-        dbfiles.sort()
-        dbfiles = set(dbfiles)
-        fsfiles = set(fsfiles)
-
-        # fsfiles
-        if result in ('fs', 'fsall'):
-            if result == 'fs':
-                difference = list(fsfiles-dbfiles)
-            else:
-                difference = list(fsfiles)
-            difference.sort()
-
-            sys.stdout.write('\n')
-            sys.stdout.write('\n'.join(difference))
-            return
+        for source in sources:
+            # filesystem files sorted stream (not required for "dball")
+            fsfiles = source.walk() if result != 'dball' else ()
 
-        # dbfiles
-        if result in ('db', 'dball', 'dbfs'):
-            if result == 'db':
-                difference = list(dbfiles-fsfiles)
-            elif result == 'dball':
-                difference = list(dbfiles)
-            else:
-                difference = list(dbfiles.intersection(fsfiles))
-            difference.sort()
-
-            sys.stdout.write('model_name\ttb_name\tid\tfield_name\tpath\tcount')
-            for i in difference:
-                sys.stdout.write('\n')
-                sys.stdout.write('\n'.join([
-                    '\t'.join([str(b) for b in (a+[len(dbfilesmeta[i])])]) for a in dbfilesmeta[i]
-                ]))
-            return
+            # database files references sorted index (not required for "fsall")
+            dbfiles = ReferencesIndex() if result == 'fsall' else self.get_references(
+                source.registry, options['chunk_size'], source.get_path,
+                options['db_workers'], source.key)
+
+            try:
+                # fsfiles
+                if result in ('fs', 'fsall'):
+                    for path, isfile, entries in merge_join(fsfiles, dbfiles):
+                        if not isfile or result == 'fs' and entries:
+                            continue
+                        if cleaner:
+                            name = path if source.storage else path[len(media_root):]
+                            cleaner.add(path, name.lstrip('/'), source.display(path),
+                                        source.storage)
+                            continue
+                        size = get_size(path, source.storage) if sized else None
+                        output.record([source.display(path), size], size)
+                    cleaner and cleaner.flush()
+
+                # dbfiles
+                if result in ('db', 'dball', 'dbfs'):
+                    for path, isfile, entries in merge_join(fsfiles, dbfiles):
+                        if not entries or (result == 'db' and isfile or
+                                           result == 'dbfs' and not isfile):
+                            continue
+                        # files are not walked for "dball", size is None if not exists
+                        size = (get_size(path, source.storage)
+                                if sized and (isfile or result == 'dball') else None)
+                        for a in entries:
+                            output.record(a[:4] + [source.display(a[4]), len(entries), size],
+                                          size)
+            finally:
+                dbfiles.close()
+        output.finish()
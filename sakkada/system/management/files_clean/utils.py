@@ -0,0 +1,582 @@
+"""
+Streaming helpers of files_clean command.
+
+Filesystem files are walked with os.scandir in sorted order (the same as
+sorted() of full paths), database files references are stored in on-disk
+sorted index (temporary sqlite database) and both sorted streams are
+merge-joined, so memory usage does not depend on files count.
+"""
+
+import os
+import re
+import csv
+import time
+import json
+import shutil
+import posixpath
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime
+from collections import namedtuple
+from queue import Queue, Full
+from concurrent.futures import ThreadPoolExecutor
+
+
+def join_path(root, *names):
+    return os.path.join(root, *names).replace('\\', '/')
+
+
+def scan_directory(media_root, root):
+    """
+    Get sorted (key, entry, is_dir) entries of directory, directories are
+    sorted by name with trailing slash, so files paths are walked in sorted
+    order of full paths.
+    """
+    try:
+        with os.scandir(join_path(media_root, root)) as iterator:
+            return sorted(
+                (entry.name + '/' if is_dir else entry.name, entry, is_dir,)
+                for entry, is_dir in ((i, i.is_dir(),) for i in iterator))
+    except OSError:
+        return []
+
+
+def walk_files(media_root, regex, on_directory=None, root='',
+               exclude=None, progress=None, scan=None):
+    """
+    Walk media_root recursively and yield files paths in sorted order,
+    files of directories, which relative paths do not match regex, are
+    skipped. on_directory(root, allowed) is called for each directory.
+    Directories matching exclude regex are pruned (not walked, reported
+    as not allowed). Symlinks to directories are not followed (as in
+    os.walk). Progress.update is called for each file. scan(media_root, root)
+    function returns directory entries (scan_directory by default).
+    """
+    allowed = bool(re.match(regex, root))
+    on_directory and on_directory(root, allowed)
+
+    for key, entry, is_dir in (scan or scan_directory)(media_root, root):
+        if is_dir:
+            if entry.is_symlink():
+                continue
+            subroot = join_path(root, entry.name).lstrip('/')
+            if exclude and re.match(exclude, subroot):
+                on_directory and on_directory(subroot, False)
+                continue
+            yield from walk_files(media_root, regex, on_directory, subroot,
+                                  exclude, progress, scan)
+        else:
+            progress and progress.update()
+            if allowed:
+                yield join_path(media_root, root, entry.name)
+
+
+def listdir(storage, path):
+    """
+    Get (directories, files) of storage path. If storage defines
+    listdir_pages(path) method, yielding (directories, files) pages
+    (paged listing of object storages), pages are joined, else
+    storage.listdir is used. Not existing paths are empty.
+    """
+    try:
+        if hasattr(storage, 'listdir_pages'):
+            directories, files = [], []
+            for page_directories, page_files in storage.listdir_pages(path):
+                directories.extend(page_directories)
+                files.extend(page_files)
+            return directories, files
+        return storage.listdir(path)
+    except (OSError, NotImplementedError):
+        return [], []
+
+
+def walk_storage(storage, regex, on_directory=None, root='',
+                 exclude=None, progress=None, skip=()):
+    """
+    Walk storage recursively by listdir like walk_files, but yield files
+    names (relative to storage root) in sorted order. Directories in 'skip'
+    (e.g. locations of nested storages) are not walked and not reported.
+    """
+    allowed = bool(re.match(regex, root))
+    on_directory and on_directory(root, allowed)
+
+    directories, files = listdir(storage, root)
+    entries = sorted([(name + '/', name, True,) for name in directories] +
+                     [(name, name, False,) for name in files])
+    for key, name, is_dir in entries:
+        name = posixpath.join(root, name)
+        if is_dir:
+            if name in skip:
+                continue
+            if exclude and re.match(exclude, name):
+                on_directory and on_directory(name, False)
+                continue
+            yield from walk_storage(storage, regex, on_directory, name,
+                                    exclude, progress, skip)
+        else:
+            progress and progress.update()
+            if allowed:
+                yield name
+
+
+class Cancelled(Exception):
+    pass
+
+
+def walk_files_parallel(media_root, regex, workers, on_directory=None,
+                        exclude=None, progress=None, queue_size=10000,
+                        scan=None):
+    """
+    Walk media_root like walk_files, but top-level subdirectories are walked
+    concurrently in thread pool of 'workers' threads. Results of each
+    subdirectory are passed through bounded queue and yielded in the same
+    sorted order, on_directory is called in caller thread.
+    """
+    stop = threading.Event()
+
+    def put(queue, item):
+        while not stop.is_set():
+            try:
+                return queue.put(item, timeout=0.1)
+            except Full:
+                pass
+        raise Cancelled
+
+    def walk(queue, root):
+        try:
+            for path in walk_files(
+                    media_root, regex, root=root, exclude=exclude,
+                    progress=progress, scan=scan, on_directory=lambda root, allowed: put(
+                        queue, ('dir', (root, allowed,),))):
+                put(queue, ('file', path,))
+            put(queue, ('end', None,))
+        except Cancelled:
+            pass
+        except Exception as e:
+            put(queue, ('error', e,))
+
+    allowed = bool(re.match(regex, ''))
+    on_directory and on_directory('', allowed)
+
+    # files of top-level directory and queues of subdirectories in order
+    items = []
+    for key, entry, is_dir in (scan or scan_directory)(media_root, ''):
+        if not is_dir:
+            progress and progress.update()
+            allowed and items.append(join_path(media_root, '', entry.name))
+        elif not entry.is_symlink():
+            if exclude and re.match(exclude, entry.name):
+                items.append(('excluded', entry.name,))
+            else:
+                items.append((Queue(queue_size), entry.name,))
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for item in items:
+            if isinstance(item, tuple) and item[0] != 'excluded':
+                pool.submit(walk, *item)
+
+        for item in items:
+            if not isinstance(item, tuple):
+                yield item
+                continue
+            if item[0] == 'excluded':
+                on_directory and on_directory(item[1], False)
+                continue
+            while True:
+                kind, value = item[0].get()
+                if kind == 'end':
+                    break
+                elif kind == 'error':
+                    raise value
+                elif kind == 'dir':
+                    on_directory and on_directory(*value)
+                else:
+                    yield value
+    finally:
+        stop.set()
+        pool.shutdown(wait=True)
+
+
+def iterate_parallel(function, tasks, workers, finalize=None, queue_size=16):
+    """
+    Yield items of function(*task) generators of all tasks, generators are
+    run in thread pool of "workers" threads (serially in caller thread if
+    workers < 2), items are passed through bounded queue in any order.
+    finalize() is called in each task thread after generator is exhausted
+    (for example, to close thread database connections).
+    """
+    if workers < 2:
+        for task in tasks:
+            yield from function(*task)
+        return
+
+    stop, queue = threading.Event(), Queue(queue_size)
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                return queue.put(item, timeout=0.1)
+            except Full:
+                pass
+        raise Cancelled
+
+    def run(task):
+        try:
+            for item in function(*task):
+                put(('item', item,))
+            put(('end', None,))
+        except Cancelled:
+            pass
+        except Exception as e:
+            put(('error', e,))
+        finally:
+            finalize and finalize()
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for task in tasks:
+            pool.submit(run, task)
+        running = len(tasks)
+        while running:
+            kind, value = queue.get()
+            if kind == 'end':
+                running -= 1
+            elif kind == 'error':
+                raise value
+            else:
+                yield value
+    finally:
+        stop.set()
+        pool.shutdown(wait=True)
+
+
+class Progress(object):
+    """Thread-safe processed files counter, writes files/sec to stream."""
+
+    def __init__(self, stream, interval=1.0):
+        self.stream, self.interval = stream, interval
+        self.count, self.lock = 0, threading.Lock()
+        self.started = self.reported = time.monotonic()
+
+    def update(self, count=1):
+        with self.lock:
+            self.count += count
+            now = time.monotonic()
+            if now - self.reported >= self.interval:
+                self.reported = now
+                self.write(now)
+
+    def write(self, now, ending=''):
+        elapsed = max(now - self.started, 0.001)
+        self.stream.write('\rfiles: %d, %.1f files/sec' % (
+            self.count, self.count / elapsed,), ending=ending)
+
+    def finish(self):
+        self.write(time.monotonic(), ending='\n')
+
+
+def get_size(path, storage=None):
+    """Get size of file (or of storage file) or None if not available."""
+    try:
+        return os.lstat(path).st_size if storage is None else storage.size(path)
+    except (OSError, NotImplementedError):
+        return None
+
+
+class Output(object):
+    """
+    Streamed output of records (values of fields) in format: "text" (tab
+    separated values without size and None values, records are separated
+    by new line, no totals), "jsonl" (JSON object per line), "csv" (with
+    header row) or "null" (no records). Formats except "text" are ended
+    by totals: count of records and sum of sizes in bytes, as JSON object
+    {"totals": {...}} or CSV row "#totals,count,bytes".
+    """
+
+    formats = ('text', 'jsonl', 'csv', 'null',)
+
+    def __init__(self, write, format='text', fields=(), prefix='', header=False):
+        self.write, self.format, self.fields = write, format, fields
+        self.count, self.bytes, self.items = 0, 0, 0
+        if format == 'text':
+            write('\t'.join(i for i in fields if i != 'size') if header else prefix)
+            self.items = int(header)
+        elif format == 'csv':
+            self.csv = csv.writer(self, lineterminator='\n')
+            self.csv.writerow(fields)
+
+    def record(self, values, size=None):
+        self.count += 1
+        self.bytes += size or 0
+        if self.format == 'text':
+            self.write('%s%s' % ('\n' if self.items else '', '\t'.join(
+                str(value) for field, value in zip(self.fields, values)
+                if field != 'size' and value is not None)))
+            self.items += 1
+        elif self.format == 'jsonl':
+            self.write(json.dumps(dict(zip(self.fields, values))) + '\n')
+        elif self.format == 'csv':
+            self.csv.writerow(values)
+
+    def finish(self):
+        if self.format == 'csv':
+            self.csv.writerow(('#totals', self.count, self.bytes,))
+        elif self.format != 'text':
+            self.write(json.dumps({'totals': {'count': self.count,
+                                              'bytes': self.bytes}}) + '\n')
+
+
+class Cleaner(object):
+    """
+    Delete files or move them to quarantine directory (move_to, relative
+    paths are kept) in batches. Files modified less than min_age seconds
+    ago are skipped (not finished uploads), speed is limited to rate
+    files/sec (sleep after each batch). Each file is reported to write
+    as manifest line "action\tpath[\tinfo]", action is delete, move, skip
+    or error, nothing is changed if dry_run. Paths are filesystem paths
+    or names of storage (if passed, see Storage API). Manifest values
+    (action, path, info, size) are passed to write(values, size), size of
+    file is got before action if sizes is True. Existing files in
+    quarantine directory are never overwritten: moved file gets unique
+    name ("name_1.ext", ...), which is reported as info of move action.
+    """
+
+    actions = ('delete', 'move', 'skip', 'error',)
+
+    def __init__(self, write, move_to=None, min_age=3600, rate=None,
+                 batch_size=100, dry_run=False, sizes=False):
+        self.write, self.move_to, self.dry_run = write, move_to, dry_run
+        self.sizes = sizes
+        self.min_age, self.rate, self.batch_size = min_age, rate, batch_size
+        self.batch, self.processed, self.started = [], 0, None
+        self.totals = dict.fromkeys(self.actions, 0)
+
+    def add(self, path, name, display, storage=None):
+        """Add file to batch, name is path relative to quarantine directory."""
+        self.batch.append((path, name, display, storage,))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Process current batch, sleep if rate is exceeded."""
+        if not self.batch:
+            return
+        if self.started is None:
+            self.started = time.monotonic()
+        for item in self.batch:
+            self.process(*item)
+        self.processed += len(self.batch)
+        self.batch = []
+        if self.rate:
+            delay = self.processed / self.rate - (time.monotonic() - self.started)
+            delay > 0 and time.sleep(delay)
+
+    def process(self, path, name, display, storage=None):
+        action = 'move' if self.move_to else 'delete'
+        info = join_path(self.move_to, name) if self.move_to else None
+        size = get_size(path, storage) if self.sizes else None
+        try:
+            if self.get_age(path, storage) < self.min_age:
+                action, info = 'skip', None
+            elif self.move_to:
+                info = self.get_target(info)
+                self.dry_run or self.move(path, info, storage)
+            elif not self.dry_run:
+                self.delete(path, storage)
+        except (OSError, NotImplementedError) as e:
+            action, info = 'error', str(e) or e.__class__.__name__
+        self.totals[action] += 1
+        self.write([action, display, info, size], size)
+
+    def get_age(self, path, storage=None):
+        if storage is None:
+            return time.time() - os.lstat(path).st_mtime
+        modified = storage.get_modified_time(path)
+        return (datetime.now(modified.tzinfo) - modified).total_seconds()
+
+    def delete(self, path, storage=None):
+        if storage is None:
+            os.remove(path)
+        else:
+            storage.delete(path)
+
+    def get_target(self, target):
+        """Get not existing target path, add "_{number}" suffix if required."""
+        root, ext = os.path.splitext(target)
+        number = 0
+        while os.path.lexists(target):
+            number += 1
+            target = '%s_%s%s' % (root, number, ext,)
+        return target
+
+    def move(self, path, target, storage=None):
+        """Move file to not existing target, FileExistsError is raised else."""
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if storage is None:
+            if os.path.lexists(target):
+                raise FileExistsError('Target file exists: %s' % target)
+            shutil.move(path, target)
+            return
+        with storage.open(path, 'rb') as source, open(target, 'xb') as destination:
+            shutil.copyfileobj(source, destination)
+        storage.delete(path)
+
+
+class ReferencesIndex(object):
+    """
+    On-disk index of database files references: rows (path, model_name,
+    table_name, pk, field_name, number) are stored in temporary sqlite
+    database and iterated grouped by path in sorted order, entries of
+    path are ordered by (number, pk, field_name), so the order does not
+    depend on insertion order.
+    """
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix='files_clean')
+        self.db = sqlite3.connect(os.path.join(self.directory, 'refs.sqlite3'))
+        self.db.execute('CREATE TABLE refs (path TEXT, model TEXT,'
+                        ' tb TEXT, pk, field TEXT, number INTEGER)')
+        self.indexed = False
+
+    def add(self, rows):
+        self.db.executemany('INSERT INTO refs VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def __iter__(self):
+        """Yield (path, [entries]) in sorted by path order."""
+        if not self.indexed:
+            self.db.commit()
+            self.db.execute('CREATE INDEX refs_path ON refs (path)')
+            self.indexed = True
+
+        path, entries = None, []
+        for row in self.db.execute('SELECT path, model, tb, pk, field FROM refs'
+                                   ' ORDER BY path, number, pk, field'):
+            if row[0] != path and entries:
+                yield path, entries
+                entries = []
+            path = row[0]
+            entries.append([row[1], row[2], row[3], row[4], row[0]])
+        if entries:
+            yield path, entries
+
+    def close(self):
+        self.db.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class Entry(namedtuple('Entry', ('name', 'symlink',))):
+    """Directory entry stored in ScanIndex (os.DirEntry-like)."""
+
+    def is_symlink(self):
+        return self.symlink
+
+
+class ScanIndex(object):
+    """
+    Persistent (sqlite file) index of files_clean runs.
+
+    Directories entries are stored with directory mtime, directory is
+    listed again only if its mtime is changed (entries added, removed or
+    renamed), else stored entries are used (directory is only stat'ed).
+    Recently changed directories (mtime in last "delay" seconds) are not
+    stored because of mtime resolution.
+
+    Database references are stored by key (source, model and fields),
+    incremental reading state is stored as mark of key (see set_mark).
+    """
+
+    def __init__(self, filename, delay=2):
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.lock, self.delay = threading.Lock(), delay
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime INTEGER,
+                                             entries TEXT);
+            CREATE TABLE IF NOT EXISTS refs (key TEXT, pk, field TEXT, path TEXT);
+            CREATE INDEX IF NOT EXISTS refs_key_pk ON refs (key, pk);
+            CREATE TABLE IF NOT EXISTS marks (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TEMP TABLE pks (pk PRIMARY KEY);
+        """)
+
+    def scan(self, media_root, root):
+        """Get directory entries like scan_directory, stored if not changed."""
+        path = join_path(media_root, root)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return []
+
+        with self.lock:
+            row = self.db.execute('SELECT mtime, entries FROM dirs WHERE path = ?',
+                                  (path,)).fetchone()
+        if row and row[0] == mtime:
+            return [(name + '/' if is_dir else name, Entry(name, symlink), is_dir,)
+                    for name, is_dir, symlink in json.loads(row[1])]
+
+        entries = scan_directory(media_root, root)
+        if time.time() - mtime / 10 ** 9 > self.delay:
+            data = json.dumps([(entry.name, is_dir, is_dir and entry.is_symlink(),)
+                               for key, entry, is_dir in entries])
+            with self.lock:
+                self.db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)',
+                                (path, mtime, data,))
+        return entries
+
+    def get_mark(self, key):
+        row = self.db.execute('SELECT value FROM marks WHERE key = ?', (key,)).fetchone()
+        return row and row[0]
+
+    def set_mark(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO marks VALUES (?, ?)', (key, value,))
+
+    def add_refs(self, key, rows):
+        """Add (pk, field, path) rows of key."""
+        self.db.executemany('INSERT INTO refs VALUES (?, ?, ?, ?)',
+                            ((key, pk, field, path,) for pk, field, path in rows))
+
+    def delete_refs(self, key, pks=None):
+        """Delete references of key (only of pks if passed)."""
+        if pks is None:
+            self.db.execute('DELETE FROM refs WHERE key = ?', (key,))
+            return
+        self.db.executemany('DELETE FROM refs WHERE key = ? AND pk = ?',
+                            ((key, pk,) for pk in pks))
+
+    def keep_refs(self, key, pks):
+        """Delete references of key with pk not in pks (deleted rows)."""
+        self.db.execute('DELETE FROM pks')
+        self.db.executemany('INSERT OR IGNORE INTO pks VALUES (?)',
+                            ((pk,) for pk in pks))
+        self.db.execute('DELETE FROM refs WHERE key = ? AND pk NOT IN'
+                        ' (SELECT pk FROM pks)', (key,))
+        self.db.execute('DELETE FROM pks')
+
+    def get_refs(self, key):
+        """Yield (pk, field, path) rows of key."""
+        return self.db.execute('SELECT pk, field, path FROM refs WHERE key = ?', (key,))
+
+    def close(self, commit=True):
+        commit and self.db.commit()
+        self.db.close()
+
+
+def merge_join(fs_paths, db_paths):
+    """
+    Merge-join sorted streams of filesystem paths and (path, entries) of
+    database references, yield (path, exists_on_fs, entries or None).
+    """
+    fs_paths, db_paths = iter(fs_paths), iter(db_paths)
+    fs_path = next(fs_paths, None)
+    db_path, entries = next(db_paths, (None, None,))
+    while fs_path is not None or db_path is not None:
+        if db_path is None or (fs_path is not None and fs_path < db_path):
+            yield fs_path, True, None
+            fs_path = next(fs_paths, None)
+        elif fs_path is None or db_path < fs_path:
+            yield db_path, False, entries
+            db_path, entries = next(db_paths, (None, None,))
+        else:
+            yield fs_path, True, entries
+            fs_path = next(fs_paths, None)
+            db_path, entries = next(db_paths, (None, None,))
@@ -1,5 +1,8 @@
-from .shortcuts import paginator
-from .pagination import Pagination
+from .shortcuts import paginator, keyset_paginator
+from .pagination import Pagination, PaginationWindow
+from .keyset import KeysetPaginator
+from .count import CountPaginator, NoCountPaginator
 
 
-__all__ = ('paginator', 'Pagination',)
+__all__ = ('paginator', 'keyset_paginator', 'Pagination', 'PaginationWindow',
+           'KeysetPaginator', 'CountPaginator', 'NoCountPaginator',)
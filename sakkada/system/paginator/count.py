@@ -0,0 +1,220 @@
+import json
+import hashlib
+from django.core.cache import caches
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import (
+    Paginator, Page, EmptyPage, PageNotAnInteger)
+from django.db import connections
+from django.db.models.query import QuerySet
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+
+
+def get_exact_count(object_list):
+    """Exact count: COUNT(*) for querysets, len for other sequences."""
+    if isinstance(object_list, QuerySet):
+        return object_list.count()
+    return len(object_list)
+
+
+def get_count_cache_key(queryset, prefix='sakkada.paginator.count'):
+    """Get cache key of queryset count by its sql or None if empty."""
+    try:
+        sql = queryset.query.get_compiler(queryset.db).as_sql()
+    except EmptyResultSet:
+        return None
+    return '%s:%s' % (prefix, hashlib.md5(
+        repr((queryset.db, sql,)).encode()).hexdigest(),)
+
+
+def get_cached_count(object_list, cache_alias='default', timeout=300):
+    """Exact count, cached in django cache by queryset sql for timeout."""
+    key = (get_count_cache_key(object_list)
+           if isinstance(object_list, QuerySet) else None)
+    if key is None:
+        return get_exact_count(object_list)
+
+    cache = caches[cache_alias]
+    count = cache.get(key)
+    if count is None:
+        count = get_exact_count(object_list)
+        cache.set(key, count, timeout)
+    return count
+
+
+def get_postgresql_estimate(queryset, connection):
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            # whole table: statistics value (-1 since postgresql 14 and 0
+            # before it if table is never vacuumed or analyzed, so not
+            # positive values are unknown and exact count is used)
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            return int(row[0]) if row and row[0] > 0 else None
+
+        sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+        cursor.execute('EXPLAIN (FORMAT JSON) %s' % sql, params)
+        plan = cursor.fetchone()[0]
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+def get_mysql_estimate(queryset, connection):
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                'SELECT TABLE_ROWS FROM information_schema.TABLES'
+                ' WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+                [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            return int(row[0]) if row and row[0] is not None else None
+
+        sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+        cursor.execute('EXPLAIN FORMAT=JSON %s' % sql, params)
+        plan = json.loads(cursor.fetchone()[0])['query_block']
+        table = plan.get('table') or plan.get('ordering_operation', {}).get('table', {})
+        rows = table.get('rows_produced_per_join')
+        return int(rows) if rows is not None else None
+
+
+ESTIMATORS = {
+    'postgresql': get_postgresql_estimate,
+    'mysql': get_mysql_estimate,
+}
+
+
+def get_estimated_count(object_list):
+    """
+    Estimated count: postgresql table statistics (reltuples) or EXPLAIN rows
+    estimate, mysql information_schema or EXPLAIN rows estimate. Exact count
+    is used for other backends, sequences, distinct, grouped and sliced
+    querysets, and if estimate is not available.
+    """
+    if not isinstance(object_list, QuerySet):
+        return get_exact_count(object_list)
+
+    query = object_list.query
+    connection = connections[object_list.db]
+    estimator = ESTIMATORS.get(connection.vendor)
+    if (estimator is None or query.distinct or query.combinator or
+            query.group_by is not None or
+            query.low_mark or query.high_mark is not None):
+        return get_exact_count(object_list)
+
+    try:
+        count = estimator(object_list, connection)
+    except EmptyResultSet:
+        return 0
+    return get_exact_count(object_list) if count is None else count
+
+
+COUNT_STRATEGIES = {
+    'exact': get_exact_count,
+    'cached': get_cached_count,
+    'estimated': get_estimated_count,
+}
+
+
+class CountPaginator(Paginator):
+    """
+    Paginator with count strategy: "exact" (default), "cached" (exact count
+    stored in django cache for cache_timeout seconds, keyed by queryset sql),
+    "estimated" (see get_estimated_count) or callable(object_list), the
+    last two are considered as not exact.
+    """
+
+    cache_alias = 'default'
+    cache_timeout = 300
+
+    def __init__(self, object_list, per_page, count='exact',
+                 cache_timeout=None, **kwargs):
+        if not callable(count) and count not in COUNT_STRATEGIES:
+            raise ValueError('Count strategy should be one of %s or'
+                             ' callable.' % ', '.join(COUNT_STRATEGIES))
+        self.count_strategy = count
+        if cache_timeout is not None:
+            self.cache_timeout = cache_timeout
+        super().__init__(object_list, per_page, **kwargs)
+
+    @property
+    def exact(self):
+        """Count is exact ("exact" and "cached" strategies)."""
+        return self.count_strategy in ('exact', 'cached',)
+
+    def validate_number(self, number):
+        """
+        Validate page number, numbers after last page are not rejected for
+        not exact count (estimated count can be less than real one), such
+        pages are empty if they are really out of range.
+        """
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            number = int(number)
+            if self.exact or number < 1:
+                raise
+            return number
+
+    def page(self, number):
+        """Page, rows of not exact count pages are not limited by count."""
+        if self.exact:
+            return super().page(number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page],
+                              number, self)
+
+    @cached_property
+    def count(self):
+        if callable(self.count_strategy):
+            return self.count_strategy(self.object_list)
+        if self.count_strategy == 'cached':
+            return get_cached_count(self.object_list, self.cache_alias,
+                                    self.cache_timeout)
+        return COUNT_STRATEGIES[self.count_strategy](self.object_list)
+
+
+class NoCountPage(Page):
+    """Page of NoCountPaginator, has_next is known from fetched rows."""
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+    def end_index(self):
+        return (self.number - 1) * self.paginator.per_page + len(self)
+
+
+class NoCountPaginator(Paginator):
+    """
+    Paginator without count: per_page+1 rows are fetched to detect next
+    page, count and num_pages are unknown (None). Out of range pages
+    are empty (except first page if allow_empty_first_page is False).
+    """
+
+    count = None
+    num_pages = None
+
+    def validate_number(self, number):
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_('That page number is not an integer'))
+        if number < 1:
+            raise EmptyPage(_('That page number is less than 1'))
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        objects = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not objects and number == 1 and not self.allow_empty_first_page:
+            raise EmptyPage(_('That page contains no results'))
+        return NoCountPage(objects[:self.per_page], number, self,
+                           len(objects) > self.per_page)
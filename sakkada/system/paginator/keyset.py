@@ -0,0 +1,177 @@
+import json
+import base64
+import collections.abc
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import InvalidPage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, connections
+from django.db.models.expressions import OrderBy
+from django.utils.functional import cached_property
+from sakkada.models.prev_next import PrevNextModel
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+class KeysetPaginator(object):
+    """
+    Keyset (cursor) paginator for PrevNextModel querysets.
+
+    Usage:
+        paginator = KeysetPaginator(queryset, per_page=20)
+        page = paginator.page(request.GET.get('cursor'))
+        # page.next_cursor and page.previous_cursor are opaque strings
+        # (or None) for links to next and previous pages
+
+    Ordering of queryset is converted to unique ordering (pk is appended,
+    see PrevNextModel._get_current_ordering), cursor contains ordering values
+    of first or last row of page, next and previous pages are selected by
+    "after/before this row" filter with LIMIT per_page+1 (no COUNT and OFFSET
+    queries). If 'count' is set (integer or True to calculate it), cursors
+    also contain page numbers and paginator has "count" and "num_pages"
+    values, so page can be used with Pagination.
+    """
+
+    def __init__(self, queryset, per_page, count=None, nulls_first=None):
+        model = queryset.model
+        if not issubclass(model, PrevNextModel):
+            raise ValueError('KeysetPaginator supports only querysets of'
+                             ' PrevNextModel subclasses.')
+
+        self.queryset, self.per_page = queryset, int(per_page)
+        self.model, self.using = model, queryset.db
+        self.nulls_first = (
+            connections[self.using].features.nulls_order_largest
+            if nulls_first is None else bool(nulls_first))
+        if count is not None:
+            self.count = queryset.count() if count is True else int(count)
+
+        # related fields are annotated too, so all ordering values
+        # of page objects are accessible as attributes
+        ordering = model._get_current_ordering(queryset)
+        ordering = [
+            OrderBy(models.F(i.lstrip('-')), descending=i.startswith('-'))
+            if isinstance(i, str) and '__' in i else i for i in ordering
+        ]
+        self.annotated, self.ordering, _ = model._annotate_ordering(
+            queryset, ordering)
+        self.names = [i.lstrip('-') for i in self.ordering]
+        self.attnames = [self.get_attname(name) for name in self.names]
+
+    def get_attname(self, name):
+        try:
+            return self.model._meta.get_field(name).attname
+        except FieldDoesNotExist:
+            return name
+
+    @cached_property
+    def num_pages(self):
+        if not hasattr(self, 'count'):
+            return None
+        return max(self.count // self.per_page + bool(
+            self.count % self.per_page), 1)
+
+    def encode_cursor(self, obj, is_next, number=None):
+        data = {'v': [getattr(obj, name) for name in self.attnames],
+                'd': 'n' if is_next else 'p',}
+        if number is not None:
+            data['n'] = number
+        data = json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Decode cursor to (values dict, is_next, number)."""
+        try:
+            data = base64.urlsafe_b64decode(
+                cursor.encode() + b'=' * (-len(cursor) % 4))
+            data = json.loads(data.decode())
+            values, is_next = data['v'], data['d'] == 'n'
+            if len(values) != len(self.names):
+                raise ValueError
+            query = self.annotated.query.clone()
+            values = {
+                name: value if value is None else
+                query.resolve_ref(name).output_field.to_python(value)
+                for name, value in zip(self.names, values)
+            }
+            number = data.get('n')
+            number = int(number) if number is not None else None
+        except Exception:
+            raise InvalidCursor('Invalid cursor value.')
+        return values, is_next, number
+
+    def page(self, cursor=None):
+        """Get page by cursor, first page if cursor is empty."""
+        queryset, ordering = self.annotated, self.ordering
+        is_next, number = True, 1
+
+        if cursor:
+            values, is_next, number = self.decode_cursor(cursor)
+            if is_next:
+                directions = [not i.startswith('-') for i in ordering]
+            else:
+                directions = [i.startswith('-') for i in ordering]
+                ordering = [i.lstrip('-') if b else '-%s' % i
+                            for i, b in zip(ordering, directions)]
+            queryset = queryset.filter(self.model._get_nextprev_filter(
+                self.names, directions, self.nulls_first, values))
+
+        objects = list(queryset.order_by(*ordering)[0:self.per_page + 1])
+        more = len(objects) > self.per_page
+        objects = objects[0:self.per_page]
+        if not is_next:
+            objects.reverse()
+
+        return KeysetPage(
+            objects, self, number=number if hasattr(self, 'count') else None,
+            has_next=more if is_next else True,
+            has_previous=bool(cursor) if is_next else more,
+        )
+
+
+class KeysetPage(collections.abc.Sequence):
+    def __init__(self, object_list, paginator, number=None,
+                 has_next=False, has_previous=False):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.number = number
+        self._has_next, self._has_previous = has_next, has_previous
+
+    def __repr__(self):
+        return '<Keyset page %s>' % (self.number or '',)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def next_page_number(self):
+        return self.number + 1 if self.number is not None else None
+
+    def previous_page_number(self):
+        return self.number - 1 if self.number is not None else None
+
+    @cached_property
+    def next_cursor(self):
+        if not self.has_next():
+            return None
+        return self.paginator.encode_cursor(
+            self.object_list[-1], True, self.next_page_number())
+
+    @cached_property
+    def previous_cursor(self):
+        if not self.has_previous():
+            return None
+        return self.paginator.encode_cursor(
+            self.object_list[0], False, self.previous_page_number())
@@ -1,3 +1,7 @@
+from functools import lru_cache
+from collections import namedtuple
+
+
 class PaginationBase(object):
     """
     Usage:
@@ -11,6 +15,12 @@ class PaginationBase(object):
     """
 
     def __init__(self, page, paginate=True):
+        self.number, self.pages = self.get_number_and_pages(page)
+        paginate and self.paginate()
+
+    @staticmethod
+    def get_number_and_pages(page):
+        """Get (number, pages) values from page object or dict."""
         if isinstance(page, dict):
             if 'pages' in page:
                 pages = page['pages'] or 1
@@ -22,9 +32,7 @@ class PaginationBase(object):
         else:
             pages = page.paginator.num_pages
             number = page.number
-
-        self.pages, self.number = pages, number
-        paginate and self.paginate()
+        return number, pages
 
     def paginate(self):
         raise NotImplementedError
@@ -97,3 +105,91 @@ class Pagination(PaginationBase):
 
         for i in range(start, end + 1):
             self.pages.append({'current': i == number, 'number': i,})
+
+
+PageItem = namedtuple('PageItem', ('number', 'current',))
+
+
+class PaginationWindow(object):
+    """
+    Immutable variant of Pagination with the same template interface,
+    page items are generated on each "pages" access (PageItem tuples).
+    Instances are cached by (number, pages, window) in LRU cache, so
+    several paginators on the same page share one object.
+
+    usage:
+        pagination = PaginationWindow(page, window=2)
+        pagination = PaginationWindow.get(number=3, pages=10, window=2)
+        page = paginator(queryset, request, pagination=PaginationWindow)
+    """
+
+    __slots__ = ('number', 'num_pages', 'window', 'start', 'end',)
+
+    window_default = 2
+    cache_size = 1024
+
+    def __new__(cls, page, window=None):
+        number, pages = PaginationBase.get_number_and_pages(page)
+        window = window if isinstance(window, int) and window > 0 else None
+        return cls.get(number, pages, window or cls.window_default)
+
+    @classmethod
+    @lru_cache(maxsize=cache_size)
+    def get(cls, number, pages, window):
+        # get start and end values (see Pagination.paginate)
+        start = max(number - window, 1)
+        end = min(number + window, pages)
+
+        # save window*2 count
+        if (number - start) < window:
+            end = end + (window - (number - start))
+        elif (end - number) < window:
+            start = start - (window - (end - number))
+
+        self = object.__new__(cls)
+        for name, value in (('number', number), ('num_pages', pages),
+                            ('window', window), ('start', max(start, 1)),
+                            ('end', min(end, pages)),):
+            object.__setattr__(self, name, value)
+        return self
+
+    def __setattr__(self, name, value):
+        raise AttributeError('PaginationWindow is immutable.')
+
+    __delattr__ = __setattr__
+
+    def __repr__(self):
+        return '<PaginationWindow %s of %s>' % (self.number, self.num_pages,)
+
+    @property
+    def pages(self):
+        return (PageItem(i, i == self.number)
+                for i in range(self.start, self.end + 1))
+
+    @property
+    def current(self):
+        return self.number
+
+    @property
+    def prev(self):
+        return self.number - 1 if self.number > 1 else None
+
+    @property
+    def next(self):
+        return self.number + 1 if self.number < self.num_pages else None
+
+    @property
+    def first(self):
+        return 1 if self.start > 1 else None
+
+    @property
+    def last(self):
+        return self.num_pages if self.end < self.num_pages else None
+
+    @property
+    def dots_left(self):
+        return self.start - 1 if self.start - 1 > 1 else None
+
+    @property
+    def dots_right(self):
+        return self.end + 1 if self.end + 1 < self.num_pages else None
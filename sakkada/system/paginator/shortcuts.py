@@ -1,9 +1,12 @@
-from django.core.paginator import Paginator, InvalidPage, EmptyPage
+from django.core.paginator import InvalidPage, EmptyPage
 from django.http import HttpRequest
 from .pagination import Pagination
+from .count import CountPaginator, NoCountPaginator
+from .keyset import KeysetPaginator, InvalidCursor
 
 
-def paginator(queryset, number=None, per_page=10, pagination=True):
+def paginator(queryset, number=None, per_page=10, pagination=True,
+              count='exact', count_timeout=None, clamp=True):
     """
     paginator shortcut
     :param queryset, model queryset for pagination
@@ -11,6 +14,15 @@ def paginator(queryset, number=None, per_page=10, pagination=True):
            from request.GET page param (?page=1)
     :param per_page, items per page
     :param pagination class or None
+    :param count, count strategy: "exact", "cached", "estimated"
+           or callable, see CountPaginator, if None, count is not
+           calculated, per_page+1 rows are fetched to detect next page
+           (see NoCountPaginator)
+    :param count_timeout, cache timeout of "cached" count
+    :param clamp, clamp out of range page number by count before slicing,
+           only for exact counts ("exact" and "cached"), with not exact
+           counts pages after estimated last page are sliced and empty
+           one is replaced by estimated last page
     """
 
     # get page number
@@ -18,22 +30,72 @@ def paginator(queryset, number=None, per_page=10, pagination=True):
         number = number.GET.get('page', 1)
     try:
         number = abs(int(number)) or 1
-    except ValueError:
+    except (TypeError, ValueError):
         number = 1
 
     # get paginator object
-    paginator = Paginator(queryset, per_page)
+    if count is None:
+        paginator = NoCountPaginator(queryset, per_page)
+    else:
+        paginator = CountPaginator(queryset, per_page, count=count,
+                                   cache_timeout=count_timeout)
+        if clamp and paginator.exact:
+            number = min(number, paginator.num_pages)
 
     # try to paginate
     try:
         page = paginator.page(number)
     except (EmptyPage, InvalidPage):
-        number = paginator.num_pages
+        number = paginator.num_pages or 1
         page = paginator.page(number)
 
-    # attach pagination list or None
+    # not exact count: page after estimated last page is really out of range
+    beyond = count is not None and page.number > paginator.num_pages
+    if beyond and not page.object_list:
+        page = paginator.page(paginator.num_pages)
+        beyond = False
+
+    # attach pagination list or None, without count (or after estimated
+    # last page) only known pages (up to next page) are used
+    if pagination and pagination is True:
+        pagination = Pagination
+    pagination_page = page if count is not None and not beyond else {
+        'page': page.number, 'pages': page.number + page.has_next(),}
+    page.pagination = pagination and pagination(pagination_page) or None
+
+    return page
+
+
+def keyset_paginator(queryset, cursor=None, per_page=10, count=None,
+                     pagination=True):
+    """
+    keyset (cursor) paginator shortcut, see KeysetPaginator
+    :param queryset, PrevNextModel queryset for pagination
+    :param cursor, if cursor is request object, get cursor
+           from request.GET cursor param (?cursor=...)
+    :param per_page, items per page
+    :param count, objects count (or True to calculate it), if set,
+           pages are numbered and pagination is attached
+    :param pagination class or None
+    """
+
+    # get cursor value
+    if isinstance(cursor, HttpRequest):
+        cursor = cursor.GET.get('cursor', None)
+
+    # get paginator object
+    paginator = KeysetPaginator(queryset, per_page, count=count)
+
+    # try to paginate, get first page for invalid cursor
+    try:
+        page = paginator.page(cursor)
+    except InvalidCursor:
+        page = paginator.page(None)
+
+    # attach pagination list or None (only if page number is known)
     if pagination and pagination is True:
         pagination = Pagination
-    page.pagination = pagination and pagination(page) or None
+    page.pagination = (pagination(page) if pagination and
+                       page.number is not None else None)
 
     return page
@@ -0,0 +1,162 @@
+# Generated by Django 3.0.14 on 2026-10-18 08:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+import main.storage
+import sakkada.models.fields.filefield.fields
+import sakkada.models.fields.multivalue
+import sakkada.system.validators
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CopyBrand',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=32, unique=True, verbose_name='code')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+        migrations.CreateModel(
+            name='CopyCategory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=128, verbose_name='title')),
+                ('parent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='main.CopyCategory')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+        migrations.CreateModel(
+            name='CopyProduct',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=128, verbose_name='title')),
+                ('file', models.FileField(blank=True, upload_to='main/copyproduct/file/', verbose_name='file')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='products', to='main.CopyCategory')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+        migrations.CreateModel(
+            name='FileFieldModel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', sakkada.models.fields.filefield.fields.AdvancedFileField(blank=True, upload_to='main/filefieldmodel/file/', validators=[sakkada.system.validators.ExtensionValidator(['.txt']), sakkada.system.validators.MimetypeValidator(['text/plain']), sakkada.system.validators.FilesizeValidator(max=1024)], verbose_name='file')),
+                ('image', sakkada.models.fields.filefield.fields.AdvancedImageField(upload_to='main/filefieldmodel/image/', validators=[sakkada.system.validators.MimetypeValidator(['image/png']), sakkada.system.validators.FilesizeValidator(max=4096)], verbose_name='image')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='updated')),
+            ],
+            options={
+                'ordering': ('-id',),
+            },
+        ),
+        migrations.CreateModel(
+            name='MemoryFileModel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(blank=True, storage=main.storage.MemoryStorage(), upload_to='memory', verbose_name='file')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+        migrations.CreateModel(
+            name='MultiValueFieldModel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('char_default', sakkada.models.fields.multivalue.CharMultipleValuesField(max_length=1024)),
+                ('text_default', sakkada.models.fields.multivalue.TextMultipleValuesField(max_length=1024)),
+                ('comma_separated', sakkada.models.fields.multivalue.CharMultipleValuesField(default=['a', 'b', 'c'], max_length=1024)),
+                ('slash_separated', sakkada.models.fields.multivalue.CharMultipleValuesField(default=['a', 'b', 'c'], delimiter='/', max_length=1024)),
+                ('newline_separated', sakkada.models.fields.multivalue.TextMultipleValuesField(default=['a', 'b', 'c'])),
+                ('cfield_blank', sakkada.models.fields.multivalue.CharMultipleValuesField(blank=True, max_length=1024)),
+                ('cfield_non_editable', sakkada.models.fields.multivalue.CharMultipleValuesField(blank=True, editable=False, max_length=1024)),
+                ('cfield_with_extended_form_field', sakkada.models.fields.multivalue.CharMultipleValuesField(max_length=1024)),
+                ('cfield_integer', sakkada.models.fields.multivalue.CharMultipleValuesField(coerce=int, max_length=1024)),
+                ('cfield_integer_with_default', sakkada.models.fields.multivalue.CharMultipleValuesField(coerce=int, default=[1, 2, 3], max_length=1024)),
+                ('cfield_float_with_choices_and_default', sakkada.models.fields.multivalue.CharMultipleValuesField(choices=[(1.0, 'One'), (1.5, 'One and half'), (2.0, 'Two')], coerce=float, default=[1.0, 2.0], delimiter='|', max_length=1024)),
+                ('cfield_integer_with_choices_checkboxes', sakkada.models.fields.multivalue.CharMultipleValuesField(choices=[(1, 'One'), (2, 'Two'), (3, 'Three')], coerce=int, default=[1, 2], delimiter=':', max_length=1024)),
+                ('cfield_integer_with_grouped_choices', sakkada.models.fields.multivalue.CharMultipleValuesField(choices=[('one', ((1, 'One'), (11, 'Eleven'))), ('two', ((2, 'Two'), (22, 'Twenty two')))], coerce=int, default=[1, 22], max_length=1024)),
+                ('tfield_integer_with_choices', sakkada.models.fields.multivalue.TextMultipleValuesField(choices=[(1, 'One'), (2, 'Two'), (3, 'Three')], coerce=int, default=[1, 2], max_length=1024)),
+            ],
+            options={
+                'ordering': ('-id',),
+            },
+        ),
+        migrations.CreateModel(
+            name='PrevNextTestModel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=128, verbose_name='title')),
+                ('slug', models.SlugField(max_length=128, verbose_name='slug')),
+                ('weight', models.IntegerField(default=500, verbose_name='weight')),
+                ('nweight', models.IntegerField(blank=True, default=500, null=True, verbose_name='weight nullable')),
+                ('parent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='children', to='main.PrevNextTestModel')),
+            ],
+            options={
+                'ordering': ['-weight'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CopyVariant',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=128, verbose_name='title')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='main.CopyProduct')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+        migrations.CreateModel(
+            name='CopyTreeNode',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=128, verbose_name='title')),
+                ('level', models.PositiveIntegerField(default=0, editable=False, verbose_name='level')),
+                ('path', models.CharField(editable=False, max_length=255, verbose_name='path')),
+                ('parent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='main.CopyTreeNode')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+        migrations.CreateModel(
+            name='CopyBrandItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=128, verbose_name='title')),
+                ('brand', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='main.CopyBrand', to_field='code')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+        migrations.CreateModel(
+            name='PrevNextNoOrderingTestModel',
+            fields=[
+            ],
+            options={
+                'ordering': [],
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('main.prevnexttestmodel',),
+        ),
+        migrations.AddIndex(
+            model_name='prevnexttestmodel',
+            index=models.Index(fields=['weight', 'slug', 'id'], name='main_prevnext_weight_slug_idx'),
+        ),
+    ]
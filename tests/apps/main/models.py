@@ -5,11 +5,13 @@ from sakkada.models.fields.filefield import (
 from sakkada.models.fields.multivalue import (
     CharMultipleValuesField, TextMultipleValuesField, MultipleValuesModelMixin)
 from sakkada.system import validators
+from .storage import MemoryStorage
 
 
 FILES_UPLOAD_TO = {
     'filefieldmodel_file': 'main/filefieldmodel/file/',
     'filefieldmodel_image': 'main/filefieldmodel/image/',
+    'copyproduct_file': 'main/copyproduct/file/',
 }
 
 
@@ -19,9 +21,16 @@ class PrevNextTestModel(PrevNextModel):
     weight = models.IntegerField('weight', default=500)
     nweight = models.IntegerField(
         'weight nullable', default=500, null=True, blank=True)
+    parent = models.ForeignKey(
+        'self', null=True, blank=True, on_delete=models.SET_NULL,
+        related_name='children')
 
     class Meta:
         ordering = ['-weight',]
+        indexes = [
+            models.Index(fields=['weight', 'slug', 'id'],
+                         name='main_prevnext_weight_slug_idx'),
+        ]
 
     def __str__(self):
         return '%s (%d: %s)' % (self.title, self.id, self.slug,)
@@ -33,6 +42,98 @@ class PrevNextNoOrderingTestModel(PrevNextTestModel):
         ordering = []
 
 
+class CopyCategory(models.Model):
+    title = models.CharField('title', max_length=128)
+    parent = models.ForeignKey(
+        'self', null=True, blank=True, on_delete=models.CASCADE,
+        related_name='children')
+
+    class Meta:
+        ordering = ('id',)
+
+    def __str__(self):
+        return self.title
+
+
+class CopyProduct(models.Model):
+    category = models.ForeignKey(
+        CopyCategory, on_delete=models.CASCADE, related_name='products')
+    title = models.CharField('title', max_length=128)
+    file = models.FileField(
+        'file', blank=True, upload_to=FILES_UPLOAD_TO['copyproduct_file'])
+
+    class Meta:
+        ordering = ('id',)
+
+    def __str__(self):
+        return self.title
+
+
+class MemoryFileModel(models.Model):
+    file = models.FileField(
+        'file', blank=True, upload_to='memory', storage=MemoryStorage())
+
+    class Meta:
+        ordering = ('id',)
+
+
+class CopyVariant(models.Model):
+    product = models.ForeignKey(
+        CopyProduct, on_delete=models.CASCADE, related_name='variants')
+    title = models.CharField('title', max_length=128)
+
+    class Meta:
+        ordering = ('id',)
+
+    def __str__(self):
+        return self.title
+
+
+class CopyTreeNode(models.Model):
+    """Tree node with fields calculated by parent on save (like mptt)."""
+    title = models.CharField('title', max_length=128)
+    parent = models.ForeignKey(
+        'self', null=True, blank=True, on_delete=models.CASCADE,
+        related_name='children')
+    level = models.PositiveIntegerField('level', default=0, editable=False)
+    path = models.CharField('path', max_length=255, editable=False)
+
+    class Meta:
+        ordering = ('id',)
+
+    def __str__(self):
+        return self.title
+
+    def save(self, *args, **kwargs):
+        parent = self.parent
+        self.level = parent.level + 1 if parent else 0
+        self.path = '%s/%s' % (parent.path if parent else '', self.title,)
+        super().save(*args, **kwargs)
+
+
+class CopyBrand(models.Model):
+    code = models.CharField('code', max_length=32, unique=True)
+
+    class Meta:
+        ordering = ('id',)
+
+    def __str__(self):
+        return self.code
+
+
+class CopyBrandItem(models.Model):
+    brand = models.ForeignKey(
+        CopyBrand, on_delete=models.CASCADE, to_field='code',
+        related_name='items')
+    title = models.CharField('title', max_length=128)
+
+    class Meta:
+        ordering = ('id',)
+
+    def __str__(self):
+        return self.title
+
+
 class FileFieldModel(models.Model):
     file = AdvancedFileField(
         'file', blank=True, clearable=True, erasable=False,
@@ -60,6 +161,18 @@ class FileFieldModel(models.Model):
         return str(self.id)
 
 
+class FilesCleanModel(models.Model):
+    file = models.FileField('file', blank=True)
+    image = models.FileField('image', blank=True)
+    updated = models.DateTimeField('updated', auto_now=True)
+
+    class Meta:
+        ordering = ('-id',)
+
+    def __str__(self):
+        return str(self.id)
+
+
 class MultiValueFieldModel(MultipleValuesModelMixin, models.Model):
     char_default = CharMultipleValuesField(max_length=1024)
     text_default = TextMultipleValuesField(max_length=1024)
@@ -0,0 +1,48 @@
+from io import BytesIO
+from django.core.files.base import File
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class MemoryStorage(Storage):
+    """In-memory storage with paged listing (like object storages)."""
+
+    files = {}
+
+    def _open(self, name, mode='rb'):
+        return File(BytesIO(self.files[name]), name)
+
+    def _save(self, name, content):
+        self.files[name] = content.read()
+        return name
+
+    def delete(self, name):
+        self.files.pop(name, None)
+
+    def exists(self, name):
+        return name in self.files
+
+    def size(self, name):
+        return len(self.files[name])
+
+    def url(self, name):
+        return '/memory/%s' % name
+
+    def listdir_pages(self, path):
+        prefix = path and path.rstrip('/') + '/'
+        directories, files = set(), set()
+        for name in self.files:
+            if name.startswith(prefix):
+                name = name[len(prefix):]
+                if '/' in name:
+                    directories.add(name.split('/', 1)[0])
+                else:
+                    files.add(name)
+        for name in sorted(directories):
+            yield [name], []
+        for name in sorted(files):
+            yield [], [name]
+
+    def listdir(self, path):
+        raise NotImplementedError('Use listdir_pages instead.')
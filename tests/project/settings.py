@@ -47,6 +47,8 @@ INSTALLED_APPS = [
 
     # sakkada apps
     'sakkada.template.htmlattrs',
+    'sakkada.admin.actions.copy_selected',
+    'sakkada.system.management.files_clean',
 ]
 
 MIDDLEWARE = [
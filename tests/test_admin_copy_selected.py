@@ -0,0 +1,319 @@
+from io import StringIO
+from unittest import mock
+from django.conf.urls import url
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import reverse
+from sakkada.admin.actions.copy_selected import (
+    copy_selected, copy_selected_status_view, get_exceeded_limits)
+from sakkada.admin.actions.copy_selected.jobs import (
+    CopyJob, ThreadExecutor, ProcessExecutor)
+from sakkada.admin.sites.admin_views import AdminViewsSite
+from sakkada.admin.actions.copy_selected.utils import NestedObjects
+from sakkada.models.copying import CASCADE_SELF, DO_NOTHING, CopyEstimate
+from main.models import (
+    CopyCategory, CopyProduct, CopyVariant, CopyBrand, CopyBrandItem)
+
+
+class CopyCategoryAdmin(admin.ModelAdmin):
+    actions = (copy_selected,)
+
+
+site = AdminViewsSite(name='copy_selected_admin')
+site.register(CopyCategory, CopyCategoryAdmin)
+site.register_view(r'^copy_selected/(?P<job_id>[0-9a-f]+)/$',
+                   view=copy_selected_status_view,
+                   urlname='copy_selected_status', visible=False)
+
+urlpatterns = [
+    url(r'^admin/', site.urls),
+]
+
+
+class NestedObjectsTests(TestCase):
+    def setUp(self):
+        category = CopyCategory.objects.create(title='category')
+        for i in range(2):
+            product = CopyProduct.objects.create(category=category,
+                                                 title='product %s' % i)
+            CopyVariant.objects.create(product=product,
+                                       title='variant %s' % i)
+
+    def test_nested(self):
+        collector = NestedObjects(using=connection.alias)
+        collector.collect(CopyCategory.objects.all())
+        with self.assertNumQueries(0):
+            nested = collector.nested(str)
+        self.assertEqual(nested, [
+            'category', ['product 0', ['variant 0'],
+                         'product 1', ['variant 1']],
+        ])
+        self.assertEqual(collector.nested(str, limit=3), [
+            'category', ['product 0', ['variant 0']], 'and 2 more\u2026',
+        ])
+
+    def test_nested_forward(self):
+        collector = NestedObjects(using=connection.alias, handlers={
+            'main.copyproduct:category': CASCADE_SELF,
+        })
+        # products, variants and categories (forward) queries,
+        # edges are built without any additional queries
+        with self.assertNumQueries(3):
+            collector.collect(CopyProduct.objects.filter(title='product 0'))
+        self.assertEqual(collector.nested(str), [
+            'product 0', ['variant 0', 'category'],
+        ])
+
+    def test_nested_to_field(self):
+        for code in ('a', 'b',):
+            brand = CopyBrand.objects.create(code=code)
+            for i in range(2):
+                CopyBrandItem.objects.create(brand=brand,
+                                             title='%s item %s' % (code, i))
+
+        # brands and items queries, edges are built by to_field values
+        collector = NestedObjects(using=connection.alias)
+        with self.assertNumQueries(2):
+            collector.collect(CopyBrand.objects.all())
+        self.assertEqual(collector.nested(str), [
+            'a', ['a item 0', 'a item 1'], 'b', ['b item 0', 'b item 1'],
+        ])
+
+        collector = NestedObjects(using=connection.alias, handlers={
+            'main.copybranditem:brand': CASCADE_SELF,
+        })
+        with self.assertNumQueries(3):
+            collector.collect(CopyBrandItem.objects.filter(title='a item 0'))
+        self.assertEqual(collector.nested(str), ['a item 0', ['a']])
+
+        # not collected targets are resolved with single query
+        collector = NestedObjects(using=connection.alias)
+        field = CopyBrandItem._meta.get_field('brand')
+        with self.assertNumQueries(1):
+            pks = collector.get_target_pks(field, (), ('a', 'b',))
+        self.assertEqual(pks, dict(CopyBrand.objects.values_list('code', 'pk')))
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class CopySelectedTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = User.objects.create_superuser('admin', '', 'password')
+        category = CopyCategory.objects.create(title='category')
+        for i in range(2):
+            product = CopyProduct.objects.create(category=category,
+                                                 title='product %s' % i)
+            CopyVariant.objects.create(product=product,
+                                       title='variant %s' % i)
+
+    def get_estimate(self, rows=0, bytes=0, queries=0):
+        estimate = CopyEstimate()
+        estimate.rows, estimate.bytes, estimate.queries = (
+            {CopyCategory: rows}, bytes, queries,)
+        return estimate
+
+    def test_get_exceeded_limits(self):
+        modeladmin = CopyCategoryAdmin(CopyCategory, site)
+        estimate = self.get_estimate(rows=10, bytes=2048, queries=10)
+        self.assertEqual(get_exceeded_limits(modeladmin, None), [])
+        self.assertEqual(get_exceeded_limits(modeladmin, estimate), [])
+
+        modeladmin.copy_selected_max_rows = 10
+        modeladmin.copy_selected_max_bytes = 1024
+        modeladmin.copy_selected_max_queries = 5
+        self.assertEqual(get_exceeded_limits(modeladmin, estimate), [
+            'files size 2.0\xa0KB (limit is 1.0\xa0KB)',
+            'queries 10 (limit is 5)',
+        ])
+        modeladmin.copy_selected_max_rows = 9
+        self.assertEqual(len(get_exceeded_limits(modeladmin, estimate)), 3)
+
+    def test_confirmation(self):
+        modeladmin = CopyCategoryAdmin(CopyCategory, site)
+        request = self.factory.post('/', {'action': 'copy_selected'})
+        request.user = self.user
+
+        response = copy_selected(modeladmin, request,
+                                 CopyCategory.objects.all())
+        response.render()
+        estimate = response.context_data['copy_estimate']
+        self.assertEqual((estimate.total_rows, estimate.files,
+                          estimate.queries,), (5, 0, 5,))
+        self.assertEqual(response.context_data['limits_exceeded'], [])
+        self.assertContains(response, 'Total objects: 5')
+        self.assertContains(response, 'Estimated queries: 5')
+
+        modeladmin.copy_selected_max_rows = 4
+        response = copy_selected(modeladmin, request,
+                                 CopyCategory.objects.all())
+        response.render()
+        self.assertEqual(response.context_data['limits_exceeded'],
+                         ['objects 5 (limit is 4)'])
+        self.assertContains(response, 'objects 5 (limit is 4)')
+        self.assertEqual(CopyCategory.objects.count(), 1)
+
+    def post_action(self, **kwargs):
+        url = reverse('%s:main_copycategory_changelist' % site.name)
+        return self.client.post(url, {
+            'action': 'copy_selected', 'post': 'yes',
+            '_selected_action': [str(pk) for pk in
+                                 CopyCategory.objects.values_list('pk', flat=True)],
+        }, **kwargs)
+
+    def test_copy(self):
+        self.client.force_login(self.user)
+        response = self.post_action(follow=True)
+        self.assertContains(response, 'Successfully created 1 copy category.')
+        self.assertEqual(CopyCategory.objects.count(), 2)
+        self.assertEqual(CopyVariant.objects.count(), 4)
+
+    def test_background(self):
+        modeladmin = site._registry[CopyCategory]
+        executor = mock.Mock()
+        self.client.force_login(self.user)
+
+        # objects are not collected in request, job is only scheduled
+        with mock.patch.object(modeladmin, 'copy_selected_executor',
+                               executor, create=True), \
+                mock.patch.object(NestedObjects, 'collect') as collect:
+            response = self.post_action()
+        collect.assert_not_called()
+        job = executor.submit.call_args[0][0]
+        self.assertRedirects(response, reverse(
+            '%s:copy_selected_status' % site.name, args=(job.id,)))
+        self.assertEqual(CopyJob.get(job.id).status, CopyJob.STATUS_PENDING)
+        self.assertEqual(CopyCategory.objects.count(), 1)
+
+        response = self.client.get(response.url)
+        self.assertContains(response, 'Status: pending')
+        self.assertEqual(job.run().status, CopyJob.STATUS_DONE)
+        response = self.client.get(reverse(
+            '%s:copy_selected_status' % site.name, args=(job.id,)))
+        self.assertContains(response, 'Status: done')
+        self.assertContains(response, 'Progress: 5 / 5 (100%)')
+        self.assertEqual(CopyCategory.objects.count(), 2)
+
+        # selected objects count is checked with rows limit in request
+        executor.reset_mock()
+        with mock.patch.object(modeladmin, 'copy_selected_executor',
+                               executor, create=True), \
+                mock.patch.object(modeladmin, 'copy_selected_max_rows', 1,
+                                  create=True):
+            response = self.post_action(follow=True)
+        executor.submit.assert_not_called()
+        self.assertContains(response, 'objects 2 (limit is 1)')
+
+    def test_status_view(self):
+        job = CopyJob(model='main.copycategory', admin_site=site.name,
+                      user_id=self.user.pk)
+        job.save()
+        url = reverse('%s:copy_selected_status' % site.name, args=(job.id,))
+
+        staff = User.objects.create_user('staff', '', 'password',
+                                         is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertContains(response, 'Status: pending')
+        self.assertContains(response, 'http-equiv="refresh"')
+        self.assertEqual(self.client.get(reverse(
+            '%s:copy_selected_status' % site.name, args=('0' * 32,))
+        ).status_code, 404)
+
+
+class CopyJobTests(TestCase):
+    def setUp(self):
+        self.category = CopyCategory.objects.create(title='category')
+        product = CopyProduct.objects.create(category=self.category,
+                                             title='product')
+        CopyVariant.objects.create(product=product, title='variant')
+
+    def get_job(self, **kwargs):
+        job = CopyJob(model='main.copycategory', pks=[str(self.category.pk)],
+                      admin_site=site.name, using=connection.alias, **kwargs)
+        job.save()
+        return job
+
+    def test_run(self):
+        job = CopyJob.get(self.get_job().id)
+        self.assertEqual(job.status, CopyJob.STATUS_PENDING)
+
+        job.run()
+        self.assertEqual(job.status, CopyJob.STATUS_DONE)
+        self.assertEqual((job.done, job.total, job.percent,), (3, 3, 100,))
+        self.assertEqual(CopyJob.get(job.id).status, CopyJob.STATUS_DONE)
+        self.assertEqual(CopyCategory.objects.count(), 2)
+        self.assertEqual(CopyVariant.objects.count(), 2)
+
+    def test_run_with_changed_handlers(self):
+        job = self.get_job(handlers=['main.copyproduct:category'])
+        job.run()
+        self.assertEqual(job.status, CopyJob.STATUS_FAILED)
+        self.assertTrue(job.error)
+        self.assertEqual(CopyCategory.objects.count(), 1)
+
+        CopyCategoryAdmin.copy_selected_handlers = {
+            'main.copyproduct:category': DO_NOTHING,
+        }
+        try:
+            job = self.get_job(handlers=['main.copyproduct:category'])
+            self.assertEqual(job.run().status, CopyJob.STATUS_DONE)
+        finally:
+            del CopyCategoryAdmin.copy_selected_handlers
+        self.assertEqual(CopyCategory.objects.count(), 2)
+        self.assertEqual(CopyProduct.objects.count(), 1)
+
+    def test_run_checks(self):
+        # collected objects are checked with user permissions and limits
+        staff = User.objects.create_user('staff', '', 'password',
+                                         is_staff=True)
+        job = self.get_job(user_id=staff.pk).run()
+        self.assertEqual(job.status, CopyJob.STATUS_FAILED)
+        self.assertIn('Permission to add copy category', job.error)
+
+        CopyCategoryAdmin.copy_selected_max_rows = 2
+        try:
+            job = self.get_job().run()
+        finally:
+            del CopyCategoryAdmin.copy_selected_max_rows
+        self.assertEqual(job.status, CopyJob.STATUS_FAILED)
+        self.assertIn('objects 3 (limit is 2)', job.error)
+        self.assertEqual(CopyCategory.objects.count(), 1)
+
+    def test_command(self):
+        job = self.get_job()
+        stdout, stderr = StringIO(), StringIO()
+        call_command('copy_selected_job', job.id, 'non-existent',
+                     stdout=stdout, stderr=stderr)
+        self.assertIn('is done', stdout.getvalue())
+        self.assertIn('does not exist', stderr.getvalue())
+        self.assertEqual(CopyCategory.objects.count(), 2)
+
+        # finished jobs are not run again
+        stdout, stderr = StringIO(), StringIO()
+        call_command('copy_selected_job', job.id, stdout=stdout, stderr=stderr)
+        self.assertIn('is already done', stderr.getvalue())
+        self.assertEqual(CopyCategory.objects.count(), 2)
+
+    def test_thread_executor(self):
+        job = mock.Mock()
+        with mock.patch('sakkada.admin.actions.copy_selected.jobs.connections'
+                        ) as connections:
+            ThreadExecutor().submit(job).result(timeout=5)
+        job.run.assert_called_once_with()
+        connections.close_all.assert_called_once_with()
+
+    def test_process_executor(self):
+        job = self.get_job()
+        with mock.patch('subprocess.Popen') as popen:
+            ProcessExecutor().submit(job)
+        args, kwargs = popen.call_args
+        self.assertEqual(args[0][1:], ['-m', 'django', 'copy_selected_job',
+                                       job.id])
+        self.assertIn('PYTHONPATH', kwargs['env'])
+        self.assertTrue(kwargs['start_new_session'])
@@ -0,0 +1,354 @@
+import os
+import csv
+import json
+import shutil
+import time
+import tempfile
+from unittest import mock
+from io import StringIO
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from sakkada.system.management.files_clean import utils
+from sakkada.system.management.files_clean.utils import iterate_parallel
+from main.models import (
+    CopyCategory, CopyProduct, MemoryFileModel, FileFieldModel,
+    FilesCleanModel)
+from main.storage import MemoryStorage
+
+
+class FilesCleanTests(TestCase):
+    files = ('a.txt', 'upload/a.txt', 'upload/a-b/c.txt', 'upload/a/b.txt',
+             'upload/b.txt', 'upload/skip/c.txt', 'upload/z.txt',)
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+        for name in self.files:
+            path = os.path.join(self.media_root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(name)
+
+        category = CopyCategory.objects.create(title='category')
+        for name in ('upload/a/b.txt', 'upload/z.txt', 'upload/missing.txt',
+                     'upload/z.txt', '',):
+            CopyProduct.objects.create(category=category, title=name, file=name)
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def path(self, name):
+        return os.path.join(self.media_root, name).replace('\\', '/')
+
+    def call(self, **options):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('files_clean', stdout=stdout, stderr=stderr, **options)
+        self.stderr = stderr.getvalue()
+        return stdout.getvalue()
+
+    def test_fs(self):
+        regex = '^upload(/(?!skip(/|$))|$)'
+        self.assertEqual(
+            self.call(regex=regex, list='fs', chunk_size=1),
+            '\n' + '\n'.join(self.path(i) for i in (
+                'upload/a-b/c.txt', 'upload/a.txt', 'upload/b.txt',)))
+        self.assertEqual(
+            self.call(regex=regex, list='fsall'),
+            '\n' + '\n'.join(self.path(i) for i in (
+                'upload/a-b/c.txt', 'upload/a.txt', 'upload/a/b.txt',
+                'upload/b.txt', 'upload/z.txt',)))
+
+    def test_db(self):
+        pks = dict(CopyProduct.objects.values_list('title', 'pk').order_by('pk'))
+        pks['upload/z.txt'] = list(CopyProduct.objects.filter(
+            title='upload/z.txt').values_list('pk', flat=True).order_by('pk'))
+
+        def row(name, pk, count=1):
+            return '\t'.join(('CopyProduct', 'main_copyproduct', str(pk), 'file',
+                              self.path(name), str(count),))
+
+        header = 'model_name\ttb_name\tid\tfield_name\tpath\tcount'
+        self.assertEqual(
+            self.call(regex='^upload', list='db'),
+            '\n'.join((header, row('upload/missing.txt', pks['upload/missing.txt']),)))
+        self.assertEqual(
+            self.call(regex='^upload', list='dbfs'),
+            '\n'.join((header, row('upload/a/b.txt', pks['upload/a/b.txt']),
+                       row('upload/z.txt', pks['upload/z.txt'][0], 2),
+                       row('upload/z.txt', pks['upload/z.txt'][1], 2),)))
+        self.assertEqual(
+            self.call(regex='^upload', list='dball').count('\n'), 4)
+
+    def test_db_fields(self):
+        # empty value of one field does not hide other fields values
+        obj = FileFieldModel.objects.create(file='upload/ff.txt', image='')
+        self.assertIn(
+            '\t'.join(('FileFieldModel', 'main_filefieldmodel', str(obj.pk), 'file',
+                       self.path('upload/ff.txt'), '1',)),
+            self.call(regex='^upload', list='db', chunk_size=1).split('\n'))
+
+    def test_delete_and_move(self):
+        regex = '^upload(/(?!skip(/|$))|$)'
+        old = time.time() - 7200
+        for name in ('upload/a-b/c.txt', 'upload/a.txt',):
+            os.utime(self.path(name), (old, old,))
+
+        def manifest(action, *names):
+            return ['\t'.join([action, self.path(name)] + info)
+                    for name, *info in names]
+
+        # dry run: manifest only, new files are skipped
+        self.assertEqual(
+            self.call(regex=regex, delete=True, dry_run=True).split('\n')[1:],
+            manifest('delete', ('upload/a-b/c.txt',), ('upload/a.txt',)) +
+            manifest('skip', ('upload/b.txt',)))
+        self.assertIn('delete: 2, move: 0, skip: 1, error: 0 (dry run)', self.stderr)
+        self.assertTrue(os.path.exists(self.path('upload/a.txt')))
+
+        # move to quarantine (batches with rate limit), existing files in
+        # quarantine are not overwritten
+        def target(name):
+            return os.path.join(quarantine, name).replace('\\', '/')
+
+        quarantine = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, quarantine)
+        os.makedirs(target('upload'))
+        with open(target('upload/a.txt'), 'w') as f:
+            f.write('quarantined')
+        with mock.patch('sakkada.system.management.files_clean.utils.time.sleep') as sleep:
+            output = self.call(regex=regex, move_to=quarantine, batch_size=1, rate=1)
+        self.assertEqual(sleep.call_count, 3)
+        self.assertEqual(output.split('\n')[1:3], manifest(
+            'move', ('upload/a-b/c.txt', target('upload/a-b/c.txt'),),
+            ('upload/a.txt', target('upload/a_1.txt'),)))
+        self.assertFalse(os.path.exists(self.path('upload/a.txt')))
+        self.assertTrue(os.path.exists(target('upload/a-b/c.txt')))
+        with open(target('upload/a.txt')) as f:
+            self.assertEqual(f.read(), 'quarantined')
+        with open(target('upload/a_1.txt')) as f:
+            self.assertEqual(f.read(), 'upload/a.txt')
+
+        # delete with zero age threshold
+        self.assertEqual(self.call(regex=regex, delete=True, min_age=0).split('\n')[1:],
+                         manifest('delete', ('upload/b.txt',)))
+        self.assertFalse(os.path.exists(self.path('upload/b.txt')))
+
+        # only "fs" list, quarantine outside of media_root
+        for options in ({'delete': True, 'list': 'db'},
+                        {'delete': True, 'move_to': quarantine},
+                        {'move_to': self.path('quarantine')},):
+            self.assertNotIn('\t', self.call(regex=regex, **options))
+
+    def test_base_manager(self):
+        # rows hidden by default manager (e.g. soft deleted) still reference
+        # files, so references are read by base manager
+        regex = '^upload(/(?!skip(/|$))|$)'
+        index = os.path.join(tempfile.mkdtemp(), 'index.sqlite3')
+        self.addCleanup(shutil.rmtree, os.path.dirname(index))
+        FileFieldModel.objects.create(file='upload/b.txt', image='')
+        expected = self.call(regex=regex, list='fs')
+        self.assertNotIn(self.path('upload/z.txt'), expected)
+        self.assertNotIn(self.path('upload/b.txt'), expected)
+
+        for model in (CopyProduct, FileFieldModel,):
+            patcher = mock.patch.object(model._default_manager, 'get_queryset',
+                                        model._base_manager.none)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.assertFalse(CopyProduct.objects.exists())
+        self.assertEqual(self.call(regex=regex, list='fs'), expected)
+        for i in range(2):
+            # incremental references reading
+            self.assertEqual(self.call(regex=regex, list='fs', index=index),
+                             expected)
+
+    def test_index(self):
+        regex = '^upload(/(?!skip(/|$))|$)'
+        index = os.path.join(tempfile.mkdtemp(), 'index.sqlite3')
+        self.addCleanup(shutil.rmtree, os.path.dirname(index))
+        old = time.time() - 60
+        for root, dirs, files in os.walk(self.media_root):
+            os.utime(root, (old, old,))
+
+        # not changed directories are not listed again
+        expected = self.call(regex=regex, list='fs')
+        self.assertEqual(self.call(regex=regex, list='fs', index=index), expected)
+        with mock.patch('sakkada.system.management.files_clean.utils.scan_directory',
+                        side_effect=utils.scan_directory) as scandir:
+            self.assertEqual(self.call(regex=regex, list='fs', index=index), expected)
+            self.assertEqual(scandir.call_count, 0)
+            os.remove(self.path('upload/b.txt'))
+            os.utime(self.path('upload'), (old + 1, old + 1,))
+            self.assertEqual(self.call(regex=regex, list='fs', index=index),
+                             expected.replace('\n' + self.path('upload/b.txt'), ''))
+            self.assertEqual(scandir.call_count, 1)
+
+        # references of models with auto_now field are read incrementally
+        def refs():
+            return sorted(line.split('\t')[4] for line in self.call(
+                regex=regex, list='dball', index=index).split('\n')[1:])
+
+        obj = FilesCleanModel.objects.create(file='upload/ff.txt', image='upload/fi.png')
+        CopyProduct.objects.filter(file='upload/missing.txt').update(file='upload/cp.txt')
+        expected = sorted(self.path(i) for i in (
+            'upload/a/b.txt', 'upload/cp.txt', 'upload/ff.txt', 'upload/fi.png',
+            'upload/z.txt', 'upload/z.txt',))
+        self.assertEqual(refs(), expected)
+
+        # not tracked change (no auto_now update) is not visible, tracked is
+        FilesCleanModel.objects.filter(pk=obj.pk).update(file='upload/untracked.txt')
+        self.assertEqual(refs(), expected)
+        obj.refresh_from_db()
+        obj.image = ''
+        obj.save()
+        expected.remove(self.path('upload/fi.png'))
+        expected.remove(self.path('upload/ff.txt'))
+        self.assertEqual(refs(), sorted(expected + [self.path('upload/untracked.txt')]))
+
+        # deleted rows
+        obj.delete()
+        self.assertEqual(refs(), expected)
+
+    def test_formats(self):
+        regex = '^upload(/(?!skip(/|$))|$)'
+        names = ('upload/a-b/c.txt', 'upload/a.txt', 'upload/b.txt',)
+        totals = {'count': 3, 'bytes': sum(len(name) for name in names)}
+
+        self.assertEqual(
+            [json.loads(line) for line in self.call(
+                regex=regex, list='fs', format='jsonl').splitlines()],
+            [{'path': self.path(name), 'size': len(name)} for name in names] +
+            [{'totals': totals}])
+        self.assertEqual(
+            list(csv.reader(StringIO(self.call(regex=regex, list='fs', format='csv')))),
+            [['path', 'size']] + [[self.path(name), str(len(name))] for name in names] +
+            [['#totals', str(totals['count']), str(totals['bytes'])]])
+        self.assertEqual(
+            self.call(regex=regex, list='fs', format='null'),
+            json.dumps({'totals': totals}) + '\n')
+
+        # db records: one per reference, sizes of existing files only
+        records = [json.loads(line) for line in self.call(
+            regex=regex, list='dball', format='jsonl').splitlines()]
+        self.assertEqual(records[-1], {'totals': {'count': 4, 'bytes': 14 + 12 * 2}})
+        self.assertEqual(
+            [(i['path'], i['count'], i['size'],) for i in records[:-1]],
+            [(self.path('upload/a/b.txt'), 1, 14,),
+             (self.path('upload/missing.txt'), 1, None,),
+             (self.path('upload/z.txt'), 2, 12,), (self.path('upload/z.txt'), 2, 12,)])
+
+        # manifest and dirs
+        records = [json.loads(line) for line in self.call(
+            regex=regex, list='fs', delete=True, dry_run=True, format='jsonl',
+            min_age=0).splitlines()]
+        self.assertEqual(records[0], {'action': 'delete', 'path': self.path(names[0]),
+                                      'info': None, 'size': len(names[0])})
+        self.assertEqual(self.call(regex=regex, list='dirs', format='csv'),
+                         'path\nupload\nupload/a-b\nupload/a\n#totals,3,0\n')
+
+    def test_iterate_parallel(self):
+        finalized = []
+
+        def function(number, count):
+            for i in range(count):
+                yield number, i
+
+        tasks = [(number, number * 10,) for number in range(5)]
+        expected = [item for task in tasks for item in function(*task)]
+        for workers in (1, 3,):
+            self.assertEqual(
+                sorted(iterate_parallel(function, tasks, workers,
+                                        finalize=lambda: finalized.append(1),
+                                        queue_size=2)), expected)
+        self.assertEqual(len(finalized), 5)
+
+        def error(number):
+            yield number
+            raise ValueError
+        with self.assertRaises(ValueError):
+            list(iterate_parallel(error, [(1,), (2,)], 2))
+
+    def test_dirs(self):
+        regex = '^upload(/(?!skip(/|$))|$)'
+        self.assertEqual(self.call(regex=regex, list='dirs'),
+                         'upload\nupload/a-b\nupload/a')
+        self.assertEqual(self.call(regex=regex, list='nodirs'),
+                         '\nupload/skip')
+
+    def test_workers(self):
+        regex = '^upload(/(?!skip(/|$))|$)'
+        for list in ('fs', 'fsall', 'db', 'dbfs', 'dirs', 'nodirs',):
+            self.assertEqual(self.call(regex=regex, list=list, workers=3),
+                             self.call(regex=regex, list=list))
+
+    def test_exclude_and_progress(self):
+        # excluded directories are not walked, but listed in nodirs
+        for workers in (1, 2,):
+            self.assertEqual(
+                self.call(regex='^', list='nodirs', exclude='^upload/(a|skip)$',
+                          workers=workers, progress=True),
+                '\n'.join(('upload/a', 'upload/skip',)))
+            self.assertTrue(self.stderr.endswith(
+                'files: 5, %s files/sec\n' % self.stderr.split()[-2]))
+
+    def test_storages(self):
+        MemoryStorage.files.clear()
+        for name in ('memory/a.txt', 'memory/b/c.txt', 'other.txt',):
+            MemoryStorage.files[name] = b''
+        for name in ('memory/a.txt', 'memory/lost.txt',):
+            MemoryFileModel.objects.create(file=name)
+        label = 'main.storage.MemoryStorage:%s'
+
+        # filesystem mode: illegal storage is reported and skipped
+        self.call(regex='^upload', list='fs')
+        self.assertIn('Use --storages param', self.stderr)
+
+        # storages mode: each storage is listed by its own paths
+        self.assertEqual(
+            self.call(regex='^(upload|memory)', list='fs', storages=True),
+            '\n' + '\n'.join([self.path(i) for i in (
+                'upload/a-b/c.txt', 'upload/a.txt', 'upload/b.txt',
+                'upload/skip/c.txt',)] + [label % 'memory/b/c.txt']))
+        self.assertEqual(
+            self.call(regex='^(upload|memory)', list='db',
+                      storages=True).split('\n')[-2:],
+            [self.call(regex='^upload', list='db').split('\n')[-1],
+             '\t'.join(('MemoryFileModel', 'main_memoryfilemodel',
+                        str(MemoryFileModel.objects.get(file='memory/lost.txt').pk),
+                        'file', label % 'memory/lost.txt', '1',))])
+        self.assertEqual(
+            self.call(regex='^memory', list='dirs', storages=True),
+            '\n'.join((label % 'memory', label % 'memory/b',)))
+
+    def test_storages_nested(self):
+        # files of nested storage location are compared with references
+        # of fields of nested storage only, not with outer storage ones
+        MemoryStorage.files.clear()
+        os.makedirs(self.path('upload/n'))
+        for name in ('upload/n/nested.txt', 'upload/n/orphan.txt',):
+            open(self.path(name), 'w').close()
+        FileFieldModel.objects.create(file='nested.txt', image='')
+
+        # other storage with the same location is merged with default one
+        storage = FileSystemStorage(location=self.path('upload/n'))
+        other = FileSystemStorage(location=self.media_root, base_url='/other/')
+        opts = FileFieldModel._meta
+        with mock.patch.object(opts.get_field('file'), 'storage', storage), \
+                mock.patch.object(opts.get_field('image'), 'storage', other):
+            self.assertEqual(
+                self.call(regex='^(upload|$)', list='fs', storages=True),
+                '\n' + '\n'.join(self.path(i) for i in (
+                    'a.txt', 'upload/a-b/c.txt', 'upload/a.txt', 'upload/b.txt',
+                    'upload/skip/c.txt', 'upload/n/orphan.txt',)))
+
+            # cleanup is refused for nested storages locations in any mode
+            for storages in (True, False,):
+                output = self.call(regex='^(upload|$)', storages=storages,
+                                   delete=True, min_age=0)
+                self.assertEqual(output, 'Storages locations overlap (%s), --delete'
+                                 ' and --move-to are not allowed.' % self.path('upload/n'))
+            self.assertTrue(os.path.exists(self.path('upload/n/orphan.txt')))
+            self.assertTrue(os.path.exists(self.path('a.txt')))
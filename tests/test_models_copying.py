@@ -0,0 +1,397 @@
+import os
+import random
+import time
+from unittest import mock
+from django.core.files.base import ContentFile
+from django.db import DatabaseError, connection, transaction
+from django.db.models.query import QuerySet
+from django.test import TestCase, skipUnlessDBFeature
+from sakkada.models.copying import (
+    Collector, COPY_PLANS, DO_NOTHING, SET, CyclicDependencyError,
+    clear_copy_plans)
+from main.models import (
+    CopyCategory, CopyProduct, CopyVariant, CopyBrand, CopyBrandItem,
+    CopyTreeNode)
+
+
+def get_fake_models(count):
+    """Get model-like classes with only "_meta" required by Collector.sort."""
+    models = []
+    for i in range(count):
+        model = type('Model%s' % i, (), {})
+        model._meta = type('Options', (), {'concrete_model': model,
+                                           'label': 'fake.Model%s' % i,})
+        models.append(model)
+    return models
+
+
+class CollectorTests(TestCase):
+    def setUp(self):
+        self.category = CopyCategory.objects.create(title='category')
+        for i in range(2):
+            product = CopyProduct.objects.create(
+                category=self.category, title='product %s' % i)
+            for j in range(2):
+                CopyVariant.objects.create(
+                    product=product, title='variant %s.%s' % (i, j))
+
+    def get_collector(self, queryset, handlers=None):
+        collector = Collector(using=connection.alias, handlers=handlers)
+        collector.collect(queryset)
+        return collector
+
+    def assertCopied(self, copied):
+        self.assertEqual(len(copied), 7)
+        self.assertEqual(CopyCategory.objects.count(), 2)
+        self.assertEqual(CopyProduct.objects.count(), 4)
+        self.assertEqual(CopyVariant.objects.count(), 8)
+
+        new_category = CopyCategory.objects.exclude(pk=self.category.pk).get()
+        self.assertEqual(new_category.products.count(), 2)
+        for product in new_category.products.all():
+            self.assertEqual(product.variants.count(), 2)
+            prefix = 'variant %s.' % product.title[-1]
+            self.assertTrue(all(variant.title.startswith(prefix)
+                                for variant in product.variants.all()))
+
+    def test_copy(self):
+        collector = self.get_collector(CopyCategory.objects.all())
+        self.assertCopied(collector.copy())
+
+    def test_copy_queries(self):
+        # related objects are remapped by attnames without any fetching,
+        # so only one insert query per object should be executed
+        collector = self.get_collector(CopyCategory.objects.all())
+        with self.assertNumQueries(7):
+            copied = collector.copy()
+        self.assertCopied(copied)
+
+    def test_copy_bulk(self):
+        # backends without returned pks from bulk insert use per-row saves:
+        # one insert per object, the same as without bulk
+        collector = self.get_collector(CopyCategory.objects.all())
+        bulk = connection.features.can_return_rows_from_bulk_insert
+        with self.assertNumQueries(3 if bulk else 7):
+            copied = collector.copy(bulk=True)
+        self.assertCopied(copied)
+
+    @skipUnlessDBFeature('can_return_rows_from_bulk_insert')
+    def test_copy_bulk_queries(self):
+        collector = self.get_collector(CopyCategory.objects.all())
+        # one insert per model
+        with self.assertNumQueries(3):
+            copied = collector.copy(bulk=True)
+        self.assertCopied(copied)
+
+    def test_copy_bulk_emulated(self):
+        # backend returning pks from bulk insert is emulated by per-row
+        # inserts, so bulk_copy_objects is verified on any backend
+        def bulk_create(queryset, objs, batch_size=None, **kwargs):
+            batches.append((queryset.model, len(objs), batch_size,))
+            for obj in objs:
+                obj.save_base(raw=True, force_insert=True, using=queryset.db)
+            return objs
+
+        batches = []
+        collector = self.get_collector(CopyCategory.objects.all())
+        with mock.patch.object(connection.features,
+                               'can_return_rows_from_bulk_insert', True), \
+                mock.patch.object(QuerySet, 'bulk_create', autospec=True,
+                                  side_effect=bulk_create):
+            copied = collector.copy(bulk=True)
+        self.assertEqual([batch[:2] for batch in batches], [
+            (CopyCategory, 1,), (CopyProduct, 2,), (CopyVariant, 4,)])
+        self.assertTrue(all(batch[2] for batch in batches))
+        self.assertCopied(copied)
+
+        # children point to copied parents, not to originals
+        old_products = set(CopyProduct.objects.filter(
+            category=self.category).values_list('pk', flat=True))
+        for new, old in copied:
+            self.assertIsNotNone(new.pk)
+            self.assertNotEqual(new.pk, old)
+            if isinstance(new, CopyProduct):
+                self.assertNotEqual(new.category_id, self.category.pk)
+            elif isinstance(new, CopyVariant):
+                self.assertNotIn(new.product_id, old_products)
+                self.assertEqual(CopyVariant.objects.get(pk=new.pk).product_id,
+                                 new.product_id)
+
+    def test_copy_deferred_self_relation(self):
+        # child with lower pk than its parent, parent value is set after
+        # all categories are inserted
+        child = CopyCategory.objects.create(title='child')
+        parent = CopyCategory.objects.create(title='parent')
+        child.parent = parent
+        child.save()
+
+        for bulk in (False, True):
+            queryset = CopyCategory.objects.filter(pk__in=[child.pk, parent.pk])
+            collector = self.get_collector(queryset)
+            copied = dict((old, new) for new, old in collector.copy(bulk=bulk)
+                          if isinstance(new, CopyCategory))
+            new_child = CopyCategory.objects.get(pk=copied[child.pk].pk)
+            self.assertEqual(new_child.parent_id, copied[parent.pk].pk)
+            self.assertIsNone(
+                CopyCategory.objects.get(pk=copied[parent.pk].pk).parent_id)
+
+    def test_copy_tree(self):
+        # nodes are saved parents first with already copied parents, so tree
+        # fields are calculated by save method (even for node with lower pk
+        # than its parent), only relations in cycles are deferred
+        root = CopyTreeNode.objects.create(title='root')
+        child = CopyTreeNode.objects.create(title='child', parent=root)
+        CopyTreeNode.objects.create(title='leaf', parent=child)
+        orphan = CopyTreeNode.objects.create(title='orphan')
+        moved = CopyTreeNode.objects.create(title='moved', parent=child)
+        orphan.parent = moved
+        orphan.save()
+        nodes = {node.pk: node for node in CopyTreeNode.objects.all()}
+
+        collector = self.get_collector(CopyTreeNode.objects.filter(pk=root.pk))
+        copied = {old: new for new, old in collector.copy()}
+        self.assertEqual(sorted(copied), sorted(nodes))
+        self.assertEqual(collector.deferred_values, {})
+
+        for old, new in copied.items():
+            new.refresh_from_db()
+            old = nodes[old]
+            self.assertEqual(new.parent_id,
+                             old.parent_id and copied[old.parent_id].pk)
+            self.assertEqual((new.level, new.path,), (old.level, old.path,))
+
+        # subtree copy keeps relation to not collected parent
+        queryset = CopyTreeNode.objects.filter(pk=moved.pk)
+        copied = {old: new for new, old in self.get_collector(queryset).copy()}
+        self.assertEqual(sorted(copied), [orphan.pk, moved.pk])
+        new = CopyTreeNode.objects.get(pk=copied[moved.pk].pk)
+        self.assertEqual((new.parent_id, new.level, new.path,),
+                         (child.pk, 2, '/root/child/moved',))
+
+        # relations in cycles are deferred
+        first = CopyTreeNode.objects.create(title='first')
+        second = CopyTreeNode.objects.create(title='second', parent=first)
+        first.parent = second
+        first.save()
+        collector = self.get_collector(
+            CopyTreeNode.objects.filter(pk=first.pk))
+        copied = {old: new for new, old in collector.copy()}
+        self.assertEqual(sorted(copied), [first.pk, second.pk])
+        self.assertEqual(len(collector.deferred_values[CopyTreeNode]), 1)
+        self.assertEqual(
+            CopyTreeNode.objects.get(pk=copied[first.pk].pk).parent_id,
+            copied[second.pk].pk)
+        self.assertEqual(
+            CopyTreeNode.objects.get(pk=copied[second.pk].pk).parent_id,
+            copied[first.pk].pk)
+
+    def test_copy_to_field_relation(self):
+        # relations to not pk fields are remapped through values of copies
+        def set_code(obj, field):
+            obj.code = '%s-copy' % obj.code
+
+        brand = CopyBrand.objects.create(code='brand')
+        for i in range(2):
+            CopyBrandItem.objects.create(brand=brand, title='item %s' % i)
+
+        for bulk in (False, True):
+            CopyBrand.objects.filter(code='brand-copy').delete()
+            collector = self.get_collector(CopyBrand.objects.filter(pk=brand.pk), {
+                'main.copybrand:code': SET(set_code, deferred=True),
+            })
+            collector.copy(bulk=bulk)
+            new_brand = CopyBrand.objects.get(code='brand-copy')
+            self.assertEqual(sorted(new_brand.items.values_list('title', flat=True)),
+                             ['item 0', 'item 1'])
+            self.assertEqual(brand.items.count(), 2)
+
+    def test_copy_plan(self):
+        clear_copy_plans()
+        collector = Collector(using=connection.alias)
+        plan = collector.get_copy_plan(CopyProduct)
+        self.assertEqual([(kind, field.name) for kind, field, _ in plan],
+                         [('backward', 'variants')])
+        self.assertIs(collector.get_copy_plan(CopyProduct), plan)
+        self.assertEqual(len(COPY_PLANS), 1)
+
+        # plans are cached per handlers
+        collector = Collector(using=connection.alias, handlers={
+            'main.copyvariant:product': DO_NOTHING,
+        })
+        self.assertEqual(collector.get_copy_plan(CopyProduct), ())
+        self.assertEqual(len(COPY_PLANS), 2)
+
+        clear_copy_plans()
+        self.assertEqual(len(COPY_PLANS), 0)
+
+        # handlers created per call are new keys, cache size is bounded
+        with mock.patch('sakkada.models.copying.COPY_PLANS_SIZE', 3):
+            for i in range(10):
+                Collector(using=connection.alias, handlers={
+                    'main.copyproduct:title': SET('title %s' % i),
+                }).get_copy_plan(CopyProduct)
+            self.assertEqual(len(COPY_PLANS), 3)
+            self.assertIs(collector.get_copy_plan(CopyProduct),
+                          collector.get_copy_plan(CopyProduct))
+            self.assertEqual(len(COPY_PLANS), 3)
+
+    def test_copy_files(self):
+        for local in (True, False):
+            product = CopyProduct.objects.first()
+            product.file.save('file.txt', ContentFile(b'content'))
+            collector = self.get_collector(
+                CopyProduct.objects.filter(pk=product.pk))
+            with mock.patch.object(Collector, 'can_copy_file_locally',
+                                   return_value=local):
+                copied = [obj for obj, pk in collector.copy()
+                          if isinstance(obj, CopyProduct)]
+            try:
+                self.assertEqual(len(copied), 1)
+                self.assertNotEqual(copied[0].file.name, product.file.name)
+                with copied[0].file.open('rb') as file:
+                    self.assertEqual(file.read(), b'content')
+            finally:
+                product.file.delete(save=False)
+                copied[0].file.delete(save=False)
+
+    def test_copy_files_in_pool(self):
+        products = list(CopyProduct.objects.all())
+        products[0].file.save('file.txt', ContentFile(b'content'))
+        products[1].file = 'main/copyproduct/file/non-existent.txt'
+        products[1].save()
+
+        collector = self.get_collector(CopyProduct.objects.all())
+        copied = [obj for obj, pk in collector.copy(files='before',
+                                                    files_workers=2)
+                  if isinstance(obj, CopyProduct)]
+        try:
+            result = collector.files_result
+            self.assertFalse(result)
+            self.assertEqual(len(result.copied), 1)
+            self.assertEqual(len(result.failed), 1)
+            self.assertEqual(result.failed[0][0].source, products[1].file.name)
+
+            # copied file has new name, failed one keeps original name
+            self.assertEqual(copied[0].file.name, result.copied[0].name)
+            with copied[0].file.open('rb') as file:
+                self.assertEqual(file.read(), b'content')
+            self.assertEqual(copied[1].file.name, products[1].file.name)
+        finally:
+            products[0].file.delete(save=False)
+            copied[0].file.delete(save=False)
+
+    def test_copy_files_rollback(self):
+        product = CopyProduct.objects.first()
+        product.file.save('file.txt', ContentFile(b'content'))
+        directory = os.path.dirname(product.file.path)
+        listing = set(os.listdir(directory))
+        try:
+            for files in ('before', 'on_commit',):
+                collector = self.get_collector(
+                    CopyProduct.objects.filter(pk=product.pk))
+                with mock.patch.object(Collector, 'update_deferred_values',
+                                       side_effect=DatabaseError):
+                    with self.assertRaises(DatabaseError):
+                        with transaction.atomic():
+                            collector.copy(files=files)
+
+                # reserved and copied files are deleted, names are restored
+                self.assertEqual(set(os.listdir(directory)), listing)
+                self.assertEqual(
+                    collector.data[CopyProduct][0].file.name, product.file.name)
+        finally:
+            product.file.delete(save=False)
+
+    def test_copy_files_on_commit(self):
+        products = list(CopyProduct.objects.all())
+        products[0].file.save('file.txt', ContentFile(b'content'))
+        products[1].file.save('failed.txt', ContentFile(b'content'))
+        directory = os.path.dirname(products[0].file.path)
+        listing = set(os.listdir(directory))
+
+        def copy_file_content(collector, storage, source, name):
+            if source == products[1].file.name:
+                raise IOError('Copying failed.')
+            return copy_file_content.original(collector, storage, source, name)
+        copy_file_content.original = Collector.copy_file_content
+
+        collector = self.get_collector(CopyProduct.objects.all())
+        with mock.patch.object(Collector, 'copy_file_content',
+                               copy_file_content), \
+                mock.patch.object(transaction, 'on_commit',
+                                  side_effect=lambda func, using=None: func()):
+            copied = [obj for obj, pk in collector.copy(files='on_commit')
+                      if isinstance(obj, CopyProduct)]
+        try:
+            result = collector.files_result
+            self.assertEqual(len(result.copied), 1)
+            self.assertEqual(len(result.failed), 1)
+
+            # failed copy placeholder is deleted, row keeps original name
+            self.assertEqual(set(os.listdir(directory)),
+                             listing | {os.path.basename(copied[0].file.name)})
+            copied[1].refresh_from_db()
+            self.assertEqual(copied[1].file.name, products[1].file.name)
+        finally:
+            products[0].file.delete(save=False)
+            products[1].file.delete(save=False)
+            copied[0].file.delete(save=False)
+
+    def test_estimate(self):
+        product = CopyProduct.objects.first()
+        product.file.save('file.txt', ContentFile(b'content'))
+        try:
+            collector = self.get_collector(CopyCategory.objects.all())
+            with self.assertNumQueries(0):
+                estimate = collector.estimate()
+            self.assertEqual(estimate.rows, {
+                CopyCategory: 1, CopyProduct: 2, CopyVariant: 4,
+            })
+            self.assertEqual(estimate.total_rows, 7)
+            self.assertEqual(estimate.files, 1)
+            self.assertEqual(estimate.bytes, 7)
+            self.assertEqual(estimate.unsized, 0)
+            self.assertEqual(estimate.queries, 7)
+
+            # files sizes are requested from storages only if allowed
+            with mock.patch.object(product.file.storage, 'size') as size:
+                estimate = collector.estimate(sizes=None)
+            size.assert_not_called()
+            self.assertEqual((estimate.files, estimate.bytes,
+                              estimate.unsized,), (1, 0, 1,))
+            self.assertEqual(collector.estimate(sizes='all').bytes, 7)
+        finally:
+            product.file.delete(save=False)
+
+    def test_sort(self):
+        collector = Collector(using=connection.alias)
+        a, b, c = get_fake_models(3)
+        collector.data = {c: set(), b: set(), a: set()}
+        collector.dependencies = {a: {b, c, a}, b: {c}}
+        collector.sort()
+        self.assertEqual(list(collector.data), [a, b, c])
+
+        collector.dependencies[c] = {a}
+        with self.assertRaises(CyclicDependencyError):
+            collector.sort()
+
+    def test_sort_benchmark(self):
+        # a few hundred interrelated models in random order
+        rand = random.Random(0)
+        models = get_fake_models(500)
+        collector = Collector(using=connection.alias)
+        collector.dependencies = {
+            model: set(rand.sample(models[i+1:], min(10, len(models)-i-1)))
+            for i, model in enumerate(models)
+        }
+        collector.data = {model: set()
+                          for model in rand.sample(models, len(models))}
+
+        start = time.monotonic()
+        collector.sort()
+        self.assertLess(time.monotonic() - start, 1)
+
+        position = {model: i for i, model in enumerate(collector.data)}
+        for model, deps in collector.dependencies.items():
+            for dep in deps:
+                self.assertLess(position[model], position[dep])
@@ -1,4 +1,6 @@
-from django.db import models
+from unittest import mock, skipUnless
+from django.db import models, connection
+from django.db.models.functions import Lower
 from django.conf import settings
 from django.test import TestCase
 from main.models import (
@@ -56,10 +58,10 @@ class QueryStringTests(TestCase):
         qset_defined = Model.objects.all().order_by('-title')
         obj = qset_default.get(slug='c')
 
-        # support of expressions is not implemented yet
+        # random ordering is not supported
         self.assertRaises(ValueError,
                           obj._get_next_or_prev_by_order,
-                          order_by=(models.F('title'),))
+                          order_by=('?',))
 
         # test _get_next_or_prev_by_order kwargs:
         #   order_by, is_next, nulls_first, queryset,
@@ -200,3 +202,227 @@ class QueryStringTests(TestCase):
 
         self.assertEqual(prev.slug, 'b')
         self.assertEqual(next.slug, 'd')
+
+    def test_prefetch_next_and_prev_by_order(self):
+        def neighbours(obj, **kwargs):
+            return (obj.get_next_by_order(force='nocache', **kwargs),
+                    obj.get_prev_by_order(force='nocache', **kwargs),)
+
+        for order_by in (('slug',), ('-nweight', 'title',),):
+            instances = list(Model.objects.order_by(*order_by)[1:5])
+            queries = 2 if connection.features.supports_over_clause else 8
+            with self.assertNumQueries(queries):
+                Model.prefetch_next_and_prev_by_order(instances,
+                                                      order_by=order_by)
+            for obj in instances:
+                self.assertEqual((obj._next_nextprev_cache,
+                                  obj._prev_nextprev_cache,),
+                                 neighbours(obj, order_by=order_by))
+
+        # instances out of queryset and cache_name
+        queryset = Model.objects.filter(title='b')
+        instances = [Model.objects.get(slug='a'), Model.objects.get(slug='c')]
+        Model.prefetch_next_and_prev_by_order(
+            instances, queryset=queryset, cache_name='b')
+        for obj in instances:
+            self.assertEqual((obj._next_b_nextprev_cache,
+                              obj._prev_b_nextprev_cache,),
+                             neighbours(obj, queryset=queryset))
+
+        # backends without window functions
+        instances = list(Model.objects.all())
+        with mock.patch.object(connection.features,
+                               'supports_over_clause', False):
+            with self.assertNumQueries(12):
+                Model.prefetch_next_and_prev_by_order(instances)
+        for obj in instances:
+            self.assertEqual((obj._next_nextprev_cache,
+                              obj._prev_nextprev_cache,), neighbours(obj))
+
+    def test_strategies(self):
+        orderings = (('slug',), ('weight', 'slug',), ('-weight', '-slug',),
+                     ('-nweight', 'title',), ('title', '-slug',),)
+        for order_by in orderings:
+            for obj in Model.objects.all():
+                for is_next in (True, False,):
+                    kwargs = {'order_by': order_by, 'is_next': is_next,
+                              'force': 'nocache'}
+                    expected = obj._get_next_or_prev_by_order(**kwargs)
+                    for strategy in ('rows', 'window', 'auto',):
+                        self.assertEqual(
+                            obj._get_next_or_prev_by_order(strategy=strategy,
+                                                           **kwargs),
+                            expected)
+
+        # object is not in queryset, neighbours are selected from queryset
+        obj = Model.objects.get(slug='c')
+        for is_next, slug in ((True, 'e',), (False, None,),):
+            for strategy in ('filter', 'rows', 'window', 'auto',):
+                neighbour = obj._get_next_or_prev_by_order(
+                    queryset=Model.objects.filter(title='c'),
+                    order_by=('slug',), is_next=is_next, force='nocache',
+                    strategy=strategy)
+                self.assertEqual(neighbour and neighbour.slug, slug)
+
+        # relation fields are ordered by related model ordering, so rows
+        # comparison is not used for them even if they are not nullable
+        Model.objects.update(parent=Model.objects.get(slug='a'))
+        parent = Model._meta.get_field('parent')
+        with mock.patch.object(parent, 'null', False):
+            for obj in Model.objects.all():
+                kwargs = {'order_by': ('parent', 'slug',), 'force': 'nocache'}
+                expected = obj._get_next_or_prev_by_order(**kwargs)
+                for strategy in ('rows', 'window',):
+                    self.assertEqual(obj._get_next_or_prev_by_order(
+                        strategy=strategy, **kwargs), expected)
+            self.assertEqual(obj._get_nextprev_strategy(
+                'rows', Model.objects.all(), ['parent', 'id']), 'filter')
+
+        # rows comparison works only with the same directions and not null
+        # fields on supported backends, window functions only with supported
+        # backends, "auto" uses only "rows" on postgresql, else "filter"
+        obj = Model.objects.get(slug='c')
+        queryset = Model.objects.all()
+        self.assertEqual(obj._get_nextprev_strategy(
+            'rows', queryset, ['-weight', '-slug', '-id']), 'rows')
+        self.assertEqual(obj._get_nextprev_strategy(
+            'rows', queryset, ['weight', '-slug', 'id']), 'filter')
+        self.assertEqual(obj._get_nextprev_strategy(
+            'rows', queryset, ['nweight', 'id']), 'filter')
+        with mock.patch.object(connection, 'vendor', 'oracle'):
+            self.assertEqual(obj._get_nextprev_strategy(
+                'rows', queryset, ['slug', 'id']), 'filter')
+        with mock.patch.object(connection.features,
+                               'supports_over_clause', False):
+            self.assertEqual(obj._get_nextprev_strategy(
+                'window', queryset, ['slug', 'id']), 'filter')
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            self.assertEqual(obj._get_nextprev_strategy(
+                'auto', queryset, ['slug', 'id']), 'rows')
+            self.assertEqual(obj._get_nextprev_strategy(
+                'auto', queryset, ['slug', '-id']), 'filter')
+        for vendor in ('sqlite', 'mysql', 'oracle',):
+            with mock.patch.object(connection, 'vendor', vendor), \
+                    mock.patch.object(connection.features,
+                                      'supports_over_clause', True):
+                self.assertEqual(obj._get_nextprev_strategy(
+                    'auto', queryset, ['slug', 'id']), 'filter')
+
+        # model level default strategy
+        with mock.patch.object(Model, 'nextprev_strategy', 'rows'):
+            self.assertEqual(type(obj._get_next_or_prev_by_order(
+                order_by=('slug',), as_queryset=True)[1].children[0]).__name__,
+                'RowValuesCompare')
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN output is sqlite specific.')
+    def test_strategies_explain(self):
+        # composite index (weight, slug, id) is used by rows comparison
+        # without sorting, "filter" strategy requires additional sorting
+        obj = Model.objects.get(slug='c')
+        for is_next in (True, False,):
+            kwargs = {'order_by': ('weight', 'slug',), 'is_next': is_next,
+                      'as_queryset': True}
+            plan = obj._get_next_or_prev_by_order(
+                strategy='rows', **kwargs)[0][0:1].explain()
+            self.assertIn('SEARCH', plan)
+            self.assertIn('USING INDEX main_prevnext_weight_slug_idx', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+            plan = obj._get_next_or_prev_by_order(
+                strategy='filter', **kwargs)[0][0:1].explain()
+            self.assertIn('TEMP B-TREE', plan)
+
+            # window is calculated over all queryset rows
+            plan = obj._get_next_or_prev_by_order(
+                strategy='window', **kwargs)[0][0:1].explain()
+            self.assertIn('SCAN', plan)
+
+    def test_shared_cache(self):
+        from django.core.cache import cache
+        cache.clear()
+        with mock.patch.object(Model, 'nextprev_cache_alias', 'default'):
+            obj = Model.objects.get(slug='c')
+            with self.assertNumQueries(1):
+                next = obj.get_next_by_order(order_by=('slug',))
+            self.assertEqual(next.slug, 'd')
+
+            # new instance (e.g. in next request) uses shared cache
+            obj = Model.objects.get(slug='c')
+            with self.assertNumQueries(0):
+                self.assertEqual(obj.get_next_by_order(order_by=('slug',)), next)
+            # other ordering, queryset or direction are cached separately
+            with self.assertNumQueries(3):
+                obj.get_next_by_order(order_by=('-slug',), force=True)
+                obj.get_next_by_order(queryset=Model.objects.filter(title='b'),
+                                      order_by=('slug',), force=True)
+                obj.get_prev_by_order(order_by=('slug',), force=True)
+
+            # saving or deleting of any object invalidates cache
+            Model.objects.create(title='c', slug='cc', weight=500)
+            obj = Model.objects.get(slug='c')
+            with self.assertNumQueries(1):
+                self.assertEqual(
+                    obj.get_next_by_order(order_by=('slug',)).slug, 'cc')
+            Model.objects.get(slug='cc').delete()
+            obj = Model.objects.get(slug='c')
+            with self.assertNumQueries(1):
+                self.assertEqual(
+                    obj.get_next_by_order(order_by=('slug',)).slug, 'd')
+
+            # "nocache" does not use shared cache
+            with self.assertNumQueries(1):
+                obj.get_next_by_order(order_by=('slug',), force='nocache')
+
+            # bulk writes do not send signals, cache is invalidated manually,
+            # stale values are kept at most nextprev_cache_timeout seconds
+            Model.objects.filter(slug='d').update(slug='dd')
+            obj = Model.objects.get(slug='c')
+            with self.assertNumQueries(0):
+                self.assertEqual(
+                    obj.get_next_by_order(order_by=('slug',)).slug, 'd')
+            Model.invalidate_nextprev_cache()
+            obj = Model.objects.get(slug='c')
+            with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+                self.assertEqual(
+                    obj.get_next_by_order(order_by=('slug',)).slug, 'dd')
+            self.assertEqual(cache_set.call_args[0][2], Model.nextprev_cache_timeout)
+            self.assertIsNotNone(Model.nextprev_cache_timeout)
+
+    def test_related_and_expression_ordering(self):
+        a, b, e = (Model.objects.get(slug=i) for i in 'abe')
+        Model.objects.filter(slug__in='cd').update(parent=e)
+        Model.objects.filter(slug__in='ef').update(parent=a)
+        Model.objects.filter(slug='a').update(parent=b)
+
+        self.assertEqual(
+            a._get_current_ordering(Model.objects.order_by(
+                models.F('title'), models.F('slug').desc())),
+            ['title', '-slug', 'id'])
+
+        orderings = (
+            (models.F('title'), models.F('slug').desc(),),
+            ('parent__slug', '-title',),
+            ('-parent__parent__slug', 'slug',),
+            (Lower('title').desc(), '-slug',),
+            (models.F('weight') + models.F('nweight'), 'slug',),
+            (models.F('parent__nweight').asc(), models.F('id').desc(),),
+        )
+        for order_by in orderings:
+            objects = list(Model.objects.order_by(*order_by))
+            for strategy in ('filter', 'rows', 'window',):
+                for index, obj in enumerate(objects):
+                    next = objects[index + 1] if index + 1 < len(objects) else None
+                    prev = objects[index - 1] if index else None
+                    kwargs = {'order_by': order_by, 'force': 'nocache',
+                              'strategy': strategy}
+                    self.assertEqual(obj.get_next_by_order(**kwargs), next)
+                    self.assertEqual(obj.get_prev_by_order(**kwargs), prev)
+
+            Model.prefetch_next_and_prev_by_order(objects, order_by=order_by)
+            self.assertEqual([i._next_nextprev_cache for i in objects],
+                             objects[1:] + [None])
+
+        # values of related fields and expressions are selected by subquery
+        # in the neighbour query itself
+        with self.assertNumQueries(1):
+            a.get_next_by_order(order_by=('parent__slug', Lower('title'),))
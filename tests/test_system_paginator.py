@@ -0,0 +1,248 @@
+from unittest import mock
+from django.core.cache import cache
+from django.core.paginator import EmptyPage
+from django.db import connection
+from django.test import TestCase, RequestFactory
+from sakkada.system.paginator import (
+    paginator, keyset_paginator, KeysetPaginator, CountPaginator, Pagination,
+    PaginationWindow)
+from sakkada.system.paginator import count as count_module
+from main.models import PrevNextTestModel as Model
+
+
+class KeysetPaginatorTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        for i in range(23):
+            Model.objects.create(title='t%s' % (i % 4), slug='s%02d' % i,
+                                 weight=i % 3, nweight=i % 5 or None)
+
+    def walk(self, paginator):
+        pages, page = [], paginator.page()
+        while True:
+            pages.append(page)
+            if not page.has_next():
+                break
+            with self.assertNumQueries(1):
+                page = paginator.page(page.next_cursor)
+        return pages
+
+    def test_pages(self):
+        orderings = (('slug',), ('-weight', 'title',), ('-nweight', 'slug',),
+                     ('parent__slug', 'nweight',),)
+        for order_by in orderings:
+            queryset = Model.objects.order_by(*order_by)
+            objects = list(queryset.order_by(*order_by, 'id'))
+            paginator = KeysetPaginator(queryset, 5)
+
+            # forward
+            pages = self.walk(paginator)
+            self.assertEqual([len(page) for page in pages], [5, 5, 5, 5, 3])
+            self.assertEqual([obj for page in pages for obj in page], objects)
+            self.assertFalse(pages[0].has_previous())
+            self.assertIsNone(pages[0].previous_cursor)
+            self.assertIsNone(pages[-1].next_cursor)
+
+            # backward
+            page, backward = pages[-1], [pages[-1]]
+            while page.has_previous():
+                page = paginator.page(page.previous_cursor)
+                backward.append(page)
+            self.assertEqual([list(page) for page in reversed(backward)],
+                             [list(page) for page in pages])
+            self.assertTrue(backward[-1].has_next())
+            self.assertFalse(backward[-1].has_previous())
+
+    def test_count_and_pagination(self):
+        queryset = Model.objects.order_by('slug')
+        paginator = KeysetPaginator(queryset, 5, count=True)
+        self.assertEqual((paginator.count, paginator.num_pages,), (23, 5,))
+
+        pages = self.walk(paginator)
+        self.assertEqual([page.number for page in pages], [1, 2, 3, 4, 5])
+        page = paginator.page(pages[3].previous_cursor)
+        self.assertEqual(page.number, 3)
+
+        pagination = Pagination(page)
+        self.assertEqual((pagination.num_pages, pagination.current,), (5, 3,))
+
+        # no count - no numbers
+        page = KeysetPaginator(queryset, 5).page()
+        self.assertIsNone(page.number)
+
+    def test_shortcut(self):
+        queryset = Model.objects.order_by('slug')
+        page = keyset_paginator(queryset, self.factory.get('/'), per_page=10)
+        self.assertIsNone(page.pagination)
+        self.assertEqual(page[0].slug, 's00')
+
+        page = keyset_paginator(queryset, self.factory.get('/'), per_page=10,
+                                count=23)
+        request = self.factory.get('/', {'cursor': page.next_cursor})
+        page = keyset_paginator(queryset, request, per_page=10, count=23)
+        self.assertEqual(page[0].slug, 's10')
+        self.assertEqual(page.pagination.current, 2)
+        self.assertEqual(page.pagination.num_pages, 3)
+
+        # invalid cursor - first page
+        for cursor in ('invalid', 'eyJ2IjpbMV19',):
+            request = self.factory.get('/', {'cursor': cursor})
+            page = keyset_paginator(queryset, request, per_page=10)
+            self.assertEqual(page[0].slug, 's00')
+
+
+class CountPaginatorTests(TestCase):
+    def setUp(self):
+        for i in range(23):
+            Model.objects.create(title='t%s' % (i % 4), slug='s%02d' % i)
+        cache.clear()
+
+    def test_count_strategies(self):
+        queryset = Model.objects.filter(title='t1')
+        self.assertEqual(CountPaginator(queryset, 5).count, 6)
+        self.assertEqual(CountPaginator(list(queryset.all()), 5, count='cached').count, 6)
+        self.assertEqual(CountPaginator(queryset.all(), 5, count=len).count, 6)
+        self.assertRaises(ValueError, CountPaginator, queryset, 5, count='wrong')
+
+        # cached count is stored by query sql
+        with self.assertNumQueries(1):
+            self.assertEqual(CountPaginator(queryset, 5, count='cached').count, 6)
+        with self.assertNumQueries(0):
+            self.assertEqual(CountPaginator(
+                Model.objects.filter(title='t1'), 5, count='cached').count, 6)
+        with self.assertNumQueries(1):
+            self.assertEqual(CountPaginator(
+                Model.objects.filter(title='t2'), 5, count='cached').count, 6)
+
+        # estimated count for unsupported backends (sqlite) is exact
+        with self.assertNumQueries(1):
+            self.assertEqual(CountPaginator(queryset, 5, count='estimated').count, 6)
+
+    def test_estimated_count(self):
+        estimator = mock.Mock(return_value=1000)
+        with mock.patch.dict(count_module.ESTIMATORS,
+                             {connection.vendor: estimator}):
+            page = paginator(Model.objects.all(), 3, per_page=5, count='estimated')
+            self.assertEqual(page.paginator.count, 1000)
+            self.assertEqual(page.pagination.num_pages, 200)
+
+            # distinct and sliced querysets are counted exactly
+            self.assertEqual(CountPaginator(
+                Model.objects.distinct(), 5, count='estimated').count, 23)
+            self.assertEqual(CountPaginator(
+                Model.objects.all()[0:7], 5, count='estimated').count, 7)
+
+            # no estimate - exact count
+            estimator.return_value = None
+            self.assertEqual(CountPaginator(
+                Model.objects.all(), 5, count='estimated').count, 23)
+
+    def test_estimated_count_out_of_range(self):
+        # estimated count is not used for clamping: page after estimated
+        # last page is sliced, empty one is replaced by estimated last page
+        queryset = Model.objects.order_by('slug')
+        estimator = mock.Mock(return_value=10)
+        with mock.patch.dict(count_module.ESTIMATORS,
+                             {connection.vendor: estimator}):
+            with self.assertNumQueries(1):
+                page = paginator(queryset, 4, per_page=5, count='estimated')
+                self.assertEqual([i.slug for i in page][0], 's15')
+            self.assertEqual(page.number, 4)
+            self.assertEqual(page.pagination.num_pages, 4)
+
+            with self.assertNumQueries(2):
+                page = paginator(queryset, 99999, per_page=5,
+                                 count='estimated')
+                self.assertEqual([i.slug for i in page][0], 's05')
+            self.assertEqual(page.number, 2)
+
+            with self.assertRaises(EmptyPage):
+                CountPaginator(queryset, 5, count='exact').page(6)
+
+    def test_postgresql_estimate(self):
+        # not positive reltuples (never analyzed table) is unknown
+        connection = mock.MagicMock()
+        cursor = connection.cursor.return_value.__enter__.return_value
+        for reltuples, expected in ((1500.0, 1500,), (0.0, None,),
+                                    (-1.0, None,), (None, None,),):
+            cursor.fetchone.return_value = (
+                None if reltuples is None else (reltuples,))
+            self.assertEqual(count_module.get_postgresql_estimate(
+                Model.objects.all(), connection), expected)
+
+    def test_out_of_range(self):
+        queryset = Model.objects.order_by('slug')
+
+        # count and one slice query, page number is clamped
+        with self.assertNumQueries(2):
+            page = paginator(queryset, 99999, per_page=5)
+            self.assertEqual(page.number, 5)
+            self.assertEqual([i.slug for i in page], ['s20', 's21', 's22'])
+        with self.assertNumQueries(2):
+            page = paginator(queryset, 99999, per_page=5, clamp=False)
+            self.assertEqual(page.number, 5)
+            self.assertEqual(len(page.object_list), 3)
+
+        # cached count: only slice query
+        paginator(queryset, 2, per_page=5, count='cached')
+        with self.assertNumQueries(1):
+            page = paginator(queryset, 99999, per_page=5, count='cached')
+            self.assertEqual(page.number, 5)
+            self.assertEqual(len(page.object_list), 3)
+
+    def test_no_count(self):
+        queryset = Model.objects.order_by('slug')
+        with self.assertNumQueries(1):
+            page = paginator(queryset, 2, per_page=5, count=None)
+            self.assertEqual([i.slug for i in page][0], 's05')
+        self.assertTrue(page.has_next())
+        self.assertTrue(page.has_previous())
+        self.assertEqual((page.start_index(), page.end_index(),), (6, 10,))
+        self.assertEqual(page.pagination.num_pages, 3)
+        self.assertEqual(page.pagination.next, 3)
+
+        page = paginator(queryset, 5, per_page=5, count=None)
+        self.assertEqual(len(page), 3)
+        self.assertFalse(page.has_next())
+        self.assertEqual(page.pagination.num_pages, 5)
+        self.assertIsNone(page.pagination.next)
+
+        # out of range pages are empty
+        with self.assertNumQueries(1):
+            page = paginator(queryset, 99999, per_page=5, count=None)
+        self.assertEqual((len(page), page.has_next(),), (0, False,))
+
+
+class PaginationWindowTests(TestCase):
+    names = ('num_pages', 'prev', 'first', 'dots_left', 'current',
+             'dots_right', 'last', 'next',)
+
+    def test_same_as_pagination(self):
+        for pages in range(1, 12):
+            for number in range(1, pages + 1):
+                for window in (1, 2, 3,):
+                    page = {'page': number, 'pages': pages}
+                    left = Pagination(page, window=window)
+                    right = PaginationWindow(page, window=window)
+                    self.assertEqual(
+                        [getattr(left, i) for i in self.names] + [left.pages],
+                        [getattr(right, i) for i in self.names] +
+                        [[i._asdict() for i in right.pages]])
+
+    def test_cache_and_immutability(self):
+        window = PaginationWindow({'page': 3, 'count': 95, 'perpage': 10})
+        self.assertIs(window, PaginationWindow.get(3, 10, 2))
+        self.assertIs(window, PaginationWindow({'page': 3, 'pages': 10},
+                                               window=2))
+        self.assertIsNot(window, PaginationWindow.get(3, 10, 3))
+        self.assertRaises(AttributeError, setattr, window, 'number', 4)
+        self.assertRaises(AttributeError, setattr, window, 'other', 4)
+        self.assertFalse(hasattr(window, '__dict__'))
+
+        for i in range(3):
+            Model.objects.create(title='t', slug='s%s' % i)
+        page = paginator(Model.objects.all(), 2, per_page=1,
+                         pagination=PaginationWindow)
+        self.assertIs(page.pagination, PaginationWindow.get(2, 3, 2))
+        self.assertEqual([(i.number, i.current,) for i in page.pagination.pages],
+                         [(1, False,), (2, True,), (3, False,)])